@@ -2,7 +2,8 @@ const ENABLE_LOGGING = true;
 const API_URLS = {
   extractAllCategories: "https://color-extraction-api.onrender.com/extract_all_categories",
   arrowCheckBulk: "https://color-extraction-api.onrender.com/arrow_check_bulk",
-  cropAllDecisionIcons: "https://color-extraction-api.onrender.com/crop_all_decision_icons"
+  cropAllDecisionIcons: "https://color-extraction-api.onrender.com/crop_all_decision_icons",
+  analyzeMap: "https://color-extraction-api.onrender.com/analyze_map"
 };
 
 const pathRanges = [
@@ -230,10 +231,13 @@ function processIslandCategoriesToBackend(sheetName, imageUrl) {
   });
 
   const result = JSON.parse(response.getContentText());
-  if (!result.island_data || result.island_data.length !== 25) return;
+  writeIslandCategories(backendSheet, result.island_data);
+}
+function writeIslandCategories(backendSheet, islandData) {
+  if (!islandData || islandData.length !== 25) return;
 
-  const types = result.island_data.map(d => [d.island_type || ""]);
-  const cats = result.island_data.map(d => [d.category || ""]);
+  const types = islandData.map(d => [d.island_type || ""]);
+  const cats = islandData.map(d => [d.category || ""]);
 
   backendSheet.getRange(2, 26, 25, 1).setValues(types); // Col Z
   backendSheet.getRange(2, 3, 25, 1).setValues(cats);   // Col C
@@ -246,7 +250,10 @@ function arrowCheckBulk(sheet, imageUrl) {
     muteHttpExceptions: true
   });
   const result = JSON.parse(response.getContentText());
-  if (!result.A || !result.D) return;
+  writeArrowResults(sheet, result);
+}
+function writeArrowResults(sheet, result) {
+  if (!result || !result.A || !result.D) return;
 
   result.A.forEach((row, i) => {
     sheet.getRange(i + 2, 5).setValue(row[0] === "skip" ? "" : row[0]);
@@ -260,7 +267,6 @@ function arrowCheckBulk(sheet, imageUrl) {
 function populateDecisionIcons(imageUrl, realmSheet) {
   const backendSheet = getBackendSheet(realmSheet.getName());
   const categories = backendSheet.getRange("C2:C26").getValues().flat();
-  const ids = [];
   const response = UrlFetchApp.fetch(API_URLS.cropAllDecisionIcons, {
     method: "post",
     contentType: "application/json",
@@ -268,12 +274,15 @@ function populateDecisionIcons(imageUrl, realmSheet) {
     muteHttpExceptions: true
   });
   const result = JSON.parse(response.getContentText());
-  if (!result.icons || result.icons.length !== 25) return;
+  writeDecisionIcons(backendSheet, realmSheet, result.icons);
+}
+function writeDecisionIcons(backendSheet, realmSheet, icons) {
+  if (!icons || icons.length !== 25) return;
 
-  const labels = result.icons.map(i => [i.left.label, i.right.label]);
+  const labels = icons.map(i => [i.left.label, i.right.label]);
   backendSheet.getRange("AA2:AB26").setValues(labels);
 
-  result.icons.forEach((i, idx) => {
+  icons.forEach((i, idx) => {
     if (i.left.base64) insertImage(realmSheet, layout.leftIconCells[idx], i.left.base64, i.left.id);
     if (i.right.base64) insertImage(realmSheet, layout.rightIconCells[idx], i.right.base64, i.right.id);
   });
@@ -288,7 +297,20 @@ function getMapAndProcessAll() {
 
   if (!backend || !url) return;
 
-  processIslandCategoriesToBackend(sheetName, url);
-  arrowCheckBulk(backend, url);
-  populateDecisionIcons(url, sheet);
+  // One request: the map is downloaded and decoded once for all three stages.
+  const response = UrlFetchApp.fetch(API_URLS.analyzeMap, {
+    method: "post",
+    contentType: "application/json",
+    payload: JSON.stringify({ image_url: url }),
+    muteHttpExceptions: true
+  });
+  const result = JSON.parse(response.getContentText());
+  if (result.error) {
+    log(`❌ analyze_map failed: ${result.error}`);
+    return;
+  }
+
+  writeIslandCategories(backend, result.island_data);
+  writeArrowResults(backend, result.arrows);
+  writeDecisionIcons(backend, sheet, result.icons);
 }
\ No newline at end of file
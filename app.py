@@ -1,353 +1,189 @@
-from flask import Flask, request, jsonify, send_file
-import requests
-from PIL import Image, ImageDraw, ImageChops
-import io
-import glob
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
+from PIL import ImageChops
 import os
-import base64
-from skimage.metrics import structural_similarity as ssim
+import json
+import time
 from collections import OrderedDict
 from priority_cache_manager import PriorityCacheManager
-import cv2
+from crop_geometry import crop_diamond_at, crop_circle_at, scaled_radius, DIAMOND_RADIUS, SMALL_DIAMOND_RADIUS, CIRCLE_RADIUS
+from single_flight import SingleFlight
+import batch_worker
+from worker_pool import PriorityExecutor, Overloaded, DEFAULT_WORKERS
+from crop_artifacts import CropOutput
+from result_cache import ResultCache
+from warm_up import WarmUp
+import metrics
+import request_profiler
+from request_profiler import RequestProfiler
+from region_memo import RegionMemo
+from sampling_plan import compile_island_plan, compile_arrow_plan, freeze_centers, pixel_rgb
+from map_analysis import (
+    REFERENCE_IMAGE_SIZE, CONFIDENCE_THRESHOLD_CIRCLE, CONFIDENCE_THRESHOLD_DIAMOND, icon_points, palette,
+    closest_color, MINION_RULE, DEFAULT_CENTERS, COMBAT_POINTS, ARROW_POINTS_A, ARROW_POINTS_D, image_fetcher,
+    map_store, priority_cache, crop_store, download_flight, decode_stats, download_image, get_image_scale,
+    template_banks, bank_for, crops_available,
+    find_best_match_icon, SHIFT_SEARCH_MODE, PREFILTER_TOP_K, PREFILTER_MARGIN, SSIM_RESOLUTION, best_shifted_match,
+    classify_islands, check_arrows, match_decision_icons, region_context, analyze_map, load_banks
+)
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from PIL import ImageEnhance
-
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 app = Flask(__name__)
 
-REFERENCE_IMAGE_SIZE = 2810
-CONFIDENCE_THRESHOLD_CIRCLE = 0.85
-CONFIDENCE_THRESHOLD_DIAMOND = 0.89
-
-RAW_COLOR_MAP = {
-    "#F156FF": "decision",
-    "#2DB38F": "easy",
-    "#ECD982": "medium",
-    "#F07E5F": "hard",
-    "#9843C6": "portal",
-    "#CA3B5F": "arrival",
-    "#D7995B": "bronze door",
-    "#EAE9E8": "silver door",
-    "#FFDF33": "gold door",
-    "#6D6DE5": "shop",
-    "#697785": "time lock",
-    "#E58F16": "boss"
-}
-
-COLOR_MAP = {k.upper(): v for k, v in RAW_COLOR_MAP.items()}
-
-islandCenters = [
-    { "bgX": 1404.5, "bgY": 343.5 },
-    { "bgX": 1140.5, "bgY": 607.5 },
-    { "bgX": 1668.5, "bgY": 607.5 },
-    { "bgX": 876.5, "bgY": 871.5 },
-    { "bgX": 1404.5, "bgY": 871.5 },
-    { "bgX": 1932.5, "bgY": 871.5 },
-    { "bgX": 612.5, "bgY": 1135.5 },
-    { "bgX": 1140.5, "bgY": 1135.5 },
-    { "bgX": 1668.5, "bgY": 1135.5 },
-    { "bgX": 2196.5, "bgY": 1136.0 },
-    { "bgX": 348.5, "bgY": 1399.5 },
-    { "bgX": 876.5, "bgY": 1399.5 },
-    { "bgX": 1404.5, "bgY": 1399.5 },
-    { "bgX": 1932.5, "bgY": 1399.0 },
-    { "bgX": 2460.5, "bgY": 1400.0 },
-    { "bgX": 612.5, "bgY": 1663.5 },
-    { "bgX": 1140.5, "bgY": 1663.0 },
-    { "bgX": 1668.5, "bgY": 1663.5 },
-    { "bgX": 2196.5, "bgY": 1663.0 },
-    { "bgX": 876.5, "bgY": 1927.5 },
-    { "bgX": 1404.5, "bgY": 1927.5 },
-    { "bgX": 1932.5, "bgY": 1928.0 },
-    { "bgX": 1140.5, "bgY": 2191.5 },
-    { "bgX": 1668.5, "bgY": 2192.0 },
-    { "bgX": 1404.5, "bgY": 2455.5 }
-]
-combatTypePoints = [
-    {"bossX": 1406, "bossY": 170, "minionX": 1404, "minionY": 494},
-    {"bossX": 1142, "bossY": 434, "minionX": 1140, "minionY": 758},
-    {"bossX": 1670, "bossY": 434, "minionX": 1668, "minionY": 758},
-    {"bossX": 878, "bossY": 698, "minionX": 876, "minionY": 1022},
-    {"bossX": 1406, "bossY": 698, "minionX": 1404, "minionY": 1022},
-    {"bossX": 1934, "bossY": 698, "minionX": 1932, "minionY": 1022},
-    {"bossX": 614, "bossY": 962, "minionX": 612, "minionY": 1286},
-    {"bossX": 1142, "bossY": 962, "minionX": 1140, "minionY": 1286},
-    {"bossX": 1670, "bossY": 962, "minionX": 1668, "minionY": 1286},
-    {"bossX": 2199, "bossY": 963, "minionX": 2196, "minionY": 1287},
-    {"bossX": 350, "bossY": 1225, "minionX": 348, "minionY": 1550},
-    {"bossX": 878, "bossY": 1225, "minionX": 876, "minionY": 1550},
-    {"bossX": 1406, "bossY": 1226, "minionX": 1404, "minionY": 1550},
-    {"bossX": 1934, "bossY": 1226, "minionX": 1932, "minionY": 1549},
-    {"bossX": 2462, "bossY": 1226, "minionX": 2460, "minionY": 1550},
-    {"bossX": 614, "bossY": 1489, "minionX": 612, "minionY": 1814},
-    {"bossX": 1142, "bossY": 1489, "minionX": 1140, "minionY": 1813},
-    {"bossX": 1670, "bossY": 1489, "minionX": 1668, "minionY": 1814},
-    {"bossX": 2199, "bossY": 1489, "minionX": 2196, "minionY": 1813},
-    {"bossX": 878, "bossY": 1753, "minionX": 876, "minionY": 2077},
-    {"bossX": 1406, "bossY": 1753, "minionX": 1404, "minionY": 2077},
-    {"bossX": 1934, "bossY": 1754, "minionX": 1932, "minionY": 2079},
-    {"bossX": 1142, "bossY": 2017, "minionX": 1140, "minionY": 2340},
-    {"bossX": 1670, "bossY": 2018, "minionX": 1668, "minionY": 2341},
-    {"bossX": 1406, "bossY": 2281, "minionX": 1404, "minionY": 2603}
-]
-arrowPointsA = [
-    'x',
-    'x',
-    [[1558, 497], [1515, 454]],
-    'x',
-    [[1294, 761], [1251, 718]],
-    [[1822, 761], [1779, 718]],
-    'x',
-    [[1030, 1025], [987, 982]],
-    [[1558, 1025], [1515, 982]],
-    [[2086, 1025], [2043, 982]],
-    'x',
-    [[766, 1289], [723, 1246]],
-    [[1294, 1289], [1251, 1246]],
-    [[1822, 1289], [1779, 1246]],
-    [[2350, 1289], [2307, 1246]],
-    [[502, 1553], [459, 1510]],
-    [[1030, 1553], [987, 1510]],
-    [[1558, 1553], [1515, 1510]],
-    [[2086, 1553], [2043, 1510]],
-    [[766, 1817], [723, 1774]],
-    [[1294, 1817], [1251, 1774]],
-    [[1822, 1817], [1779, 1774]],
-    [[1030, 2081], [987, 2038]],
-    [[1558, 2081], [1515, 2038]],
-    [[1294, 2345], [1251, 2302]]
-]
-arrowPointsD = [
-    'x',
-    [[1251, 497], [1294, 454]],
-    'x',
-    [[987, 761], [1030, 718]],
-    [[1515, 761], [1558, 718]],
-    'x',
-    [[723, 1025], [766, 982]],
-    [[1251, 1025], [1294, 982]],
-    [[1779, 1025], [1822, 982]],
-    'x',
-    [[459, 1289], [502, 1246]],
-    [[987, 1289], [1030, 1246]],
-    [[1515, 1289], [1558, 1246]],
-    [[2043, 1289], [2086, 1246]],
-    'x',
-    [[723, 1553], [766, 1510]],
-    [[1251, 1553], [1294, 1510]],
-    [[1779, 1553], [1822, 1510]],
-    [[2307, 1553], [2350, 1510]],
-    [[987, 1817], [1030, 1774]],
-    [[1515, 1817], [1558, 1774]],
-    [[2043, 1817], [2086, 1774]],
-    [[1251, 2081], [1294, 2038]],
-    [[1779, 2081], [1822, 2038]],
-    [[1515, 2345], [1558, 2302]]
-]
-
-icon_points = [
-            { "leftX": 1304, "leftY": 343, "rightX": 1504, "rightY": 343 },
-            { "leftX": 1040, "leftY": 607, "rightX": 1240, "rightY": 607 },
-            { "leftX": 1570, "leftY": 607, "rightX": 1770, "rightY": 607 },
-            { "leftX": 776, "leftY": 871, "rightX": 976, "rightY": 871 },
-            { "leftX": 1304, "leftY": 871, "rightX": 1504, "rightY": 871 },
-            { "leftX": 1832, "leftY": 871, "rightX": 2032, "rightY": 871 },
-            { "leftX": 512, "leftY": 1135, "rightX": 712, "rightY": 1135 },
-            { "leftX": 1040, "leftY": 1135, "rightX": 1240, "rightY": 1135 },
-            { "leftX": 1570, "leftY": 1135, "rightX": 1770, "rightY": 1135 },
-            { "leftX": 2098, "leftY": 1135, "rightX": 2298, "rightY": 1135 },
-            { "leftX": 248, "leftY": 1399, "rightX": 448, "rightY": 1399 },
-            { "leftX": 776, "leftY": 1399, "rightX": 976, "rightY": 1399 },
-            { "leftX": 1304, "leftY": 1399, "rightX": 1504, "rightY": 1399 },
-            { "leftX": 1832, "leftY": 1399, "rightX": 2032, "rightY": 1399 },
-            { "leftX": 2360, "leftY": 1399, "rightX": 2560, "rightY": 1399 },
-            { "leftX": 512, "leftY": 1663, "rightX": 712, "rightY": 1663 },
-            { "leftX": 1040, "leftY": 1663, "rightX": 1240, "rightY": 1663 },
-            { "leftX": 1570, "leftY": 1663, "rightX": 1770, "rightY": 1663 },
-            { "leftX": 2098, "leftY": 1663, "rightX": 2298, "rightY": 1663 },
-            { "leftX": 776, "leftY": 1927, "rightX": 976, "rightY": 1927 },
-            { "leftX": 1304, "leftY": 1927, "rightX": 1504, "rightY": 1927 },
-            { "leftX": 1832, "leftY": 1927, "rightX": 2032, "rightY": 1927 },
-            { "leftX": 1040, "leftY": 2191, "rightX": 1240, "rightY": 2191 },
-            { "leftX": 1570, "leftY": 2191, "rightX": 1770, "rightY": 2191 },
-            { "leftX": 1304, "leftY": 2455, "rightX": 1504, "rightY": 2455 }
-        ]
-
-door_categories = {"bronze door", "silver door", "door", "gold door", "time lock"}
-symbol_categories = {"portal", "arrival", "shop"}
-ssim_categories = {"decision"}
-image_categories = {"battle", "boss"}
-
-def preprocess_crop(crop, size=(118, 118)):
-    enhancer = ImageEnhance.Contrast(crop.convert("L"))
-    boosted = enhancer.enhance(1.5)  # increase contrast
-    return boosted.resize(size)
-
-def enhance_contrast(img, factor=1.5):
-    return ImageEnhance.Contrast(img).enhance(factor)
-
-def hex_to_rgb(hex_color):
-    return tuple(int(hex_color[i:i+2], 16) for i in (1, 3, 5))
-
-def color_distance(c1, c2):
-    return sum((a - b) ** 2 for a, b in zip(c1, c2)) ** 0.5
-
-def closest_color(pixel):
-    closest_hex = None
-    closest_dist = float("inf")
-
-    for hex_code in COLOR_MAP.keys():
-        color_rgb = hex_to_rgb(hex_code)
-        dist = color_distance(pixel, color_rgb)
-        if dist < closest_dist:
-            closest_dist = dist
-            closest_hex = hex_code
-
-    if closest_dist < 20:
-        return closest_hex  # fuzzy match accepted
-
-    # No acceptable match — return exact color as hex
-    return "#{:02X}{:02X}{:02X}".format(pixel[0], pixel[1], pixel[2])
-
-priority_cache = PriorityCacheManager(original_capacity=6, scaled_capacity=6)
-
-CANNOT_BE_MINION_COLORS = {
-    "#2DB38F",  # Easy
-    "#ECD982",  # Medium
-    "#F07E5F"   # Hard
-}
-
-MONSTER_HEX = "#262B34"  # Dark fallback (Monster)
-MONSTER_THRESHOLD = 10  # Allow fuzzy match within distance 10
-def is_monster_color(pixel_hex):
-    pixel_rgb = hex_to_rgb(pixel_hex)
-    monster_rgb = hex_to_rgb(MONSTER_HEX)
-    return color_distance(pixel_rgb, monster_rgb) <= MONSTER_THRESHOLD
-
-def is_minion_color(pixel_hex):
-    if pixel_hex.upper() in CANNOT_BE_MINION_COLORS or is_monster_color(pixel_hex):
-        return False
-    return True
-
-def download_image(image_url):
-    cached_image = priority_cache.get_original(image_url)
-    if cached_image:
-        print(f"Using cached original for {image_url}")
-        return cached_image
-
-    response = requests.get(image_url)
-    if response.status_code != 200:
-        raise Exception(f"Cloudinary returned error {response.status_code}.")
-
-    img = Image.open(io.BytesIO(response.content)).convert("RGBA")
-    priority_cache.store_original(image_url, img)  # Auto-tracks batch/type if present
-    return img
-
-def get_image_scale(image):
-    return image.width / REFERENCE_IMAGE_SIZE
-
-def preload_er_icon_templates(directories, er_scaled_size=118):
-    templates = {}
-    for directory in directories:
-        for file in glob.glob(f"{directory}/*.png"):
-            img_pil = Image.open(file).convert("L")
-            img_np = np.array(img_pil)  # full-size 200px
-
-            scaled_img = img_pil.resize((er_scaled_size, er_scaled_size))
-            scaled_array = np.array(scaled_img)
-
-            name = os.path.basename(file).split(".")[0]
-            templates[name] = {
-                "original": img_np,
-                "er_scaled": scaled_array
-            }
-    
-    print(f"[TEMPLATE LOAD] Loaded template: {name} from {file}")
-    return templates
-
-
-
-icon_templates = preload_er_icon_templates(["iconsER"], er_scaled_size=118)
-
-def image_similarity_ssim(img1, img2):
-    img1_gray = np.array(img1.convert("L"))
-    img2_gray = np.array(img2.convert("L").resize(img1.size))
-    score, _ = ssim(img1_gray, img2_gray, full=True)
-    return score
-
-def find_best_match_icon(preprocessed_img, threshold=0.85):
-    img_array = np.array(preprocessed_img)
-    best_score = -1
-    best_name = "other"
+# Shared by every request: "point" (single-pixel and probe queries) is served
+# before "bulk" (icon matching); a full lane answers 429 instead of queueing.
+worker_pool = PriorityExecutor(
+    workers=int(os.environ.get("WORKER_THREADS", DEFAULT_WORKERS)),
+    reserved=int(os.environ.get("WORKER_RESERVED_POINT", 1)),
+    lane_limits={
+        "point": int(os.environ.get("WORKER_QUEUE_POINT", 100)),
+        "bulk": int(os.environ.get("WORKER_QUEUE_BULK", 200))
+    }
+)
 
-    for name in sorted(icon_templates.keys()):
-        template_array = icon_templates[name]["er_scaled"]
-        score = ssim(img_array, template_array)
-        if score > best_score:
-            best_score = score
-            best_name = name
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
 
-    return {
-        "label": best_name if best_score >= threshold else "other",
-        "score": best_score
+def request_image_url():
+    image_url = request.args.get("image_url")
+    if image_url is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            image_url = data.get("image_url")
+    return image_url if isinstance(image_url, str) else None
+
+@app.before_request
+def start_request_metrics():
+    # Labels for every stage timed while serving this request, worker threads included
+    _, map_type = PriorityCacheManager.parse_batch_and_type(request_image_url() or "")
+    labels = {
+        "endpoint": request.url_rule.rule if request.url_rule else "unmatched",
+        "map_type": metrics.map_type_label(map_type)
     }
+    g.metric_labels = labels
+    g.metric_token = metrics.request_labels.set(labels)
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    labels = g.get("metric_labels")
+    if labels is not None and labels["endpoint"] != "/metrics":
+        metrics.request_seconds.observe(time.perf_counter() - g.request_started,
+                                        labels["endpoint"], labels["map_type"], str(response.status_code))
+    return response
+
+@app.teardown_request
+def reset_request_metrics(exc=None):
+    token = g.pop("metric_token", None)
+    if token is not None:
+        metrics.request_labels.reset(token)
+
+profiler = RequestProfiler(
+    secret=os.environ.get("PROFILE_SECRET"),
+    max_profiles=int(os.environ.get("PROFILE_MAX_STORED", 50)),
+    top=int(os.environ.get("PROFILE_TOP_FUNCTIONS", 25))
+)
+
+@app.before_request
+def start_request_profile():
+    if not profiler.wants_profile(request.args, request.headers):
+        return
+    g.profile = profiler.start(request.method, request.path)
+    g.profile_token = request_profiler.current_profile.set(g.profile)
+
+@app.after_request
+def attach_request_profile(response):
+    profile = g.get("profile")
+    if profile is None:
+        return response
+    profile.status_code = response.status_code
+    response.headers["X-Profile-Id"] = profile.id
+    response.headers["X-Profile-Url"] = f"/profiles/{profile.id}"
+    stages = profile.stage_times()
+    if stages and not response.is_streamed:
+        response.headers["Server-Timing"] = ", ".join(f"{name};dur={entry['total_ms']}" for name, entry in stages.items())
+    # Streamed bodies (NDJSON) are still being produced; stop profiling once sent
+    g.profile_closing = True
+    response.call_on_close(lambda: profiler.finish(profile))
+    return response
+
+@app.teardown_request
+def reset_request_profile(exc=None):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+    request_profiler.current_profile.reset(g.pop("profile_token"))
+    if not g.get("profile_closing"):
+        profiler.finish(profile)
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    if not profiler.enabled:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    if not profiler.authorized(request.headers.get("X-Profile-Token") or request.args.get("profile_token")):
+        return jsonify({"error": "Invalid profile token"}), 403
+    summary = profiler.get(profile_id)
+    if summary is None:
+        return jsonify({"error": "Unknown or expired profile id"}), 404
+    return jsonify(summary)
+
+# Concurrent requests for the same map share one analysis
+analysis_flight = SingleFlight("analysis")
+
+# Endpoints that only read a few pixels get a "probe" decode
+PROBE_ENDPOINTS = {"/extract_color", "/check_minion", "/extract_all_categories", "/arrow_check_bulk"}
+
+def download_for_request(image_url):
+    # The decode the current route needs
+    need = "probe" if request.url_rule is not None and request.url_rule.rule in PROBE_ENDPOINTS else "full"
+    return download_image(image_url, need)
+
+# Finished results per (map content, endpoint, parameters); a different template
+# bank makes them stale
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+)
+
+def cached_result(endpoint, img, params, compute, validate=None, templates=False):
+    # templates=True for results that depend on icon matching: the bank version
+    # joins the key, so recompiled icons never serve old matches
+    if templates:
+        params = {**params, "bank": bank_for(img).version}
+        if bank_for(img).prefilter(PREFILTER_TOP_K).active:
+            params["prefilter"] = [PREFILTER_TOP_K, PREFILTER_MARGIN]
+        if SSIM_RESOLUTION != "template":
+            params["resolution"] = SSIM_RESOLUTION
+    if getattr(img, "reduced", 1) > 1:
+        # Draft-decoded probes may read slightly different pixels than full ones
+        params = {**params, "reduced": img.reduced}
+    return result_cache.get_or_compute(endpoint, getattr(img, "content_hash", None), params, compute, validate)
+
+def normalize_categories(categories):
+    return [c.strip().lower() for c in categories] if categories else None
 
-def best_shifted_match(x, y, image, threshold=0.85):
-    scale = get_image_scale(image)
-    scaled_x = int(x * scale)
-    scaled_y = int(y * scale)
-    radius = int(100 * scale)
-
-    best_result = {"label": "other", "score": -1, "base64": ""}
-    best_crop = None
-
-    def crop_and_match(dx, dy):
-        cx, cy = scaled_x + dx, scaled_y + dy
-        crop_coords = [
-            (cx, cy - radius), (cx - radius, cy),
-            (cx, cy + radius), (cx + radius, cy)
-        ]
-        mask = Image.new("L", image.size, 0)
-        ImageDraw.Draw(mask).polygon(crop_coords, fill=255)
-        cropped = Image.composite(image, Image.new("RGBA", image.size, (0, 0, 0, 0)), mask).crop(
-            (cx - radius, cy - radius, cx + radius, cy + radius)
-        )
-        pre = preprocess_crop(cropped)  # grayscale + contrast + resize
-        match = find_best_match_icon(pre, threshold)
-        return match, cropped
-
-    for dx in [-2, -1, 0, 1, 2]:
-        for dy in [-2, -1, 0, 1, 2]:
-            match, cropped = crop_and_match(dx, dy)
-            if match["score"] > best_result["score"]:
-                best_result = match
-                best_crop = cropped
-
-    if best_crop:
-        best_result["base64"] = image_to_base64(best_crop)
-
-    return best_result
-
-
-def image_to_base64(img):
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
 @app.route('/extract_color', methods=['GET'])
 def extract_color():
     image_url = request.args.get("image_url")
     x, y = int(request.args.get("x", 0)), int(request.args.get("y", 0))
 
-    try:
-        image = download_image(image_url)
+    def sample(image):
         scale_factor = get_image_scale(image)
-        pixel = image.getpixel((int(x * scale_factor), int(y * scale_factor)))
+        pixel = pixel_rgb(image, (int(x * scale_factor), int(y * scale_factor)))
+        return closest_color(pixel)
 
-        color_result = closest_color(pixel)
+    try:
+        # Downloads stay on the request thread; only the pixel work uses a worker
+        color_result = worker_pool.run("point", sample, download_for_request(image_url))
         return jsonify({"hex": color_result})
 
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)})
 
@@ -356,14 +192,16 @@ def check_minion():
     image_url = request.args.get("image_url")
     x, y = int(request.args.get("x", 0)), int(request.args.get("y", 0))
 
-    try:
-        image = download_image(image_url)
+    def sample(image):
         scale_factor = get_image_scale(image)
-        pixel = image.getpixel((int(x * scale_factor), int(y * scale_factor)))
-        pixel_hex = "#{:02X}{:02X}{:02X}".format(pixel[0], pixel[1], pixel[2])
+        pixel = pixel_rgb(image, (int(x * scale_factor), int(y * scale_factor)))
+        return bool(MINION_RULE.evaluate(np.array([pixel[:3]]))[0])
 
-        return jsonify({"minion": is_minion_color(pixel_hex)})
+    try:
+        return jsonify({"minion": worker_pool.run("point", sample, download_for_request(image_url))})
 
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)})
 
@@ -373,74 +211,18 @@ def extract_all_categories():
         data = request.get_json()
         image_url = data.get("image_url")
         customCenters = data.get("islandCenters")
-        centers_to_use = customCenters if customCenters else islandCenters
 
         if not image_url:
             return jsonify({"error": "Missing image_url"}), 400
 
-        img = download_image(image_url)
-        scale = get_image_scale(img)
-
-        def process_island(i, center):
-            try:
-                x_scaled = int(center["bgX"] * scale)
-                y_scaled = int(center["bgY"] * scale)
-                pixel = img.getpixel((x_scaled, y_scaled))
-                matched_hex = closest_color(pixel[:3])
-                island_type = COLOR_MAP.get(matched_hex, "Void") if matched_hex else "Void"
-
-                boss_x = int(combatTypePoints[i]["bossX"] * scale)
-                boss_y = int(combatTypePoints[i]["bossY"] * scale)
-                boss_pixel = img.getpixel((boss_x, boss_y))
-                boss_hex = "#{:02X}{:02X}{:02X}".format(*boss_pixel[:3])
-
-                minion_x = int(combatTypePoints[i]["minionX"] * scale)
-                minion_y = int(combatTypePoints[i]["minionY"] * scale)
-                minion_pixel = img.getpixel((minion_x, minion_y))
-                minion_hex = "#{:02X}{:02X}{:02X}".format(*minion_pixel[:3])
-
-                combat_type_helper = "None"
-                if boss_hex.upper() == "#E58F16":
-                    combat_type_helper = "boss"
-                elif is_minion_color(minion_hex):
-                    combat_type_helper = "minion"
-
-                lower_type = island_type.lower()
-                if lower_type in ["easy", "medium", "hard"]:
-                    category = combat_type_helper if combat_type_helper != "None" else "battle"
-                elif lower_type == "decision":
-                    category = "decision"
-                elif lower_type == "shop":
-                    category = "shop"
-                elif lower_type in ["portal", "arrival"]:
-                    category = "portal"
-                elif lower_type in ["bronze door", "silver door", "gold door", "time lock"]:
-                    category = "door"
-
-                else:
-                    category = "Void"
-
-                print(f"Island {i+1} RGB: {pixel}, Closest Hex: {matched_hex}, Matched Type: {island_type}")
-
-                return {
-                    "index": i + 1,
-                    "island_type": island_type,
-                    "category": category
-                }
-
-            except Exception as inner_e:
-                print(f"Error processing island {i+1}: {str(inner_e)}")
-                return {"index": i + 1, "island_type": "Void", "category": "Void"}
-
-        results = []
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            futures = [executor.submit(process_island, i, center) for i, center in enumerate(centers_to_use)]
-            for f in as_completed(futures):
-                results.append(f.result())
-
-        results.sort(key=lambda x: x["index"])
-        return jsonify({"island_data": results})
+        img = download_for_request(image_url)
+        params = {"centers": freeze_centers(customCenters) if customCenters else None}
+        island_data = cached_result("extract_all_categories", img, params,
+                                    lambda: worker_pool.run("point", classify_islands, img, customCenters))
+        return jsonify({"island_data": island_data})
 
+    except Overloaded:
+        raise
     except Exception as e:
         print("ERROR:", str(e))
         return jsonify({"error": str(e)}), 500
@@ -454,22 +236,14 @@ def crop_circle():
         image = download_image(image_url)
         scale_factor = get_image_scale(image)
         x_scaled, y_scaled = int(x * scale_factor), int(y * scale_factor)
-        radius = int(24 * scale_factor)
-
-        mask = Image.new("L", image.size, 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((x_scaled - radius, y_scaled - radius, x_scaled + radius, y_scaled + radius), fill=255)
+        radius = scaled_radius(CIRCLE_RADIUS, scale_factor)
 
-        cropped_img = Image.composite(image, Image.new("RGBA", image.size, (0,0,0,0)), mask).crop(
-            (x_scaled - radius, y_scaled - radius, x_scaled + radius, y_scaled + radius))
+        cropped_img = crop_circle_at(image, x_scaled, y_scaled, radius)
 
-        label = find_best_match_icon(cropped_img, CONFIDENCE_THRESHOLD_CIRCLE)
-        output = io.BytesIO()
-        cropped_img.save(output, format="PNG")
-        image_base64 = base64.b64encode(output.getvalue()).decode("utf-8")
+        label = find_best_match_icon(cropped_img, CONFIDENCE_THRESHOLD_CIRCLE, bank_for(image).matcher)
         priority_cache.store_scaled(image_url, 48, cropped_img)  # assuming 48px target scale for small crops
 
-        return jsonify({"label": label, "base64": image_base64})
+        return jsonify({"label": label, **crop_store.render(cropped_img, CropOutput.from_request(data))})
 
     except Exception as e:
         return jsonify({"error": str(e)})
@@ -483,32 +257,18 @@ def crop_diamond():
         image = download_image(image_url)
         scale_factor = get_image_scale(image)
         scaled_x, scaled_y = int(x * scale_factor), int(y * scale_factor)
-        radius = int(100 * scale_factor)
-
-        crop_coords = [
-            (scaled_x, scaled_y - radius), (scaled_x - radius, scaled_y),
-            (scaled_x, scaled_y + radius), (scaled_x + radius, scaled_y)
-        ]
-
-        mask = Image.new("L", image.size, 0)
-        ImageDraw.Draw(mask).polygon(crop_coords, fill=255)
+        radius = scaled_radius(DIAMOND_RADIUS, scale_factor)
 
-        cropped_img = Image.composite(image, Image.new("RGBA", image.size, (0, 0, 0, 0)), mask).crop(
-            (scaled_x - radius, scaled_y - radius, scaled_x + radius, scaled_y + radius)
-        )
+        cropped_img = crop_diamond_at(image, scaled_x, scaled_y, radius)
 
         # Get label from icon matching
-        label = find_best_match_icon(cropped_img, CONFIDENCE_THRESHOLD_DIAMOND)
-
-        output = io.BytesIO()
-        cropped_img.save(output, format="PNG")
-        image_base64 = base64.b64encode(output.getvalue()).decode("utf-8")
+        label = find_best_match_icon(cropped_img, CONFIDENCE_THRESHOLD_DIAMOND, bank_for(image).matcher)
 
         scale = image.width / 2810
         priority_cache.store_scaled(image_url, scale, cropped_img)
 
         return jsonify({
-            "base64": image_base64,
+            **crop_store.render(cropped_img, CropOutput.from_request(data)),
             "label": label
         })
 
@@ -520,19 +280,9 @@ def crop_diamond_to_file(image_url, x, y, output_path="diamond_crop.png"):
         img = download_image(image_url)
         scale_factor = get_image_scale(img)
         scaled_x, scaled_y = int(x * scale_factor), int(y * scale_factor)
-        radius = int(100 * scale_factor)
-
-        crop_coords = [
-            (scaled_x, scaled_y - radius), (scaled_x - radius, scaled_y),
-            (scaled_x, scaled_y + radius), (scaled_x + radius, scaled_y)
-        ]
+        radius = scaled_radius(DIAMOND_RADIUS, scale_factor)
 
-        mask = Image.new("L", img.size, 0)
-        ImageDraw.Draw(mask).polygon(crop_coords, fill=255)
-
-        cropped_img = Image.composite(img, Image.new("RGBA", img.size, (0, 0, 0, 0)), mask).crop(
-            (scaled_x - radius, scaled_y - radius, scaled_x + radius, scaled_y + radius)
-        )
+        cropped_img = crop_diamond_at(img, scaled_x, scaled_y, radius)
 
         cropped_img.save(output_path)
         return f"Saved diamond crop to {output_path}"
@@ -548,24 +298,11 @@ def crop_small_diamond():
         image = download_image(image_url)
         scale_factor = get_image_scale(image)
         x_scaled, y_scaled = int(x * scale_factor), int(y * scale_factor)
-        offset = int(32 * scale_factor)
-
-        crop_coords = [
-            (x_scaled, y_scaled - offset), (x_scaled - offset, y_scaled),
-            (x_scaled, y_scaled + offset), (x_scaled + offset, y_scaled)
-        ]
+        offset = scaled_radius(SMALL_DIAMOND_RADIUS, scale_factor)
 
-        mask = Image.new("L", image.size, 0)
-        ImageDraw.Draw(mask).polygon(crop_coords, fill=255)
+        cropped_img = crop_diamond_at(image, x_scaled, y_scaled, offset)
 
-        cropped_img = Image.composite(image, Image.new("RGBA", image.size, (0,0,0,0)), mask).crop(
-            (x_scaled - offset, y_scaled - offset, x_scaled + offset, y_scaled + offset))
-
-        output = io.BytesIO()
-        cropped_img.save(output, format="PNG")
-        image_base64 = base64.b64encode(output.getvalue()).decode("utf-8")
-
-        return jsonify({"image_base64": image_base64})
+        return jsonify(crop_store.render(cropped_img, CropOutput.from_request(data), base64_key="image_base64"))
 
     except Exception as e:
         return jsonify({"error": str(e)})
@@ -579,41 +316,26 @@ def arrow_check_bulk():
         if not image_url:
             return jsonify({"error": "Missing image_url"}), 400
 
-        pointsA = arrowPointsA
-        pointsD = arrowPointsD
-
-        img = download_image(image_url)
-        scale = get_image_scale(img)
-
-        def check_color(x, y):
-            scaled_x, scaled_y = int(x * scale), int(y * scale)
-            pixel = img.getpixel((scaled_x, scaled_y))
-            hex_color = "#{:02X}{:02X}{:02X}".format(*pixel[:3])
-            accepted_colors = {
-                "#F156FF", "#FFFFFF", "#2DB38F", "#ECD982", "#E5E4E2",
-                "#FFD700", "#CD7F32", "#445566", "#F07E5F", "#EAE9E8"
-            }
-            return "arrow" if hex_color.upper() in accepted_colors else "no"
-
-        def process_arrow_pair(entry):
-            if entry == "x":
-                return ["skip", "skip"]
-            else:
-                (x1, y1), (x2, y2) = entry
-                result1 = check_color(x1, y1)
-                result2 = check_color(x2, y2)
-                return [result1, result2]
-
-        results = {
-            "A": [process_arrow_pair(entry) for entry in pointsA],
-            "D": [process_arrow_pair(entry) for entry in pointsD]
-        }
-
-        return jsonify(results)
+        img = download_for_request(image_url)
+        return jsonify(cached_result("arrow_check_bulk", img, {}, lambda: worker_pool.run("point", check_arrows, img)))
 
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Last analyzed map per (type, batch): unchanged regions of the next map reuse its results
+region_memo = RegionMemo(max_batches=int(os.environ.get("REGION_MEMO_BATCHES", 6)))
+
+def finish_regions(regions):
+    # Region report for the response; a result-cache hit computed nothing
+    if regions is None:
+        return None
+    if not regions.used:
+        return {"from_result_cache": True}
+    regions.commit()
+    return regions.report()
+
 @app.route('/crop_all_decision_icons', methods=['POST'])
 def crop_all_decision_icons():
     try:
@@ -624,81 +346,164 @@ def crop_all_decision_icons():
             return jsonify({"error": "Missing image_url"}), 400
         if not categories or len(categories) != 25:
             return jsonify({"error": "categories must be a 25-item list"}), 400
+        try:
+            output = CropOutput.from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
+        worker_pool.admit("bulk", 25)
         img = download_image(image_url)
+        params = {"categories": normalize_categories(categories), "output": output.key}
+        regions = region_memo.session(image_url, region_context(img, output))
+        icons = cached_result("crop_all_decision_icons", img, params,
+                              lambda: match_decision_icons(img, categories, output, regions, worker_pool),
+                              validate=crops_available, templates=True)
+        response = {"icons": icons}
+        if regions is not None:
+            response["regions"] = finish_regions(regions)
+        return jsonify(response)
+
+    except Overloaded:
+        raise
+    except Exception as e:
+        print("ERROR in crop_all_decision_icons:", str(e))
+        return jsonify({"error": str(e)}), 500
 
-        def crop_diamond_scaled(x, y):
-            scale = get_image_scale(img)
-            scaled_x = int(x * scale)
-            scaled_y = int(y * scale)
-            radius = int(100 * scale)
-
-            crop_coords = [
-                (scaled_x, scaled_y - radius), (scaled_x - radius, scaled_y),
-                (scaled_x, scaled_y + radius), (scaled_x + radius, scaled_y)
-            ]
-
-            mask = Image.new("L", img.size, 0)
-            ImageDraw.Draw(mask).polygon(crop_coords, fill=255)
-
-            return Image.composite(img, Image.new("RGBA", img.size, (0, 0, 0, 0)), mask).crop(
-                (scaled_x - radius, scaled_y - radius, scaled_x + radius, scaled_y + radius)
-            )
-
-        def process_icon(idx):
-            point = icon_points[idx]
-            category = categories[idx].strip().lower()
+@app.route('/analyze_map', methods=['POST'])
+def analyze_map_route():
+    try:
+        data = request.get_json()
+        image_url = data.get("image_url")
+        categories = data.get("categories")
+        customCenters = data.get("islandCenters")
+        if not image_url:
+            return jsonify({"error": "Missing image_url"}), 400
+        if categories and len(categories) != 25:
+            return jsonify({"error": "categories must be a 25-item list"}), 400
+        if customCenters and len(customCenters) != 25:
+            return jsonify({"error": "islandCenters must be a 25-item list"}), 400
+        try:
+            output = CropOutput.from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        worker_pool.admit("bulk", 25)
+        key = json.dumps({"image_url": image_url, "categories": categories, "islandCenters": customCenters,
+                          "output": output.key}, sort_keys=True)
+        params = {"categories": normalize_categories(categories),
+                  "centers": freeze_centers(customCenters) if customCenters else None, "output": output.key}
+
+        def run():
+            img = download_image(image_url)
+            regions = region_memo.session(image_url, region_context(img, output))
+            result = cached_result("analyze_map", img, params,
+                                   lambda: analyze_map(img, categories, customCenters, output, regions, worker_pool),
+                                   validate=crops_available, templates=True)
+            return result, finish_regions(regions)
+
+        result, report = analysis_flight.do(key, run)
+        if report is not None:
+            result = {**result, "regions": report}
+        return jsonify(result)
+
+    except Overloaded:
+        raise
+    except Exception as e:
+        print("ERROR in analyze_map:", str(e))
+        return jsonify({"error": str(e)}), 500
 
-            left_result = {"id": f"L{idx+1}", "label": "", "base64": ""}
-            right_result = {"id": f"R{idx+1}", "label": "", "base64": ""}
 
+@app.route('/analyze_batch', methods=['POST'])
+def analyze_batch():
+    # Body: {"maps": [url or {"image_url", "categories"?, "islandCenters"?}, ...]}
+    # ("image_urls" is accepted as an alias). Streams one NDJSON line per map in
+    # completion order, then a summary line.
+    data = request.get_json() or {}
+    maps = data.get("maps") or data.get("image_urls") or []
+    if not isinstance(maps, list) or not maps:
+        return jsonify({"error": "maps must be a non-empty list"}), 400
+    try:
+        # Worker processes have their own crop stores, so batch crops are inline only
+        output = CropOutput.from_request({**data, "inline": True}, publish=False)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    jobs = []
+    for index, entry in enumerate(maps):
+        if isinstance(entry, str):
+            entry = {"image_url": entry}
+        if not isinstance(entry, dict) or not entry.get("image_url"):
+            return jsonify({"error": f"maps[{index}] is missing image_url"}), 400
+        categories = entry.get("categories")
+        if categories and len(categories) != 25:
+            return jsonify({"error": f"maps[{index}]: categories must be a 25-item list"}), 400
+        centers = entry.get("islandCenters")
+        if centers and len(centers) != 25:
+            return jsonify({"error": f"maps[{index}]: islandCenters must be a 25-item list"}), 400
+        jobs.append((index, entry["image_url"], categories, centers))
+
+    def generate():
+        failed = 0
+        try:
+            pool = batch_worker.get_pool()
+            futures = {pool.submit(batch_worker.analyze_in_worker, url, categories, centers, output): (index, url)
+                       for index, url, categories, centers in jobs}
+        except Exception as e:
+            batch_worker.reset_pool()
+            for index, url, _, _ in jobs:
+                yield json.dumps({"index": index, "image_url": url, "error": str(e)}) + "\n"
+            yield json.dumps({"done": True, "count": len(jobs), "failed": len(jobs)}) + "\n"
+            return
+
+        for future in as_completed(futures):
+            index, url = futures[future]
             try:
-                if category in ssim_categories:
-                    left_match = best_shifted_match(point["leftX"], point["leftY"], img)
-                    right_match = best_shifted_match(point["rightX"], point["rightY"], img)
-                    left_result["label"] = left_match["label"]
-                    left_result["base64"] = left_match["base64"]
-                    right_result["label"] = right_match["label"]
-                    right_result["base64"] = right_match["base64"]
-
-
-                elif category in image_categories:
-                    left_crop = crop_diamond_scaled(point["leftX"], point["leftY"])
-                    right_crop = crop_diamond_scaled(point["rightX"], point["rightY"])
+                outcome = future.result()
+            except BrokenProcessPool as e:
+                batch_worker.reset_pool()
+                outcome = {"error": f"worker crashed: {e}"}
+            except Exception as e:
+                outcome = {"error": str(e)}
+            if "error" in outcome:
+                failed += 1
+            yield json.dumps({"index": index, "image_url": url, **outcome}) + "\n"
 
-                    left_result["label"] = category
-                    right_result["label"] = category
-                    left_result["base64"] = image_to_base64(left_crop)
-                    right_result["base64"] = image_to_base64(right_crop)
+        yield json.dumps({"done": True, "count": len(jobs), "failed": failed}) + "\n"
 
-                elif category in door_categories:
-                    left_result["label"] = "𓉞"
-                    right_result["label"] = "𓉞"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
-                elif category in symbol_categories:
-                    left_result["label"] = "⋆₊˚⊹"
-                    right_result["label"] = "࿔⋆"
 
-            except Exception as e:
-                print(f"Error processing icon {idx+1}: {str(e)}")
+def debug_decision_labels(img, categories, search=None):
+    debug_output = []
 
-            return {"left": left_result, "right": right_result}
+    for idx in range(25):
+        point = icon_points[idx]
+        category = categories[idx].strip().lower()
 
+        row = {"index": idx + 1, "category": category}
 
+        if category == "decision":
+            left_match = best_shifted_match(point["leftX"], point["leftY"], img, search=search)
+            right_match = best_shifted_match(point["rightX"], point["rightY"], img, search=search)
 
-        results = []
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            futures = [executor.submit(process_icon, idx) for idx in range(25)]
-            for f in as_completed(futures):
-                results.append(f.result())
+            row.update({
+                "left_label": left_match["label"],
+                "left_score": left_match["score"],
+                "left_offset": left_match["offset"],
+                "right_label": right_match["label"],
+                "right_score": right_match["score"],
+                "right_offset": right_match["offset"]
+            })
 
-        results.sort(key=lambda r: int(r['left']['id'][1:]))
-        return jsonify({"icons": results})
+        else:
+            row.update({
+                "left_label": "(skipped)",
+                "right_label": "(skipped)"
+            })
 
-    except Exception as e:
-        print("ERROR in crop_all_decision_icons:", str(e))
-        return jsonify({"error": str(e)}), 500
+        debug_output.append(row)
 
+    return debug_output
 
 @app.route('/debug_decision_icon_labels', methods=['POST'])
 def debug_decision_icon_labels():
@@ -711,51 +516,12 @@ def debug_decision_icon_labels():
         if not categories or len(categories) != 25:
             return jsonify({"error": "categories must be a 25-item list"}), 400
 
+        search = data.get("search") or SHIFT_SEARCH_MODE
+
         img = download_image(image_url)
-        scale = get_image_scale(img)
-
-        def crop_diamond_scaled(x, y):
-            scaled_x, scaled_y = int(x * scale), int(y * scale)
-            radius = int(100 * scale)
-            crop_coords = [
-                (scaled_x, scaled_y - radius), (scaled_x - radius, scaled_y),
-                (scaled_x, scaled_y + radius), (scaled_x + radius, scaled_y)
-            ]
-            mask = Image.new("L", img.size, 0)
-            ImageDraw.Draw(mask).polygon(crop_coords, fill=255)
-            cropped = Image.composite(img, Image.new("RGBA", img.size, (0,0,0,0)), mask).crop(
-                (scaled_x - radius, scaled_y - radius, scaled_x + radius, scaled_y + radius)
-            )
-            return cropped
-
-        debug_output = []
-
-        for idx in range(25):
-            point = icon_points[idx]
-            category = categories[idx].strip().lower()
-
-            row = {"index": idx + 1, "category": category}
-
-            if category == "decision":
-                left_match = best_shifted_match(point["leftX"], point["leftY"], img)
-                right_match = best_shifted_match(point["rightX"], point["rightY"], img)
-
-                row.update({
-                    "left_label": left_match["label"],
-                    "left_score": left_match["score"],
-                    "right_label": right_match["label"],
-                    "right_score": right_match["score"]
-                })
-
-            else:
-                row.update({
-                    "left_label": "(skipped)",
-                    "right_label": "(skipped)"
-                })
-
-            debug_output.append(row)
-
-        return jsonify(debug_output)
+        params = {"categories": normalize_categories(categories), "search": search}
+        return jsonify(cached_result("debug_decision_icon_labels", img, params,
+                                     lambda: debug_decision_labels(img, categories, search), templates=True))
 
     except Exception as e:
         print("ERROR in debug_decision_icon_labels:", str(e))
@@ -786,29 +552,151 @@ def debug_icon_at_point():
         x = int(data.get("x"))
         y = int(data.get("y"))
         threshold = float(data.get("threshold", 0.85))
+        search = data.get("search") or SHIFT_SEARCH_MODE
 
         if not image_url:
             return jsonify({"error": "Missing image_url"}), 400
+        try:
+            output = CropOutput.from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         img = download_image(image_url)
-        best = best_shifted_match(x, y, img, threshold)
 
-        return jsonify({
-            "image_url": image_url,
-            "x": x,
-            "y": y,
-            "best_label": best["label"],
-            "best_score": best["score"],
-            "base64": best["base64"]
-        })
+        def locate():
+            best = best_shifted_match(x, y, img, threshold, search=search)
+            rendered = crop_store.render(best["crop"], output) if best["crop"] is not None else {"base64": ""}
+            return {
+                "image_url": image_url,
+                "x": x,
+                "y": y,
+                "best_label": best["label"],
+                "best_score": best["score"],
+                "offset": best["offset"],
+                **rendered
+            }
+
+        params = {"image_url": image_url, "x": x, "y": y, "threshold": threshold, "search": search, "output": output.key}
+        return jsonify(cached_result("debug_icon_at_point", img, params, locate, validate=crops_available,
+                                     templates=True))
 
     except Exception as e:
         print("ERROR in debug_icon_at_point:", str(e))
         return jsonify({"error": str(e)}), 500
     
+@app.route('/crops/<artifact_id>', methods=['GET'])
+def get_crop(artifact_id):
+    artifact = crop_store.get(artifact_id)
+    if artifact is None:
+        return jsonify({"error": "Unknown or expired crop id"}), 404
+
+    # IDs are content hashes, so a given URL never changes
+    headers = {
+        "ETag": f'"{artifact.id}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "X-Crop-Width": str(artifact.width),
+        "X-Crop-Height": str(artifact.height)
+    }
+    # Any listed tag matches, weak (W/) ones included, as does "*"
+    if request.if_none_match.contains_weak(artifact.id) or request.if_none_match.star_tag:
+        return Response(status=304, headers=headers)
+    return Response(artifact.data, mimetype=artifact.mimetype, headers=headers)
+
+# Loads on purpose what the first requests would otherwise load lazily
+WARMUP_WIDTHS = [int(w) for w in os.environ.get("WARMUP_WIDTHS", str(REFERENCE_IMAGE_SIZE)).split(",") if w.strip()]
+
+def warm_sampling_plans():
+    for width in WARMUP_WIDTHS:
+        scale = width / REFERENCE_IMAGE_SIZE
+        compile_island_plan(width, width, scale, DEFAULT_CENTERS, COMBAT_POINTS)
+        compile_arrow_plan(width, width, scale, ARROW_POINTS_A, ARROW_POINTS_D)
+
+warm_up = WarmUp([
+    ("palette", lambda: palette.lut),
+    ("templates", lambda: load_banks(WARMUP_WIDTHS)),
+    ("sampling_plans", warm_sampling_plans),
+    ("fetcher", lambda: image_fetcher.session)
+])
+# Spawned batch workers re-run the launching script as __mp_main__; when that is
+# this file they must not warm a second copy (they load banks in batch_worker)
+if __name__ != "__mp_main__":
+    warm_up.start(os.environ.get("WARMUP", "background"))
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process is up and serving
+    return jsonify({"status": "alive"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: warm-up finished, safe to route traffic here
+    state = warm_up.get_status()
+    return jsonify(state), 200 if state["ready"] else 503
+
+def cache_events():
+    cache_status = priority_cache.get_cache_status()
+    for event in ("original_hits", "original_misses", "disk_hits", "scaled_hits", "scaled_misses", "evictions", "rejected"):
+        yield {"cache": "memory", "event": event}, cache_status[event]
+    if map_store is not None:
+        for labels, value in metrics.counter_samples("event", map_store.get_status(),
+                                                     ("hits", "misses", "stale", "revalidated", "writes", "evictions", "errors")):
+            yield {"cache": "disk", **labels}, value
+    results = result_cache.get_status()
+    yield {"cache": "results", "event": "hits"}, results["hits"]
+    yield {"cache": "results", "event": "misses"}, results["misses"]
+    for labels, value in metrics.counter_samples("event", crop_store.get_status(), ("stored", "reused", "served", "missing", "evictions")):
+        yield {"cache": "crops", **labels}, value
+    for labels, value in metrics.counter_samples("event", image_fetcher.get_status(), ("requests", "full", "not_modified", "errors")):
+        yield {"cache": "fetch", **labels}, value
+    for name, flight in (("download", download_flight), ("analysis", analysis_flight)):
+        for labels, value in metrics.counter_samples("event", flight.get_status(), ("executed", "shared", "failed")):
+            yield {"cache": f"single_flight_{name}", **labels}, value
+
+def cache_bytes():
+    yield {"cache": "memory"}, priority_cache.get_cache_status()["current_bytes"]
+    if map_store is not None:
+        yield {"cache": "disk"}, map_store.get_status()["current_bytes"]
+    yield {"cache": "results"}, result_cache.get_status()["current_bytes"]
+    yield {"cache": "crops"}, crop_store.get_status()["current_bytes"]
+    yield {"cache": "fetch_bodies"}, image_fetcher.get_status()["stored_body_bytes"]
+
+def worker_queue_depth():
+    for lane, lane_status in worker_pool.get_status()["lanes"].items():
+        yield {"lane": lane}, lane_status["queue_depth"]
+
+metrics.registry.register(metrics.CallbackMetric(
+    "cache_events_total", "counter", "Cache, fetch and single-flight events since start.", cache_events))
+metrics.registry.register(metrics.CallbackMetric(
+    "cache_bytes", "gauge", "Bytes currently held per cache.", cache_bytes))
+metrics.registry.register(metrics.CallbackMetric(
+    "worker_queue_depth", "gauge", "Tasks waiting per worker pool lane.", worker_queue_depth))
+metrics.registry.register(metrics.CallbackMetric(
+    "worker_busy", "gauge", "Worker threads currently running a task.", lambda: [({}, worker_pool.get_status()["busy"])]))
+metrics.registry.register(metrics.CallbackMetric(
+    "ready", "gauge", "1 once warm-up has finished.", lambda: [({}, int(warm_up.ready.is_set()))]))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/status', methods=['GET'])
 def status():
-    return jsonify(priority_cache.get_cache_status())
+    return jsonify({
+        **priority_cache.get_cache_status(),
+        "fetcher": image_fetcher.get_status(),
+        "crops": crop_store.get_status(),
+        "results": result_cache.get_status(),
+        "decodes": dict(decode_stats),
+        "regions": region_memo.get_status(),
+        "profiling": profiler.get_status(),
+        "templates": {map_type: bank.get_status() for map_type, bank in template_banks.items()},
+        "warm_up": warm_up.get_status(),
+        "workers": worker_pool.get_status(),
+        "single_flight": {
+            "download": download_flight.get_status(),
+            "analysis": analysis_flight.get_status()
+        }
+    })
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), threaded=True)
@@ -0,0 +1,313 @@
+import asyncio
+import contextvars
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import httpx
+from flask import current_app
+
+import app as service
+import map_analysis
+import metrics
+from image_fetcher import FetchError, FetchResult, ImageTooLarge
+
+# asyncio entry point serving the same Flask routes:
+#
+#   uvicorn --factory asgi_app:create_app --port 5000      (or: python asgi_app.py)
+#
+# Map downloads happen on the event loop through one pooled async client, so a
+# slow Cloudinary fetch costs a socket rather than a blocked thread. Once the map
+# is decoded into the shared cache the unchanged Flask view runs on an executor
+# thread; it finds the map already cached and only does the CPU work (probes,
+# crops, SSIM), which still goes through the same worker pool lanes.
+
+VIEW_THREADS = int(os.environ.get("ASGI_VIEW_THREADS", 32))
+FETCH_CONCURRENCY = int(os.environ.get("ASGI_FETCH_CONCURRENCY", 64))
+
+# Routes whose maps are downloaded by the batch process pool, not here
+NO_PREFETCH = {"/analyze_batch", "/status"}
+
+
+class AsyncImageFetcher:
+    # Async twin of ImageFetcher: same byte cap, and the same stored bodies and
+    # validators, so conditional revalidation works across both serving modes.
+    def __init__(self, fetcher, concurrency=FETCH_CONCURRENCY):
+        self.fetcher = fetcher
+        connect_timeout, read_timeout = fetcher.timeout
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            follow_redirects=True
+        )
+
+    async def fetch(self, url):
+        fetcher = self.fetcher
+        stored = fetcher.stored(url)
+        headers = fetcher.conditional_headers(stored)
+        fetcher.count("requests")
+
+        try:
+            async with self.client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304 and stored is not None:
+                    fetcher.count("not_modified")
+                    content, etag, last_modified = stored
+                    return FetchResult(url, content, 304, revalidated=True, etag=etag, last_modified=last_modified)
+
+                if response.status_code != 200:
+                    raise FetchError(f"Cloudinary returned error {response.status_code}.")
+
+                fetcher.check_declared_size(response.headers)
+                chunks = []
+                received = 0
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    if received > fetcher.max_bytes:
+                        raise ImageTooLarge(f"Image exceeds the {fetcher.max_bytes} byte limit.")
+                    chunks.append(chunk)
+                content = b"".join(chunks)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+        except httpx.HTTPError as e:
+            fetcher.count("errors")
+            raise FetchError(f"Failed to fetch image: {e}") from e
+        except FetchError:
+            fetcher.count("errors")
+            raise
+
+        fetcher.remember(url, content, etag, last_modified)
+        fetcher.count("full")
+        fetcher.count("bytes_received", len(content))
+        return FetchResult(url, content, 200, etag=etag, last_modified=last_modified)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class AsgiBridge:
+    def __init__(self, wsgi_app, view_threads=VIEW_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=view_threads, thread_name_prefix="asgi-view")
+        self.fetcher = None
+        self.prefetches = {}  # url: asyncio.Task, one download per map however many requests ask
+        self.stats = {"prefetched": 0, "cache_hits": 0, "shared": 0, "failed": 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.fetcher = AsyncImageFetcher(map_analysis.image_fetcher)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.fetcher is not None:
+                    await self.fetcher.close()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    def _image_url(self, scope, body):
+        if scope["path"] in NO_PREFETCH:
+            return None
+        if scope["method"] == "GET":
+            values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("image_url")
+            return values[0] if values else None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        url = data.get("image_url") if isinstance(data, dict) else None
+        return url if isinstance(url, str) and url else None
+
+    async def _download(self, url, need):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        fetched = await self.fetcher.fetch(url)
+        metrics.observe_stage("fetch", time.perf_counter() - started)
+        # Decoding a full map is CPU work; keep it off the event loop. The copied
+        # context carries the request's metric labels into the executor thread
+        context = contextvars.copy_context()
+        await loop.run_in_executor(self.executor, context.run, map_analysis.decode_and_store, url, fetched.content, need,
+                                   map_analysis.response_validators(fetched))
+        self.stats["prefetched"] += 1
+
+    async def _load(self, url, need):
+        # The disk tier first: a hit may revalidate upstream (blocking I/O), so it
+        # runs off the loop and, like the download, once per URL
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(self.executor, map_analysis.priority_cache.get_original, url, False)
+        if cached is not None and map_analysis.satisfies(cached, need):
+            self.stats["cache_hits"] += 1
+            return
+        await self._download(url, need)
+
+    async def prefetch(self, url, need="full"):
+        if self.fetcher is None:
+            self.fetcher = AsyncImageFetcher(map_analysis.image_fetcher)
+        cached = map_analysis.priority_cache.get_original(url, count=False, disk=False)
+        # Nothing to download when the cached decode serves the view as it is, or
+        # is a full-resolution probe decode the view upgrades in place. A reduced
+        # (draft) probe decode cannot be upgraded, so a full request fetches again.
+        upgradable = (cached is not None and getattr(cached, "representation", "full") == "probe"
+                      and getattr(cached, "reduced", 1) == 1)
+        if cached is not None and (map_analysis.satisfies(cached, need) or upgradable):
+            self.stats["cache_hits"] += 1
+            return
+
+        # One download per URL: a full decode in flight serves probe requests, and
+        # the view upgrades a probe decode it finds in place
+        task = self.prefetches.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._load(url, need))
+            self.prefetches[url] = task
+            task.add_done_callback(lambda _: self.prefetches.pop(url, None))
+        else:
+            self.stats["shared"] += 1
+
+        try:
+            await asyncio.shield(task)
+        except Exception as e:
+            # Let the view repeat the download so the error reaches the client in
+            # the route's usual format
+            self.stats["failed"] += 1
+            print(f"[ASGI] Prefetch failed for {url}: {e}")
+
+    def _environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", ""),
+            "PATH_INFO": scope["path"],
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False
+        }
+        for name, value in scope.get("headers", []):
+            key = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if key == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+            elif key != "CONTENT_LENGTH":
+                key = f"HTTP_{key}"
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _metric_labels(self, scope, image_url):
+        try:
+            rule, _ = service.app.url_map.bind("").match(scope["path"], scope["method"], return_rule=True)
+            endpoint = rule.rule
+        except Exception:
+            endpoint = "unmatched"
+        _, map_type = service.PriorityCacheManager.parse_batch_and_type(image_url or "")
+        return {"endpoint": endpoint, "map_type": metrics.map_type_label(map_type)}
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        image_url = self._image_url(scope, body)
+        # Prefetch stages are labelled like the view's; the prefetch task copies
+        # this context when it is created
+        metrics.request_labels.set(self._metric_labels(scope, image_url))
+        if image_url:
+            await self.prefetch(image_url, "probe" if scope["path"] in service.PROBE_ENDPOINTS else "full")
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append(status)
+            head = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+            }
+            loop.call_soon_threadsafe(queue.put_nowait, head)
+
+        def run_view(environ):
+            # The whole response, streamed bodies (NDJSON) included, is produced on
+            # one executor thread so Flask's context handling stays on that thread.
+            # `done` is always queued, or the request would wait on it forever, and
+            # errors never escape: the response is always terminated.
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if chunk:
+                            loop.call_soon_threadsafe(queue.put_nowait, chunk)
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()
+            except Exception as e:
+                print(f"[ASGI] View failed for {environ['PATH_INFO']}: {e}")
+                if started:
+                    return  # mid-body: the response ends where the view stopped
+                start_response("500 Internal Server Error", [("Content-Type", "application/json")])
+                loop.call_soon_threadsafe(queue.put_nowait, json.dumps({"error": str(e)}).encode("utf-8"))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        view = loop.run_in_executor(self.executor, run_view, self._environ(scope, body))
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, dict):
+                await send(item)
+            else:
+                await send({"type": "http.response.body", "body": item, "more_body": True})
+        await view
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    def get_status(self):
+        return {**self.stats, "in_flight": len(self.prefetches)}
+
+
+def asgi_status():
+    return service.jsonify(current_app.extensions["asgi_bridge"].get_status())
+
+
+def create_app(wsgi_app=None):
+    # The ASGI app over the Flask app; also registers /asgi_status on it
+    wsgi_app = wsgi_app or service.app
+    bridge = AsgiBridge(wsgi_app)
+    wsgi_app.extensions["asgi_bridge"] = bridge
+    if "asgi_status" not in wsgi_app.view_functions:
+        wsgi_app.add_url_rule('/asgi_status', 'asgi_status', asgi_status, methods=['GET'])
+    return bridge
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(create_app(), host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
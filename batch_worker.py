@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker processes import the analysis module once (palette table, templates and
+# all, but not the Flask app) and then analyze whole maps, so SSIM work for
+# different maps runs in parallel instead of contending for one interpreter's
+# GIL. Each worker matches its map's icons inline on one thread: the processes
+# already cover the cores.
+
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+_analysis = None
+
+
+def _init_worker():
+    global _analysis
+    import cv2
+    import map_analysis
+
+    cv2.setNumThreads(1)
+    # Blocking whatever WARMUP says: the first map a worker gets should not pay
+    # for mapping the banks. A failure leaves them to load lazily.
+    try:
+        map_analysis.load_banks()
+    except Exception as e:
+        print(f"[BATCH] Loading template banks failed: {e}")
+    _analysis = map_analysis
+
+
+def analyze_in_worker(image_url, categories=None, centers=None, output=None):
+    # Never raises: per-map failures come back as {"error": ...} so one bad map
+    # cannot take the batch down.
+    try:
+        analysis = _analysis
+        if analysis is None:
+            _init_worker()
+            analysis = _analysis
+        img = analysis.download_image(image_url)
+        return {"result": analysis.analyze_map(img, categories, centers, output)}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded Flask process can copy held locks
+            context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, mp_context=context, initializer=_init_worker)
+        return _pool
+
+
+def reset_pool():
+    # Drop a broken pool so the next batch starts fresh workers
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from metrics import stage
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_PNG_LEVEL = 6  # PIL's default, so inline PNGs stay byte-identical
+ENCODINGS = {"png", "webp", "raw"}
+MIMETYPES = {"png": "image/png", "webp": "image/webp", "raw": "application/octet-stream"}
+
+
+class CropEncoding:
+    # How a crop is rendered to bytes. png: lossless, level 0 (fast, large) to 9
+    # (slow, small). webp: lossless unless a quality is given. raw: the RGBA pixels
+    # as-is (outside-the-shape pixels already have alpha 0), no compression at all.
+    def __init__(self, format="png", png_level=DEFAULT_PNG_LEVEL, webp_quality=None):
+        if format not in ENCODINGS:
+            raise ValueError(f"encoding must be one of {sorted(ENCODINGS)}")
+        if not 0 <= int(png_level) <= 9:
+            raise ValueError("png_level must be between 0 and 9")
+        if webp_quality is not None and not 0 <= int(webp_quality) <= 100:
+            raise ValueError("webp_quality must be between 0 and 100")
+        self.format = format
+        self.png_level = int(png_level)
+        self.webp_quality = None if webp_quality is None else int(webp_quality)
+
+    @property
+    def key(self):
+        if self.format == "png":
+            return f"png{self.png_level}"
+        if self.format == "webp":
+            return "webp" if self.webp_quality is None else f"webp{self.webp_quality}"
+        return "raw"
+
+    @property
+    def mimetype(self):
+        return MIMETYPES[self.format]
+
+    def encode(self, image):
+        if self.format == "raw":
+            return image.convert("RGBA").tobytes()
+        buffer = io.BytesIO()
+        if self.format == "png":
+            image.save(buffer, format="PNG", compress_level=self.png_level)
+        elif self.webp_quality is None:
+            image.save(buffer, format="WEBP", lossless=True)
+        else:
+            image.save(buffer, format="WEBP", quality=self.webp_quality)
+        return buffer.getvalue()
+
+
+class CropOutput:
+    # Per-request choice of encoding and of what goes in the response: inline
+    # base64 (the original behaviour, on by default) and/or an artifact ID + URL.
+    # `publish` is off where the store is not the one /crops reads from (batch
+    # worker processes).
+    def __init__(self, encoding=None, inline=True, publish=True):
+        self.encoding = encoding or CropEncoding()
+        self.inline = inline
+        self.publish = publish
+
+    @classmethod
+    def from_request(cls, data, publish=True):
+        data = data or {}
+        encoding = CropEncoding(
+            format=str(data.get("encoding", "png")).lower(),
+            png_level=data.get("png_level", DEFAULT_PNG_LEVEL),
+            webp_quality=data.get("webp_quality")
+        )
+        inline = data.get("inline", True)
+        if isinstance(inline, str):
+            inline = inline.lower() not in ("0", "false", "no")
+        return cls(encoding, inline=bool(inline), publish=publish)
+
+    @property
+    def key(self):
+        return {"encoding": self.encoding.key, "inline": self.inline, "publish": self.publish}
+
+
+class Artifact:
+    def __init__(self, artifact_id, data, mimetype, width, height):
+        self.id = artifact_id
+        self.data = data
+        self.mimetype = mimetype
+        self.width = width
+        self.height = height
+
+
+class CropArtifactStore:
+    # Bounded LRU of encoded crops keyed by a hash of the crop pixels and the
+    # encoding. Re-requesting the same crop (the sheet does this constantly) finds
+    # the stored bytes and skips encoding; /crops/<id> serves them immutably.
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.artifacts = OrderedDict()  # id: Artifact, LRU order
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"stored": 0, "reused": 0, "served": 0, "missing": 0, "evictions": 0}
+
+    @staticmethod
+    def artifact_id(image, encoding):
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.width}x{image.height}:{encoding.key}:".encode("ascii"))
+        digest.update(image.tobytes())
+        return f"{digest.hexdigest()[:32]}.{encoding.format}"
+
+    def put(self, image, encoding):
+        artifact_id = self.artifact_id(image, encoding)
+        with self.lock:
+            artifact = self.artifacts.get(artifact_id)
+            if artifact is not None:
+                self.artifacts.move_to_end(artifact_id)
+                self.stats["reused"] += 1
+                return artifact
+
+        artifact = Artifact(artifact_id, encoding.encode(image), encoding.mimetype, image.width, image.height)
+        if len(artifact.data) > self.max_bytes:
+            return artifact  # usable inline, just not kept
+
+        with self.lock:
+            if artifact_id not in self.artifacts:
+                self.artifacts[artifact_id] = artifact
+                self.current_bytes += len(artifact.data)
+                self.stats["stored"] += 1
+            while self.current_bytes > self.max_bytes:
+                _, old = self.artifacts.popitem(last=False)
+                self.current_bytes -= len(old.data)
+                self.stats["evictions"] += 1
+        return artifact
+
+    def contains(self, artifact_id):
+        with self.lock:
+            if artifact_id not in self.artifacts:
+                return False
+            self.artifacts.move_to_end(artifact_id)  # still referenced by a cached result
+            return True
+
+    def get(self, artifact_id):
+        with self.lock:
+            artifact = self.artifacts.get(artifact_id)
+            if artifact is None:
+                self.stats["missing"] += 1
+                return None
+            self.artifacts.move_to_end(artifact_id)
+            self.stats["served"] += 1
+            return artifact
+
+    def render(self, image, output, base64_key="base64"):
+        # Response fields for one crop under the requested CropOutput
+        encoding = output.encoding
+        with stage("encode"):
+            if output.publish:
+                artifact = self.put(image, encoding)
+                data = artifact.data
+                fields = {"crop_id": artifact.id, "crop_url": f"/crops/{artifact.id}"}
+            else:
+                data = encoding.encode(image) if output.inline else b""
+                fields = {}
+            fields[base64_key] = base64.b64encode(data).decode("utf-8") if output.inline else ""
+        return fields
+
+    def get_status(self):
+        with self.lock:
+            return {**self.stats, "artifacts": len(self.artifacts),
+                    "current_bytes": self.current_bytes, "max_bytes": self.max_bytes}
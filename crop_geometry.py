@@ -0,0 +1,48 @@
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+# Base radii on the 2810 px reference map; multiplied by the image scale at use.
+DIAMOND_RADIUS = 100
+SMALL_DIAMOND_RADIUS = 32
+CIRCLE_RADIUS = 24
+
+
+@lru_cache(maxsize=64)
+def shape_mask(shape, radius):
+    # (2r x 2r) "L" mask, rasterized exactly as the old full-image masks were
+    # once translated to the crop box origin. Shared across requests; never mutate.
+    size = 2 * radius
+    mask = Image.new("L", (size, size), 0)
+    draw = ImageDraw.Draw(mask)
+    if shape == "diamond":
+        draw.polygon([(radius, 0), (0, radius), (radius, size), (size, radius)], fill=255)
+    elif shape == "circle":
+        draw.ellipse((0, 0, size, size), fill=255)
+    else:
+        raise ValueError(f"Unknown crop shape: {shape}")
+    return mask
+
+
+def crop_shape(image, cx, cy, radius, shape):
+    # Crop the bounding box first, then mask it. Image.crop pads anything outside
+    # the map with zeros, which is what compositing over a transparent full-size
+    # canvas produced, so points near the border give the same result.
+    box = (cx - radius, cy - radius, cx + radius, cy + radius)
+    region = image.crop(box)
+    if region.size[0] <= 0 or region.size[1] <= 0:
+        return region
+    blank = Image.new(region.mode, region.size, 0)
+    return Image.composite(region, blank, shape_mask(shape, radius))
+
+
+def scaled_radius(base_radius, scale):
+    return int(base_radius * scale)
+
+
+def crop_diamond_at(image, cx, cy, radius):
+    return crop_shape(image, cx, cy, radius, "diamond")
+
+
+def crop_circle_at(image, cx, cy, radius):
+    return crop_shape(image, cx, cy, radius, "circle")
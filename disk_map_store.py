@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from sampling_plan import array_backed_image, image_pixels
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 300
+
+# PIL mode -> channels of the stored array (None = 2-D)
+_MODE_CHANNELS = {"L": None, "RGB": 3, "RGBA": 4}
+
+
+def url_key(url):
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class DiskMapStore:
+    # Decoded maps as raw .npy arrays under blobs/<content hash>.npy, with a small
+    # JSON record per URL under urls/ pointing at its blob. URLs serving identical
+    # bytes share one blob. Hits are memory-mapped rather than decoded again.
+    # Blob mtime doubles as the LRU clock; the oldest blobs go first once the
+    # store grows past max_bytes.
+    #
+    # Records also keep the response's ETag / Last-Modified and when it was
+    # fetched. A hit older than max_age seconds is only served after
+    # revalidate(url, etag, last_modified) confirms the URL still serves the same
+    # bytes; without validators or a revalidate callback it is a miss.
+    # Directories are created with the first write.
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, revalidate=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.revalidate = revalidate
+        self.blob_dir = os.path.join(root, "blobs")
+        self.url_dir = os.path.join(root, "urls")
+
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "writes": 0, "evictions": 0, "errors": 0}
+        self.total_bytes = sum(size for _, size, _ in self._blobs())
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, f"{digest}.npy")
+
+    def _url_path(self, url):
+        return os.path.join(self.url_dir, f"{url_key(url)}.json")
+
+    def _blobs(self):
+        if not os.path.isdir(self.blob_dir):
+            return
+        for name in os.listdir(self.blob_dir):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.blob_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, st.st_size, st.st_mtime
+
+    def _read_record(self, url):
+        try:
+            with open(self._url_path(url)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_record(self, url, record):
+        record_path = self._url_path(url)
+        tmp = f"{record_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, record_path)
+
+    def _fresh(self, url, record):
+        if time.time() - record.get("fetched_at", 0) <= self.max_age:
+            return True
+        etag, last_modified = record.get("etag"), record.get("last_modified")
+        if self.revalidate is None or not (etag or last_modified) or not self.revalidate(url, etag, last_modified):
+            # Changed or unverifiable: forget the record so later lookups miss
+            # at once; the next fetch writes a new one
+            try:
+                os.remove(self._url_path(url))
+            except OSError:
+                pass
+            return False
+        # Unchanged upstream: trust the blob for another max_age
+        try:
+            self._write_record(url, {**record, "fetched_at": time.time()})
+        except OSError as e:
+            print(f"[MAP STORE] Failed to refresh {url}: {e}")
+        with self.lock:
+            self.stats["revalidated"] += 1
+        return True
+
+    def get(self, url):
+        record = self._read_record(url)
+        if record is None or record.get("url") != url:
+            with self.lock:
+                self.stats["misses"] += 1
+            return None
+        if not self._fresh(url, record):
+            with self.lock:
+                self.stats["stale"] += 1
+            return None
+
+        path = self._blob_path(record["content_hash"])
+        try:
+            array = np.load(path, mmap_mode="r")
+            os.utime(path)  # refresh LRU position
+        except (FileNotFoundError, ValueError, OSError):
+            with self.lock:
+                self.stats["misses"] += 1
+            return None
+
+        # Zero-copy, read-only image over the mapped file
+        image = array_backed_image(array, record["mode"])
+        image.content_hash = record["content_hash"]
+        image.source_url = url
+        with self.lock:
+            self.stats["hits"] += 1
+        return image
+
+    def put(self, url, image, digest, validators=None):
+        # validators: {"etag", "last_modified", "fetched_at"} of the response the
+        # map was decoded from
+        if image.mode not in _MODE_CHANNELS:
+            return False
+
+        path = self._blob_path(digest)
+        try:
+            os.makedirs(self.blob_dir, exist_ok=True)
+            os.makedirs(self.url_dir, exist_ok=True)
+            if not os.path.exists(path):
+                array = np.ascontiguousarray(image_pixels(image))
+                if array.nbytes > self.max_bytes:
+                    return False
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp, path)
+                with self.lock:
+                    self.total_bytes += os.path.getsize(path)
+                    self.stats["writes"] += 1
+            else:
+                os.utime(path)
+
+            validators = validators or {}
+            record = {"url": url, "content_hash": digest, "mode": image.mode, "size": list(image.size),
+                      "stored_at": time.time(), "etag": validators.get("etag"),
+                      "last_modified": validators.get("last_modified"),
+                      "fetched_at": validators.get("fetched_at", time.time())}
+            self._write_record(url, record)
+        except OSError as e:
+            print(f"[MAP STORE] Failed to write {url}: {e}")
+            with self.lock:
+                self.stats["errors"] += 1
+            return False
+
+        self._evict_if_needed(keep=path)
+        return True
+
+    def _evict_if_needed(self, keep=None):
+        with self.lock:
+            # Other processes (batch workers) write to the same directory, so the
+            # budget is checked against what is on disk, not this process's count
+            blobs = sorted(self._blobs(), key=lambda b: b[2])
+            self.total_bytes = sum(size for _, size, _ in blobs)
+            if self.total_bytes <= self.max_bytes:
+                return
+            evicted = set()
+            for path, size, _ in blobs:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self.total_bytes -= size
+                self.stats["evictions"] += 1
+                evicted.add(os.path.basename(path)[:-4])
+
+        if evicted:
+            self._drop_records(evicted)
+
+    def _drop_records(self, digests):
+        # URL records whose blob is gone are dead weight; readers already treat a
+        # missing blob as a miss, so this is just housekeeping.
+        if not os.path.isdir(self.url_dir):
+            return
+        for name in os.listdir(self.url_dir):
+            path = os.path.join(self.url_dir, name)
+            try:
+                with open(path) as f:
+                    if json.load(f).get("content_hash") in digests:
+                        os.remove(path)
+            except (FileNotFoundError, ValueError, OSError):
+                continue
+
+    def get_status(self):
+        with self.lock:
+            return {**self.stats, "current_bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                    "max_age": self.max_age, "root": self.root}
@@ -0,0 +1,185 @@
+import threading
+from collections import OrderedDict
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_POOL_SIZE = 16
+DEFAULT_BODY_CACHE_BYTES = 128 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class FetchError(Exception):
+    pass
+
+
+class ImageTooLarge(FetchError):
+    pass
+
+
+class FetchResult:
+    def __init__(self, url, content, status_code, revalidated=False, etag=None, last_modified=None):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.revalidated = revalidated  # True when a 304 let us reuse the stored body
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ImageFetcher:
+    # Pooled, streamed, size-capped GETs. Bodies of recent responses are kept
+    # (encoded, so a fraction of the decoded size) together with their ETag /
+    # Last-Modified, and the next fetch of that URL is a conditional request:
+    # an unchanged map costs a 304 instead of a full transfer.
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 max_bytes=DEFAULT_MAX_BYTES, pool_size=DEFAULT_POOL_SIZE,
+                 body_cache_bytes=DEFAULT_BODY_CACHE_BYTES, session=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+        self.body_cache_bytes = body_cache_bytes
+        self.pool_size = pool_size
+
+        # requests is imported with the first session, not at startup
+        self._session = session
+        self._session_lock = threading.Lock()
+
+        self.bodies = OrderedDict()  # url: (content, etag, last_modified), LRU order
+        self.body_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "full": 0, "not_modified": 0, "errors": 0, "bytes_received": 0}
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def stored(self, url):
+        with self.lock:
+            entry = self.bodies.get(url)
+            if entry is not None:
+                self.bodies.move_to_end(url)
+            return entry
+
+    def remember(self, url, content, etag, last_modified):
+        if not (etag or last_modified) or len(content) > self.body_cache_bytes:
+            return
+        with self.lock:
+            previous = self.bodies.pop(url, None)
+            if previous is not None:
+                self.body_bytes -= len(previous[0])
+            self.bodies[url] = (content, etag, last_modified)
+            self.body_bytes += len(content)
+            while self.body_bytes > self.body_cache_bytes and self.bodies:
+                _, (old_content, _, _) = self.bodies.popitem(last=False)
+                self.body_bytes -= len(old_content)
+
+    def conditional_headers(self, stored):
+        headers = {}
+        if stored is not None:
+            _, etag, last_modified = stored
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def check_declared_size(self, headers):
+        declared = headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > self.max_bytes:
+            raise ImageTooLarge(f"Image is {declared} bytes, limit is {self.max_bytes}.")
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def _read_capped(self, response):
+        self.check_declared_size(response.headers)
+
+        chunks = []
+        received = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            received += len(chunk)
+            if received > self.max_bytes:
+                raise ImageTooLarge(f"Image exceeds the {self.max_bytes} byte limit.")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def fetch(self, url):
+        import requests
+
+        stored = self.stored(url)
+        headers = self.conditional_headers(stored)
+        self.count("requests")
+
+        try:
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304 and stored is not None:
+                    self.count("not_modified")
+                    content, etag, last_modified = stored
+                    return FetchResult(url, content, 304, revalidated=True, etag=etag, last_modified=last_modified)
+
+                if response.status_code != 200:
+                    raise FetchError(f"Cloudinary returned error {response.status_code}.")
+
+                content = self._read_capped(response)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+        except requests.RequestException as e:
+            self.count("errors")
+            raise FetchError(f"Failed to fetch image: {e}") from e
+        except FetchError:
+            self.count("errors")
+            raise
+
+        self.remember(url, content, etag, last_modified)
+        self.count("full")
+        self.count("bytes_received", len(content))
+        return FetchResult(url, content, 200, etag=etag, last_modified=last_modified)
+
+    def revalidate(self, url, etag=None, last_modified=None):
+        # True when the server answers 304 to validators kept elsewhere (e.g. the
+        # disk tier). A changed map's body is remembered, so the fetch that
+        # follows is a 304 against it rather than a second transfer.
+        import requests
+
+        headers = self.conditional_headers((None, etag, last_modified))
+        self.count("requests")
+        try:
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    self.count("not_modified")
+                    return True
+                if response.status_code != 200:
+                    self.count("errors")
+                    return False
+                content = self._read_capped(response)
+                self.remember(url, content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        except (requests.RequestException, FetchError) as e:
+            self.count("errors")
+            print(f"[FETCH] Revalidating {url} failed: {e}")
+            return False
+
+        self.count("full")
+        self.count("bytes_received", len(content))
+        return False
+
+    def get_status(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "stored_bodies": len(self.bodies),
+                "stored_body_bytes": self.body_bytes,
+                "max_bytes": self.max_bytes,
+                "timeout": list(self.timeout)
+            }
@@ -0,0 +1,690 @@
+import io
+import os
+import time
+from PIL import Image, ImageEnhance
+import numpy as np
+from priority_cache_manager import PriorityCacheManager
+from crop_geometry import crop_diamond_at, scaled_radius, DIAMOND_RADIUS
+from single_flight import SingleFlight
+from image_fetcher import ImageFetcher
+from disk_map_store import DiskMapStore, content_hash
+from crop_artifacts import CropArtifactStore, CropOutput
+from template_bank import default_banks, DEFAULT_TYPE
+from metrics import stage
+from region_memo import region_digest
+from sampling_plan import (
+    array_backed_image, compile_island_plan, compile_arrow_plan, freeze_centers, freeze_combat_points,
+    freeze_arrow_points, supports_sparse, image_pixels, ColorSetRule, NearColorRule, NotRule, AllRule
+)
+from palette_classifier import PaletteClassifier, hex_to_rgb, within_distance
+
+# Map analysis without the web layer: layout tables, fetch/decode and caches,
+# colour probes and icon matching. app.py serves it; batch worker processes
+# import only this module.
+
+REFERENCE_IMAGE_SIZE = 2810
+CONFIDENCE_THRESHOLD_CIRCLE = 0.85
+CONFIDENCE_THRESHOLD_DIAMOND = 0.89
+
+RAW_COLOR_MAP = {
+    "#F156FF": "decision",
+    "#2DB38F": "easy",
+    "#ECD982": "medium",
+    "#F07E5F": "hard",
+    "#9843C6": "portal",
+    "#CA3B5F": "arrival",
+    "#D7995B": "bronze door",
+    "#EAE9E8": "silver door",
+    "#FFDF33": "gold door",
+    "#6D6DE5": "shop",
+    "#697785": "time lock",
+    "#E58F16": "boss"
+}
+
+COLOR_MAP = {k.upper(): v for k, v in RAW_COLOR_MAP.items()}
+
+islandCenters = [
+    { "bgX": 1404.5, "bgY": 343.5 },
+    { "bgX": 1140.5, "bgY": 607.5 },
+    { "bgX": 1668.5, "bgY": 607.5 },
+    { "bgX": 876.5, "bgY": 871.5 },
+    { "bgX": 1404.5, "bgY": 871.5 },
+    { "bgX": 1932.5, "bgY": 871.5 },
+    { "bgX": 612.5, "bgY": 1135.5 },
+    { "bgX": 1140.5, "bgY": 1135.5 },
+    { "bgX": 1668.5, "bgY": 1135.5 },
+    { "bgX": 2196.5, "bgY": 1136.0 },
+    { "bgX": 348.5, "bgY": 1399.5 },
+    { "bgX": 876.5, "bgY": 1399.5 },
+    { "bgX": 1404.5, "bgY": 1399.5 },
+    { "bgX": 1932.5, "bgY": 1399.0 },
+    { "bgX": 2460.5, "bgY": 1400.0 },
+    { "bgX": 612.5, "bgY": 1663.5 },
+    { "bgX": 1140.5, "bgY": 1663.0 },
+    { "bgX": 1668.5, "bgY": 1663.5 },
+    { "bgX": 2196.5, "bgY": 1663.0 },
+    { "bgX": 876.5, "bgY": 1927.5 },
+    { "bgX": 1404.5, "bgY": 1927.5 },
+    { "bgX": 1932.5, "bgY": 1928.0 },
+    { "bgX": 1140.5, "bgY": 2191.5 },
+    { "bgX": 1668.5, "bgY": 2192.0 },
+    { "bgX": 1404.5, "bgY": 2455.5 }
+]
+combatTypePoints = [
+    {"bossX": 1406, "bossY": 170, "minionX": 1404, "minionY": 494},
+    {"bossX": 1142, "bossY": 434, "minionX": 1140, "minionY": 758},
+    {"bossX": 1670, "bossY": 434, "minionX": 1668, "minionY": 758},
+    {"bossX": 878, "bossY": 698, "minionX": 876, "minionY": 1022},
+    {"bossX": 1406, "bossY": 698, "minionX": 1404, "minionY": 1022},
+    {"bossX": 1934, "bossY": 698, "minionX": 1932, "minionY": 1022},
+    {"bossX": 614, "bossY": 962, "minionX": 612, "minionY": 1286},
+    {"bossX": 1142, "bossY": 962, "minionX": 1140, "minionY": 1286},
+    {"bossX": 1670, "bossY": 962, "minionX": 1668, "minionY": 1286},
+    {"bossX": 2199, "bossY": 963, "minionX": 2196, "minionY": 1287},
+    {"bossX": 350, "bossY": 1225, "minionX": 348, "minionY": 1550},
+    {"bossX": 878, "bossY": 1225, "minionX": 876, "minionY": 1550},
+    {"bossX": 1406, "bossY": 1226, "minionX": 1404, "minionY": 1550},
+    {"bossX": 1934, "bossY": 1226, "minionX": 1932, "minionY": 1549},
+    {"bossX": 2462, "bossY": 1226, "minionX": 2460, "minionY": 1550},
+    {"bossX": 614, "bossY": 1489, "minionX": 612, "minionY": 1814},
+    {"bossX": 1142, "bossY": 1489, "minionX": 1140, "minionY": 1813},
+    {"bossX": 1670, "bossY": 1489, "minionX": 1668, "minionY": 1814},
+    {"bossX": 2199, "bossY": 1489, "minionX": 2196, "minionY": 1813},
+    {"bossX": 878, "bossY": 1753, "minionX": 876, "minionY": 2077},
+    {"bossX": 1406, "bossY": 1753, "minionX": 1404, "minionY": 2077},
+    {"bossX": 1934, "bossY": 1754, "minionX": 1932, "minionY": 2079},
+    {"bossX": 1142, "bossY": 2017, "minionX": 1140, "minionY": 2340},
+    {"bossX": 1670, "bossY": 2018, "minionX": 1668, "minionY": 2341},
+    {"bossX": 1406, "bossY": 2281, "minionX": 1404, "minionY": 2603}
+]
+arrowPointsA = [
+    'x',
+    'x',
+    [[1558, 497], [1515, 454]],
+    'x',
+    [[1294, 761], [1251, 718]],
+    [[1822, 761], [1779, 718]],
+    'x',
+    [[1030, 1025], [987, 982]],
+    [[1558, 1025], [1515, 982]],
+    [[2086, 1025], [2043, 982]],
+    'x',
+    [[766, 1289], [723, 1246]],
+    [[1294, 1289], [1251, 1246]],
+    [[1822, 1289], [1779, 1246]],
+    [[2350, 1289], [2307, 1246]],
+    [[502, 1553], [459, 1510]],
+    [[1030, 1553], [987, 1510]],
+    [[1558, 1553], [1515, 1510]],
+    [[2086, 1553], [2043, 1510]],
+    [[766, 1817], [723, 1774]],
+    [[1294, 1817], [1251, 1774]],
+    [[1822, 1817], [1779, 1774]],
+    [[1030, 2081], [987, 2038]],
+    [[1558, 2081], [1515, 2038]],
+    [[1294, 2345], [1251, 2302]]
+]
+arrowPointsD = [
+    'x',
+    [[1251, 497], [1294, 454]],
+    'x',
+    [[987, 761], [1030, 718]],
+    [[1515, 761], [1558, 718]],
+    'x',
+    [[723, 1025], [766, 982]],
+    [[1251, 1025], [1294, 982]],
+    [[1779, 1025], [1822, 982]],
+    'x',
+    [[459, 1289], [502, 1246]],
+    [[987, 1289], [1030, 1246]],
+    [[1515, 1289], [1558, 1246]],
+    [[2043, 1289], [2086, 1246]],
+    'x',
+    [[723, 1553], [766, 1510]],
+    [[1251, 1553], [1294, 1510]],
+    [[1779, 1553], [1822, 1510]],
+    [[2307, 1553], [2350, 1510]],
+    [[987, 1817], [1030, 1774]],
+    [[1515, 1817], [1558, 1774]],
+    [[2043, 1817], [2086, 1774]],
+    [[1251, 2081], [1294, 2038]],
+    [[1779, 2081], [1822, 2038]],
+    [[1515, 2345], [1558, 2302]]
+]
+
+icon_points = [
+            { "leftX": 1304, "leftY": 343, "rightX": 1504, "rightY": 343 },
+            { "leftX": 1040, "leftY": 607, "rightX": 1240, "rightY": 607 },
+            { "leftX": 1570, "leftY": 607, "rightX": 1770, "rightY": 607 },
+            { "leftX": 776, "leftY": 871, "rightX": 976, "rightY": 871 },
+            { "leftX": 1304, "leftY": 871, "rightX": 1504, "rightY": 871 },
+            { "leftX": 1832, "leftY": 871, "rightX": 2032, "rightY": 871 },
+            { "leftX": 512, "leftY": 1135, "rightX": 712, "rightY": 1135 },
+            { "leftX": 1040, "leftY": 1135, "rightX": 1240, "rightY": 1135 },
+            { "leftX": 1570, "leftY": 1135, "rightX": 1770, "rightY": 1135 },
+            { "leftX": 2098, "leftY": 1135, "rightX": 2298, "rightY": 1135 },
+            { "leftX": 248, "leftY": 1399, "rightX": 448, "rightY": 1399 },
+            { "leftX": 776, "leftY": 1399, "rightX": 976, "rightY": 1399 },
+            { "leftX": 1304, "leftY": 1399, "rightX": 1504, "rightY": 1399 },
+            { "leftX": 1832, "leftY": 1399, "rightX": 2032, "rightY": 1399 },
+            { "leftX": 2360, "leftY": 1399, "rightX": 2560, "rightY": 1399 },
+            { "leftX": 512, "leftY": 1663, "rightX": 712, "rightY": 1663 },
+            { "leftX": 1040, "leftY": 1663, "rightX": 1240, "rightY": 1663 },
+            { "leftX": 1570, "leftY": 1663, "rightX": 1770, "rightY": 1663 },
+            { "leftX": 2098, "leftY": 1663, "rightX": 2298, "rightY": 1663 },
+            { "leftX": 776, "leftY": 1927, "rightX": 976, "rightY": 1927 },
+            { "leftX": 1304, "leftY": 1927, "rightX": 1504, "rightY": 1927 },
+            { "leftX": 1832, "leftY": 1927, "rightX": 2032, "rightY": 1927 },
+            { "leftX": 1040, "leftY": 2191, "rightX": 1240, "rightY": 2191 },
+            { "leftX": 1570, "leftY": 2191, "rightX": 1770, "rightY": 2191 },
+            { "leftX": 1304, "leftY": 2455, "rightX": 1504, "rightY": 2455 }
+        ]
+
+door_categories = {"bronze door", "silver door", "door", "gold door", "time lock"}
+symbol_categories = {"portal", "arrival", "shop"}
+ssim_categories = {"decision"}
+image_categories = {"battle", "boss"}
+
+def preprocess_crop(crop, size=(118, 118)):
+    enhancer = ImageEnhance.Contrast(crop.convert("L"))
+    boosted = enhancer.enhance(1.5)  # increase contrast
+    return boosted.resize(size) if size else boosted
+
+def enhance_contrast(img, factor=1.5):
+    return ImageEnhance.Contrast(img).enhance(factor)
+
+palette = PaletteClassifier(COLOR_MAP, max_distance=20)
+
+def closest_color(pixel):
+    # Fuzzy palette match within distance 20, else the exact color as hex
+    return palette.closest_hex([pixel[:3]])[0]
+
+image_fetcher = ImageFetcher(
+    connect_timeout=float(os.environ.get("FETCH_CONNECT_TIMEOUT", 5)),
+    read_timeout=float(os.environ.get("FETCH_READ_TIMEOUT", 30)),
+    max_bytes=int(os.environ.get("FETCH_MAX_BYTES", 50 * 1024 * 1024)),
+    pool_size=int(os.environ.get("FETCH_POOL_SIZE", 16)),
+    body_cache_bytes=int(os.environ.get("FETCH_BODY_CACHE_BYTES", 128 * 1024 * 1024))
+)
+
+# Decoded maps survive restarts in MAP_STORE_DIR; set it empty to disable the disk tier.
+# Hits older than MAP_STORE_MAX_AGE seconds are revalidated upstream before use.
+MAP_STORE_DIR = os.environ.get("MAP_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_store"))
+map_store = DiskMapStore(
+    MAP_STORE_DIR,
+    max_bytes=int(os.environ.get("MAP_STORE_MAX_BYTES", 2 * 1024 * 1024 * 1024)),
+    max_age=float(os.environ.get("MAP_STORE_MAX_AGE", 300)),
+    revalidate=image_fetcher.revalidate
+) if MAP_STORE_DIR else None
+
+priority_cache = PriorityCacheManager(
+    max_bytes=int(os.environ.get("CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+    disk_store=map_store
+)
+
+CANNOT_BE_MINION_COLORS = {
+    "#2DB38F",  # Easy
+    "#ECD982",  # Medium
+    "#F07E5F"   # Hard
+}
+
+MONSTER_HEX = "#262B34"  # Dark fallback (Monster)
+MONSTER_THRESHOLD = 10  # Allow fuzzy match within distance 10
+def is_monster_color(pixel_hex):
+    return bool(within_distance(hex_to_rgb(pixel_hex), MONSTER_HEX, MONSTER_THRESHOLD))
+
+def is_minion_color(pixel_hex):
+    if pixel_hex.upper() in CANNOT_BE_MINION_COLORS or is_monster_color(pixel_hex):
+        return False
+    return True
+
+# Concurrent requests for the same map share one fetch+decode
+download_flight = SingleFlight("download")
+
+# Encoded crops, served by ID from /crops/<id> and reused when re-requested
+crop_store = CropArtifactStore(max_bytes=int(os.environ.get("CROP_STORE_MAX_BYTES", 64 * 1024 * 1024)))
+# Decode modes: "full" is the RGBA pixel array crops and icon matching need;
+# "probe" keeps the decoded source as-is for callers that only read a few
+# pixels (no RGBA copy of the whole frame). A cached probe decode is upgraded to
+# full by converting it, not by decoding the bytes again.
+# Largest JPEG draft reduction (1, 2, 4 or 8) probe decodes may use; 1 keeps full resolution
+PROBE_JPEG_DRAFT = int(os.environ.get("PROBE_JPEG_DRAFT", 1))
+decode_stats = {"full": 0, "probe": 0, "draft": 0, "upgraded": 0, "refetched": 0}
+
+def satisfies(image, need):
+    return need == "probe" or getattr(image, "representation", "full") == "full"
+
+def fetch_and_decode(image_url, need="full"):
+    # A flight that finished just before ours may already have filled the cache.
+    # This is also where the disk tier is consulted: revalidating a stale map
+    # is an upstream request, made once per flight rather than once per caller.
+    cached_image = priority_cache.get_original(image_url, count=False)
+    if cached_image and satisfies(cached_image, need):
+        return cached_image
+    if cached_image and not getattr(cached_image, "reduced", 1) > 1:
+        return upgrade_to_full(image_url, cached_image)
+
+    with stage("fetch"):
+        fetched = image_fetcher.fetch(image_url)
+    if cached_image:
+        decode_stats["refetched"] += 1  # a reduced draft cannot be upgraded in place
+    return decode_and_store(image_url, fetched.content, need, response_validators(fetched))
+
+def response_validators(fetched):
+    # What the disk tier needs to revalidate a map it persisted from this response
+    return {"etag": fetched.etag, "last_modified": fetched.last_modified, "fetched_at": time.time()}
+
+def decode_and_store(image_url, content, need="full", validators=None):
+    with stage("decode"):
+        source = Image.open(io.BytesIO(content))
+        if need == "probe" and supports_sparse(source):
+            img = decode_for_probes(source)
+        else:
+            # Keep the decoded pixels as an array the sampling plans can gather from directly
+            img = array_backed_image(np.asarray(source.convert("RGBA")), "RGBA")
+            img.representation = "full"
+        decode_stats[img.representation] += 1
+        img.content_hash = content_hash(content)  # keys the result cache
+        img.source_url = image_url  # its ?type= picks the template bank
+        img.validators = validators
+    store_decoded(image_url, img)
+    return img
+
+def decode_for_probes(source):
+    width = source.width
+    if source.format == "JPEG" and PROBE_JPEG_DRAFT > 1:
+        # DCT scaling: the decoder skips detail the probes do not need
+        source.draft(source.mode, (source.width // PROBE_JPEG_DRAFT, source.height // PROBE_JPEG_DRAFT))
+    source.load()
+    source.representation = "probe"
+    source.reduced = width / source.width
+    if source.reduced > 1:
+        decode_stats["draft"] += 1
+    return source
+
+def upgrade_to_full(image_url, image):
+    with stage("decode"):
+        full = array_backed_image(np.asarray(image.convert("RGBA")), "RGBA")
+        full.representation = "full"
+        full.content_hash = image.content_hash
+        full.source_url = image_url
+        full.validators = getattr(image, "validators", None)
+        decode_stats["upgraded"] += 1
+    store_decoded(image_url, full)
+    return full
+
+def store_decoded(image_url, img):
+    # Auto-tracks batch/type if present; the content hash keys the disk tier,
+    # which only ever holds full decodes
+    with stage("store"):
+        persist_hash = img.content_hash if img.representation == "full" else None
+        priority_cache.store_original(image_url, img, content_hash=persist_hash,
+                                      validators=getattr(img, "validators", None))
+
+def download_image(image_url, need="full"):
+    cached_image = priority_cache.get_original(image_url, disk=False)
+    if cached_image and satisfies(cached_image, need):
+        print(f"Using cached original for {image_url}")
+        return cached_image
+
+    # One flight per URL, whatever the decode: a full decode in flight serves
+    # probe callers too. A full caller that joined a probe-only flight gets
+    # nothing usable from it, but the bytes are cached by then, so its own
+    # flight only upgrades the decode (or re-fetches a reduced draft).
+    while True:
+        img = download_flight.do(image_url, lambda: fetch_and_decode(image_url, need))
+        if satisfies(img, need):
+            return img
+
+def get_image_scale(image):
+    return image.width / REFERENCE_IMAGE_SIZE
+
+# Compiled ER / NR template banks, memory-mapped on first use
+template_banks = default_banks()
+
+def load_banks(widths=(REFERENCE_IMAGE_SIZE,)):
+    # Maps every bank now and builds its matcher level for maps of these widths
+    for bank in template_banks.values():
+        matcher = bank.matcher
+        for width in widths:
+            matcher.at_size(2 * scaled_radius(DIAMOND_RADIUS, width / REFERENCE_IMAGE_SIZE))
+
+def bank_for(image):
+    # Maps are matched against the icon set of their ?type= (ER when unknown)
+    _, map_type = PriorityCacheManager.parse_batch_and_type(getattr(image, "source_url", None) or "")
+    return template_banks.get((map_type or "").upper(), template_banks[DEFAULT_TYPE])
+
+def image_similarity_ssim(img1, img2):
+    from skimage.metrics import structural_similarity as ssim  # pulls in scipy; keep it off the startup path
+    img1_gray = np.array(img1.convert("L"))
+    img2_gray = np.array(img2.convert("L").resize(img1.size))
+    score, _ = ssim(img1_gray, img2_gray, full=True)
+    return score
+
+def crops_available(result):
+    # A cached result is only as good as the crop IDs in it
+    if isinstance(result, dict):
+        if "crop_id" in result and not crop_store.contains(result["crop_id"]):
+            return False
+        return all(crops_available(v) for v in result.values() if isinstance(v, (dict, list)))
+    if isinstance(result, list):
+        return all(crops_available(v) for v in result)
+    return True
+
+def find_best_match_icon(preprocessed_img, threshold=0.85, matcher=None):
+    matcher = matcher or template_banks[DEFAULT_TYPE].matcher
+    return matcher.best_match(np.array(preprocessed_img), threshold)
+
+# "grid" scores all 25 offsets in a +/-2 px window with SSIM. "correlation" finds
+# each template's best offset with normalized cross-correlation over one slightly
+# larger region and confirms only the top few offsets with SSIM.
+SHIFT_RADIUS = 2
+SHIFT_OFFSETS = [(dx, dy) for dx in range(-SHIFT_RADIUS, SHIFT_RADIUS + 1) for dy in range(-SHIFT_RADIUS, SHIFT_RADIUS + 1)]
+SHIFT_SEARCH_MODE = os.environ.get("SHIFT_SEARCH_MODE", "correlation")
+CORRELATION_CONFIRM_K = int(os.environ.get("CORRELATION_CONFIRM_K", 3))
+# Opt-in cheap-descriptor shortlist before SSIM: each candidate crop is scored
+# only against its PREFILTER_TOP_K nearest templates (plus any within
+# PREFILTER_MARGIN of the k-th). The shortlist can miss the best template and
+# change a label, so 0 (every template) is the default; measure with
+# tools/benchmark.py --prefilter-k before turning it on.
+PREFILTER_TOP_K = int(os.environ.get("PREFILTER_TOP_K", 0))
+PREFILTER_MARGIN = float(os.environ.get("PREFILTER_MARGIN", 0.0))
+# "template": crops are resized to the 118 px templates (the calibrated default).
+# "native": crops are scored at their own size against the bank's template
+# pyramid level for that size (resampled from the original icons), with no
+# per-crop resampling. Crops larger than the templates cost more that way.
+# tests/test_ssim_resolution.py checks both modes agree on the calibrated sizes.
+SSIM_RESOLUTION = os.environ.get("SSIM_RESOLUTION", "template")
+
+def correlation_offsets(image, scaled_x, scaled_y, radius, k=CORRELATION_CONFIRM_K, matcher=None):
+    # One grayscale region covering every shift; templates are resampled to the
+    # crop size so each response position is exactly one integer offset.
+    m = SHIFT_RADIUS
+    region = image.crop((scaled_x - radius - m, scaled_y - radius - m, scaled_x + radius + m, scaled_y + radius + m)).convert("L")
+    matcher = matcher or bank_for(image).matcher
+    positions, peaks = matcher.correlation_peaks(np.array(region), size=2 * radius)
+
+    offsets = []
+    for rank, t in enumerate(np.argsort(-peaks, kind="stable")[:k]):
+        dx, dy = (int(v) - m for v in positions[t])
+        # The top peak also gets its 4-neighbours, since correlation and SSIM can
+        # disagree by a pixel on resampled crops.
+        ring = [(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)] if rank == 0 else [(0, 0)]
+        for ox, oy in ring:
+            candidate = (dx + ox, dy + oy)
+            if max(abs(candidate[0]), abs(candidate[1])) <= m and candidate not in offsets:
+                offsets.append(candidate)
+    return offsets
+
+def best_shifted_match(x, y, image, threshold=0.85, search=None, top_k=None, resolution=None):
+    search = search or SHIFT_SEARCH_MODE
+    top_k = PREFILTER_TOP_K if top_k is None else top_k
+    resolution = resolution or SSIM_RESOLUTION
+    scale = get_image_scale(image)
+    scaled_x = int(x * scale)
+    scaled_y = int(y * scale)
+    radius = scaled_radius(DIAMOND_RADIUS, scale)
+    bank = bank_for(image)
+    matcher = bank.matcher
+
+    # "crop" is the winning PIL crop; callers render it with crop_store if they return it
+    best_result = {"label": "other", "score": -1, "crop": None, "offset": None}
+
+    if search == "grid":
+        offsets = SHIFT_OFFSETS
+    elif search == "correlation":
+        with stage("correlation"):
+            offsets = correlation_offsets(image, scaled_x, scaled_y, radius, matcher=matcher)
+    else:
+        raise ValueError(f"Unknown search mode: {search}")
+
+    with stage("crop"):
+        crops = [crop_diamond_at(image, scaled_x + dx, scaled_y + dy, radius) for dx, dy in offsets]
+    if resolution == "native":
+        scorer = matcher.at_size(2 * radius)
+        with stage("preprocess"):
+            pre_stack = np.stack([np.array(preprocess_crop(c, size=None)) for c in crops])  # grayscale + contrast
+    elif resolution == "template":
+        scorer = matcher
+        with stage("preprocess"):
+            pre_stack = np.stack([np.array(preprocess_crop(c)) for c in crops])  # grayscale + contrast + resize
+    else:
+        raise ValueError(f"Unknown SSIM resolution: {resolution}")
+
+    # Every candidate shift against every (shortlisted) template in one pass;
+    # first best wins, as in the old loop
+    prefilter = bank.prefilter(top_k, PREFILTER_MARGIN)
+    if prefilter.active:
+        with stage("prefilter"):
+            pairs = prefilter.shortlist(pre_stack)
+        with stage("ssim"):
+            scores = np.full((len(crops), len(scorer.names)), -np.inf)
+            scores[pairs] = scorer.score_pairs(pre_stack, *pairs)
+    else:
+        with stage("ssim"):
+            scores = scorer.score_stack(pre_stack)
+    if scores.size == 0:
+        return best_result
+
+    best_shift, best_template = np.unravel_index(scores.argmax(), scores.shape)
+    best_score = float(scores[best_shift, best_template])
+    best_result = {
+        "label": matcher.names[best_template] if best_score >= threshold else "other",
+        "score": best_score,
+        "crop": crops[best_shift],
+        "offset": list(offsets[best_shift])
+    }
+
+    return best_result
+
+BOSS_HEX = "#E58F16"
+
+# Classification rules for the combat probes of each island
+BOSS_RULE = ColorSetRule([BOSS_HEX])
+MINION_RULE = AllRule(
+    NotRule(ColorSetRule(CANNOT_BE_MINION_COLORS)),
+    NotRule(NearColorRule(MONSTER_HEX, MONSTER_THRESHOLD))
+)
+
+DEFAULT_CENTERS = freeze_centers(islandCenters)
+COMBAT_POINTS = freeze_combat_points(combatTypePoints)
+
+def island_category(island_type, combat_type_helper):
+    lower_type = island_type.lower()
+    if lower_type in ["easy", "medium", "hard"]:
+        return combat_type_helper if combat_type_helper != "None" else "battle"
+    elif lower_type == "decision":
+        return "decision"
+    elif lower_type == "shop":
+        return "shop"
+    elif lower_type in ["portal", "arrival"]:
+        return "portal"
+    elif lower_type in ["bronze door", "silver door", "gold door", "time lock"]:
+        return "door"
+    return "Void"
+
+def classify_islands(img, centers=None):
+    frozen_centers = freeze_centers(centers) if centers else DEFAULT_CENTERS
+    plan = compile_island_plan(img.width, img.height, get_image_scale(img), frozen_centers, COMBAT_POINTS)
+
+    # Every island, boss and minion probe in one gather and one classify pass
+    with stage("probe"):
+        samples = plan.gather(img)
+    island_pixels = samples[plan.group("island")]
+    island_hexes = palette.closest_hex(island_pixels)
+    boss_hits = BOSS_RULE.evaluate(samples[plan.group("boss")])
+    minion_hits = MINION_RULE.evaluate(samples[plan.group("minion")])
+    valid = plan.valid[plan.group("island")] & plan.valid[plan.group("boss")] & plan.valid[plan.group("minion")]
+
+    results = []
+    for i, matched_hex in enumerate(island_hexes):
+        if not valid[i]:
+            print(f"Error processing island {i+1}: probe outside the image")
+            results.append({"index": i + 1, "island_type": "Void", "category": "Void"})
+            continue
+
+        island_type = COLOR_MAP.get(matched_hex, "Void")
+        combat_type_helper = "None"
+        if boss_hits[i]:
+            combat_type_helper = "boss"
+        elif minion_hits[i]:
+            combat_type_helper = "minion"
+
+        print(f"Island {i+1} RGB: {tuple(int(v) for v in island_pixels[i])}, Closest Hex: {matched_hex}, Matched Type: {island_type}")
+
+        results.append({
+            "index": i + 1,
+            "island_type": island_type,
+            "category": island_category(island_type, combat_type_helper)
+        })
+
+    return results
+
+ARROW_ACCEPTED_COLORS = {
+    "#F156FF", "#FFFFFF", "#2DB38F", "#ECD982", "#E5E4E2",
+    "#FFD700", "#CD7F32", "#445566", "#F07E5F", "#EAE9E8"
+}
+ARROW_RULE = ColorSetRule(ARROW_ACCEPTED_COLORS)
+ARROW_POINTS_A = freeze_arrow_points(arrowPointsA)
+ARROW_POINTS_D = freeze_arrow_points(arrowPointsD)
+
+def check_arrows(img):
+    plan = compile_arrow_plan(img.width, img.height, get_image_scale(img), ARROW_POINTS_A, ARROW_POINTS_D)
+    if not plan.valid.all():
+        raise IndexError("image index out of range")
+
+    with stage("probe"):
+        hits = ARROW_RULE.evaluate(plan.gather(img))
+
+    def expand(points, group):
+        group_hits = iter(hits[plan.group(group)])
+        return [["skip", "skip"] if entry is None else ["arrow" if next(group_hits) else "no" for _ in entry]
+                for entry in points]
+
+    return {
+        "A": expand(ARROW_POINTS_A, "A"),
+        "D": expand(ARROW_POINTS_D, "D")
+    }
+
+def crop_diamond_scaled(img, x, y):
+    scale = get_image_scale(img)
+    scaled_x = int(x * scale)
+    scaled_y = int(y * scale)
+    radius = scaled_radius(DIAMOND_RADIUS, scale)
+
+    with stage("crop"):
+        return crop_diamond_at(img, scaled_x, scaled_y, radius)
+
+def match_decision_icon_pair(img, idx, category, output=None):
+    point = icon_points[idx]
+    category = category.strip().lower()
+    output = output or CropOutput()
+
+    left_result = {"id": f"L{idx+1}", "label": "", "base64": ""}
+    right_result = {"id": f"R{idx+1}", "label": "", "base64": ""}
+
+    try:
+        if category in ssim_categories:
+            left_match = best_shifted_match(point["leftX"], point["leftY"], img)
+            right_match = best_shifted_match(point["rightX"], point["rightY"], img)
+            left_result["label"] = left_match["label"]
+            right_result["label"] = right_match["label"]
+            if left_match["crop"] is not None:
+                left_result.update(crop_store.render(left_match["crop"], output))
+            if right_match["crop"] is not None:
+                right_result.update(crop_store.render(right_match["crop"], output))
+
+
+        elif category in image_categories:
+            left_crop = crop_diamond_scaled(img, point["leftX"], point["leftY"])
+            right_crop = crop_diamond_scaled(img, point["rightX"], point["rightY"])
+
+            left_result["label"] = category
+            right_result["label"] = category
+            left_result.update(crop_store.render(left_crop, output))
+            right_result.update(crop_store.render(right_crop, output))
+
+        elif category in door_categories:
+            left_result["label"] = "𓉞"
+            right_result["label"] = "𓉞"
+
+        elif category in symbol_categories:
+            left_result["label"] = "⋆₊˚⊹"
+            right_result["label"] = "࿔⋆"
+
+    except Exception as e:
+        print(f"Error processing icon {idx+1}: {str(e)}")
+
+    return {"left": left_result, "right": right_result}
+
+def match_decision_icons(img, categories, output=None, regions=None, pool=None):
+    # pool: the web process's PriorityExecutor; without one (batch workers, which
+    # already run one map per process) the pairs are matched inline
+    def pair(idx):
+        if regions is None:
+            return match_decision_icon_pair(img, idx, categories[idx], output)
+        return regions.reuse_or_compute(f"icon:{idx+1}", icon_fingerprint(img, idx, categories[idx]),
+                                        lambda: match_decision_icon_pair(img, idx, categories[idx], output),
+                                        validate=crops_available)
+
+    if pool is None:
+        return [pair(idx) for idx in range(25)]
+    futures = pool.submit_many("bulk", [(pair, (idx,)) for idx in range(25)])
+    return [f.result() for f in futures]
+
+def region_context(img, output):
+    # Everything besides a region's own pixels that its result depends on
+    return (img.size, bank_for(img).version, SHIFT_SEARCH_MODE, PREFILTER_TOP_K, PREFILTER_MARGIN, SSIM_RESOLUTION,
+            output.key)
+
+def icon_fingerprint(img, idx, category):
+    # Category plus every pixel the shift search (or plain crop) can read for both diamonds
+    category = category.strip().lower()
+    parts = [category]
+    if category in ssim_categories or category in image_categories:
+        pixels = image_pixels(img)
+        scale = get_image_scale(img)
+        reach = scaled_radius(DIAMOND_RADIUS, scale) + SHIFT_RADIUS
+        point = icon_points[idx]
+        for side in ("left", "right"):
+            x, y = int(point[f"{side}X"] * scale), int(point[f"{side}Y"] * scale)
+            box = (max(x - reach, 0), max(y - reach, 0), min(x + reach, img.width), min(y + reach, img.height))
+            parts += [box, pixels[box[1]:box[3], box[0]:box[2]]]
+    return region_digest(*parts)
+
+def track_probe_regions(img, centers, regions):
+    # Island and arrow probes: fingerprinting them costs as much as classifying
+    # them, so they are always recomputed and only reported when changed
+    frozen_centers = freeze_centers(centers) if centers else DEFAULT_CENTERS
+    plan = compile_island_plan(img.width, img.height, get_image_scale(img), frozen_centers, COMBAT_POINTS)
+    samples = plan.gather(img)
+    for i in range(len(frozen_centers)):
+        probes = [plan.group(name).start + i for name in ("island", "boss", "minion")]
+        regions.track(f"island:{i+1}", region_digest(plan.xs[probes], plan.ys[probes], samples[probes]))
+
+    plan = compile_arrow_plan(img.width, img.height, get_image_scale(img), ARROW_POINTS_A, ARROW_POINTS_D)
+    samples = plan.gather(img)
+    for name, points in (("A", ARROW_POINTS_A), ("D", ARROW_POINTS_D)):
+        start = plan.group(name).start
+        for j, entry in enumerate(points):
+            if entry is None:
+                continue
+            probes = slice(start, start + len(entry))
+            start += len(entry)
+            regions.track(f"arrow:{name}{j+1}", region_digest(plan.xs[probes], plan.ys[probes], samples[probes]))
+
+def analyze_map(img, categories=None, centers=None, output=None, regions=None, pool=None):
+    # One decoded map feeds every stage; island categories drive icon matching
+    # unless the caller supplies its own. regions: a RegionSession when the map
+    # belongs to a batch, so unchanged icon pairs reuse the previous map's results.
+    island_data = classify_islands(img, centers)
+    if not categories:
+        categories = [island["category"] for island in island_data]
+    if regions is not None:
+        track_probe_regions(img, centers, regions)
+
+    return {
+        "island_data": island_data,
+        "arrows": check_arrows(img),
+        "icons": match_decision_icons(img, categories, output, regions, pool)
+    }
@@ -0,0 +1,146 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from request_profiler import record_stage
+
+# Minimal Prometheus text-format metrics: histograms and counters kept in
+# process, plus callback metrics that read existing stats dicts at scrape time.
+# Stage timings are labelled with the endpoint and map type of the request that
+# caused them; those labels travel in a context variable, which the worker pool
+# copies into its threads.
+
+PREFIX = "color_api_"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+request_labels = contextvars.ContextVar("request_labels", default={"endpoint": "none", "map_type": "none"})
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, label_names, buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values: [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = {k: list(v) for k, v in self.series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    # Values read at scrape time: fn() -> iterable of (labels dict, value)
+    def __init__(self, name, kind, help, fn):
+        self.name = PREFIX + name
+        self.kind = kind
+        self.help = help
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = list(self.fn())
+        except Exception as e:
+            print(f"[METRICS] {self.name} failed: {e}")
+            return lines
+        for labels, value in samples:
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "stage_seconds", "Wall time of one hot-path stage.", ("stage", "endpoint", "map_type")))
+request_seconds = registry.register(Histogram(
+    "request_seconds", "Wall time of one HTTP request, until the response is ready.", ("endpoint", "map_type", "status")))
+
+
+def observe_stage(stage, seconds):
+    labels = request_labels.get()
+    stage_seconds.observe(seconds, stage, labels["endpoint"], labels["map_type"])
+    record_stage(stage, seconds)  # no-op unless the request is being profiled
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def map_type_label(map_type):
+    # Bounded label values: ER, NR, other or none
+    if not map_type:
+        return "none"
+    map_type = str(map_type).upper()
+    return map_type if map_type in ("ER", "NR") else "other"
+
+
+def counter_samples(label_name, stats, keys=None):
+    # {"hits": 3, ...} -> [({label_name: "hits"}, 3), ...]
+    return [({label_name: key}, value) for key, value in stats.items()
+            if (keys is None or key in keys) and isinstance(value, (int, float))]
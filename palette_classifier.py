@@ -0,0 +1,115 @@
+import threading
+
+import numpy as np
+
+
+def hex_to_rgb(hex_color):
+    return tuple(int(hex_color[i:i+2], 16) for i in (1, 3, 5))
+
+
+def rgb_to_hex(pixel):
+    return "#{:02X}{:02X}{:02X}".format(pixel[0], pixel[1], pixel[2])
+
+
+def pack_rgb(pixels):
+    # (..., 3+) uint8 -> (...) int32 0xRRGGBB, handy for set membership tests
+    pixels = np.asarray(pixels)
+    return (pixels[..., 0].astype(np.int32) << 16) | (pixels[..., 1].astype(np.int32) << 8) | pixels[..., 2].astype(np.int32)
+
+
+def pack_hex(hex_codes):
+    return np.array([int(h[1:7], 16) for h in hex_codes], dtype=np.int32)
+
+
+class PaletteClassifier:
+    NO_MATCH = -1
+    AMBIGUOUS = -2
+
+    def __init__(self, color_map, max_distance=20, lut_bits=5):
+        self.hex_codes = [h.upper() for h in color_map.keys()]
+        self.categories = [color_map[h] for h in color_map.keys()]
+        self.palette = np.array([hex_to_rgb(h) for h in self.hex_codes], dtype=np.int32)
+        # closest_color accepts dist < max_distance; compare squared ints instead of sqrt
+        self.max_dist_sq = max_distance * max_distance
+        self.lut_bits = lut_bits
+        # The table takes ~0.1 s to build, so it is built on first use (or by warm-up)
+        self._lut = None
+        self._lut_lock = threading.Lock()
+
+    @property
+    def lut(self):
+        if self._lut is None and self.lut_bits:
+            with self._lut_lock:
+                if self._lut is None:
+                    self._lut = self._build_lut(self.lut_bits)
+        return self._lut
+
+    def _build_lut(self, bits):
+        # One entry per quantized RGB bin. A bin is resolved only when every pixel in
+        # it gets the same answer as the exact search; otherwise it is AMBIGUOUS and
+        # those pixels fall back to the exact distance computation.
+        shift = 8 - bits
+        width = 1 << shift
+        bins = np.arange(1 << bits, dtype=np.int32) * width
+        lo = np.stack(np.meshgrid(bins, bins, bins, indexing="ij"), axis=-1).reshape(-1, 1, 3)
+        hi = lo + (width - 1)
+
+        pal = self.palette.reshape(1, -1, 3)
+        nearest = np.clip(pal, lo, hi)
+        farthest = np.where(np.abs(pal - lo) > np.abs(pal - hi), lo, hi)
+        min_sq = ((nearest - pal) ** 2).sum(axis=-1)
+        max_sq = ((farthest - pal) ** 2).sum(axis=-1)
+
+        lut = np.full(lo.shape[0], self.AMBIGUOUS, dtype=np.int8)
+        lut[(min_sq >= self.max_dist_sq).all(axis=1)] = self.NO_MATCH
+
+        # Color k owns the bin if it matches everywhere in it and beats every other
+        # color everywhere in it.
+        for k in range(len(self.hex_codes)):
+            others = np.delete(min_sq, k, axis=1)
+            owns = (max_sq[:, k] < self.max_dist_sq) & (max_sq[:, k] < others.min(axis=1))
+            lut[owns] = k
+
+        return lut.reshape((1 << bits,) * 3)
+
+    def _classify_exact(self, flat):
+        dist_sq = ((flat[:, None, :] - self.palette[None, :, :]) ** 2).sum(axis=-1)
+        idx = dist_sq.argmin(axis=1)
+        best = dist_sq[np.arange(flat.shape[0]), idx]
+        return np.where(best < self.max_dist_sq, idx, self.NO_MATCH)
+
+    def classify(self, pixels):
+        # pixels: (..., 3+) array-like of RGB(A). Returns palette indices, NO_MATCH (-1)
+        # where no palette color is within max_distance.
+        pixels = np.asarray(pixels)
+        shape = pixels.shape[:-1]
+        flat = pixels.reshape(-1, pixels.shape[-1])[:, :3].astype(np.int32)
+
+        if self.lut is None:
+            return self._classify_exact(flat).reshape(shape)
+
+        shift = 8 - self.lut_bits
+        q = flat >> shift
+        result = self.lut[q[:, 0], q[:, 1], q[:, 2]].astype(np.int32)
+        pending = result == self.AMBIGUOUS
+        if pending.any():
+            result[pending] = self._classify_exact(flat[pending])
+        return result.reshape(shape)
+
+    def closest_hex(self, pixels):
+        # Vectorized closest_color: palette hex where matched, the pixel's own hex otherwise.
+        pixels = np.asarray(pixels)
+        flat = pixels.reshape(-1, pixels.shape[-1])
+        idx = self.classify(flat)
+        return [self.hex_codes[i] if i >= 0 else rgb_to_hex(p) for i, p in zip(idx, flat)]
+
+    def closest_category(self, pixels, default="Void"):
+        idx = np.asarray(self.classify(pixels)).reshape(-1)
+        return [self.categories[i] if i >= 0 else default for i in idx]
+
+
+def within_distance(pixels, hex_color, threshold):
+    # Vectorized color_distance(pixel, hex_color) <= threshold
+    pixels = np.asarray(pixels)[..., :3].astype(np.int32)
+    target = np.array(hex_to_rgb(hex_color), dtype=np.int32)
+    return ((pixels - target) ** 2).sum(axis=-1) <= threshold * threshold
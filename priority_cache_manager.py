@@ -1,8 +1,39 @@
 import threading
+from collections import OrderedDict
 from urllib.parse import urlparse, parse_qs
 
+import numpy as np
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Bytes per band for PIL modes that are not 8-bit
+_WIDE_MODE_BAND_BYTES = {"I": 4, "F": 4, "I;16": 2, "I;16B": 2, "I;16L": 2}
+# Modes PIL stores padded to 4 bytes per pixel (probe-only decodes keep these)
+_PADDED_MODES = {"RGB", "LA", "PA", "YCbCr", "LAB", "HSV"}
+
+
+def estimate_size(value):
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if hasattr(value, "getbands") and hasattr(value, "size"):
+        width, height = value.size
+        if value.mode in _PADDED_MODES:
+            return width * height * 4
+        return width * height * len(value.getbands()) * _WIDE_MODE_BAND_BYTES.get(value.mode, 1)
+    return 0
+
+
 class PriorityCacheManager:
-    def __init__(self, original_capacity=6, scaled_capacity=12):
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, original_capacity=None, scaled_capacity=None, disk_store=None):
+        # max_bytes is the shared budget for both tiers; the capacities are optional
+        # per-tier entry-count limits on top of it. disk_store (a DiskMapStore) is an
+        # optional persistent tier consulted on original misses.
+        self.max_bytes = max_bytes
+        self.disk_store = disk_store
         self.original_capacity = original_capacity
         self.scaled_capacity = scaled_capacity
 
@@ -12,10 +43,20 @@ class PriorityCacheManager:
         self.current_er_batches = {}  # batch_number: url
         self.current_nr_batches = {}  # batch_number: url
 
-        self.original_cache = {}  # url: PIL.Image
-        self.scaled_cache = {}   # (url, scale): PIL.Image
+        # Both ordered least- to most-recently used
+        self.original_cache = OrderedDict()  # url: PIL.Image
+        self.scaled_cache = OrderedDict()   # (url, scale): PIL.Image
+        self.scaled_keys_by_url = {}  # url: set of (url, scale)
+        self.entry_sizes = {}  # ("original", url) / ("scaled", (url, scale)): bytes
+        self.current_bytes = 0
 
-        self.lock = threading.Lock()
+        self.stats = {
+            "original_hits": 0, "original_misses": 0, "disk_hits": 0,
+            "scaled_hits": 0, "scaled_misses": 0,
+            "evictions": 0, "evicted_bytes": 0, "rejected": 0
+        }
+
+        self.lock = threading.RLock()
 
     def _update_batch_tracking(self, map_type, batch_number, url):
         with self.lock:
@@ -34,46 +75,163 @@ class PriorityCacheManager:
                 if old_url:
                     self.evict_url(old_url)
 
-    def evict_url(self, url):
+    def _is_active(self, url):
+        return url in self.current_er_batches.values() or url in self.current_nr_batches.values()
+
+    def _remove_original(self, url):
         if url in self.original_cache:
             del self.original_cache[url]
-        keys_to_remove = [(u, s) for (u, s) in self.scaled_cache.keys() if u == url]
-        for key in keys_to_remove:
+            self.current_bytes -= self.entry_sizes.pop(("original", url), 0)
+
+    def _remove_scaled(self, key):
+        if key in self.scaled_cache:
             del self.scaled_cache[key]
+            self.current_bytes -= self.entry_sizes.pop(("scaled", key), 0)
+            keys = self.scaled_keys_by_url.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.scaled_keys_by_url[key[0]]
 
-    def store_original(self, url, image):
+    def evict_url(self, url):
+        with self.lock:
+            self._remove_original(url)
+            for key in list(self.scaled_keys_by_url.get(url, ())):
+                self._remove_scaled(key)
+
+    def _eviction_candidates(self):
+        # Least valuable first: entries outside the active ER/NR batches, then
+        # active ones; scaled crops before originals; LRU order within each group.
+        for active in (False, True):
+            for key in list(self.scaled_cache):
+                if self._is_active(key[0]) == active:
+                    yield "scaled", key
+            for url in list(self.original_cache):
+                if self._is_active(url) == active:
+                    yield "original", url
+
+    def _evict_one(self, tier, key):
+        size = self.entry_sizes.get((tier, key), 0)
+        if tier == "scaled":
+            self._remove_scaled(key)
+        else:
+            self._remove_original(key)
+        self.stats["evictions"] += 1
+        self.stats["evicted_bytes"] += size
+
+    def _enforce_limits(self, keep):
+        if self.original_capacity is not None:
+            while len(self.original_cache) > self.original_capacity:
+                self._evict_one("original", next(iter(self.original_cache)))
+        if self.scaled_capacity is not None:
+            while len(self.scaled_cache) > self.scaled_capacity:
+                self._evict_one("scaled", next(iter(self.scaled_cache)))
+
+        if self.current_bytes <= self.max_bytes:
+            return
+        for tier, key in self._eviction_candidates():
+            if (tier, key) == keep:
+                continue
+            self._evict_one(tier, key)
+            if self.current_bytes <= self.max_bytes:
+                return
+
+    def _insert_original(self, url, image):
         batch_number, map_type = self.parse_batch_and_type(url)
         if batch_number and map_type:
             self._update_batch_tracking(map_type, batch_number, url)
 
         with self.lock:
-            if url not in self.original_cache:
-                if len(self.original_cache) >= self.original_capacity:
-                    oldest_url = next(iter(self.original_cache))
-                    del self.original_cache[oldest_url]
-                self.original_cache[url] = image
-
-    def get_original(self, url):
+            current = self.original_cache.get(url)
+            if current is not None:
+                # Only a probe-only decode is ever replaced, by its full upgrade
+                upgrade = getattr(current, "representation", "full") == "probe" \
+                          and getattr(image, "representation", "full") != "probe"
+                if not upgrade:
+                    self.original_cache.move_to_end(url)
+                    return
+                self._remove_original(url)
+
+            size = estimate_size(image)
+            if size > self.max_bytes:
+                self.stats["rejected"] += 1
+                return
+
+            self.original_cache[url] = image
+            self.entry_sizes[("original", url)] = size
+            self.current_bytes += size
+            self._enforce_limits(keep=("original", url))
+
+    def store_original(self, url, image, content_hash=None, validators=None):
+        # content_hash (of the encoded bytes) also persists the map to the disk
+        # tier, with the response validators that let it be revalidated later
+        self._insert_original(url, image)
+        if self.disk_store is not None and content_hash:
+            self.disk_store.put(url, image, content_hash, validators)
+
+    def get_original(self, url, count=True, disk=True):
+        # count=False for re-checks that should not skew the hit/miss stats.
+        # disk=False keeps the lookup in memory: a disk hit may revalidate
+        # upstream, which callers do once per URL (inside their single flight)
         with self.lock:
-            return self.original_cache.get(url, None)
+            image = self.original_cache.get(url, None)
+            if image is not None:
+                self.original_cache.move_to_end(url)
+                if count:
+                    self.stats["original_hits"] += 1
+                return image
+
+        if disk and self.disk_store is not None:
+            image = self.disk_store.get(url)
+            if image is not None:
+                self._insert_original(url, image)
+                with self.lock:
+                    self.stats["disk_hits"] += 1
+                return image
+
+        if count:
+            with self.lock:
+                self.stats["original_misses"] += 1
+        return None
 
     def store_scaled(self, url, scale, image):
+        key = (url, scale)
         with self.lock:
-            if (url, scale) not in self.scaled_cache:
-                if len(self.scaled_cache) >= self.scaled_capacity:
-                    oldest_key = next(iter(self.scaled_cache))
-                    del self.scaled_cache[oldest_key]
-                self.scaled_cache[(url, scale)] = image
+            if key in self.scaled_cache:
+                self.scaled_cache.move_to_end(key)
+                return
+
+            size = estimate_size(image)
+            if size > self.max_bytes:
+                self.stats["rejected"] += 1
+                return
+
+            self.scaled_cache[key] = image
+            self.scaled_keys_by_url.setdefault(url, set()).add(key)
+            self.entry_sizes[("scaled", key)] = size
+            self.current_bytes += size
+            self._enforce_limits(keep=("scaled", key))
 
     def get_scaled(self, url, scale):
+        key = (url, scale)
         with self.lock:
-            return self.scaled_cache.get((url, scale), None)
+            image = self.scaled_cache.get(key, None)
+            if image is None:
+                self.stats["scaled_misses"] += 1
+                return None
+            self.scaled_cache.move_to_end(key)
+            self.stats["scaled_hits"] += 1
+            return image
 
     def get_cache_status(self):
         with self.lock:
             return {
                 "original_cache_count": len(self.original_cache),
                 "scaled_cache_count": len(self.scaled_cache),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                **self.stats,
+                "disk": self.disk_store.get_status() if self.disk_store is not None else None,
                 "active_er_batches": self.current_er_batches,
                 "active_nr_batches": self.current_nr_batches
             }
@@ -0,0 +1,134 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from priority_cache_manager import PriorityCacheManager
+
+# Per-region results of the last analyzed map of each (type, batch). Successive
+# maps of one batch usually differ in a few islands only, so a new map's
+# regions are fingerprinted (a digest of exactly the pixels, coordinates and
+# inputs the region's result depends on) and any region whose fingerprint
+# matches the previous map's reuses that map's result. Fingerprints are exact,
+# so a reused region is the result recomputing it would give.
+#
+# Regions whose computation costs no more than reading their pixels (island and
+# arrow probes) are only tracked: the response lists which of them changed.
+
+
+def region_digest(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(f"{part.shape}{part.dtype}".encode("utf-8"))
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode("utf-8"))
+        digest.update(b"|")
+    return digest.hexdigest()
+
+
+class RegionSession:
+    # One analysis of one map: looks regions up in the previous snapshot and
+    # collects the new one. Safe to use from worker threads.
+    def __init__(self, memo, key, url, context, previous, previous_url):
+        self.memo = memo
+        self.key = key
+        self.url = url
+        self.context = context
+        self.previous = previous
+        self.previous_url = previous_url
+        self.regions = {}  # name: (fingerprint, result or None)
+        self.reused = []
+        self.recomputed = []
+        self.changed = []
+        self.lock = threading.Lock()
+
+    def reuse_or_compute(self, name, fingerprint, compute, validate=None):
+        entry = self.previous.get(name)
+        if entry is not None and entry[0] == fingerprint and entry[1] is not None \
+                and (validate is None or validate(entry[1])):
+            result = entry[1]
+            outcome = self.reused
+        else:
+            result = compute()
+            outcome = self.recomputed
+        with self.lock:
+            outcome.append(name)
+            self.regions[name] = (fingerprint, result)
+        return result
+
+    def track(self, name, fingerprint):
+        entry = self.previous.get(name)
+        with self.lock:
+            if entry is None or entry[0] != fingerprint:
+                self.changed.append(name)
+            self.regions[name] = (fingerprint, None)
+
+    @property
+    def used(self):
+        return bool(self.regions)
+
+    def commit(self):
+        self.memo.store(self, self.regions)
+
+    def report(self):
+        def ordered(names):
+            # "arrow:A9" before "arrow:A10", "icon:3" before "icon:12"
+            def key(name):
+                kind, label = name.split(":", 1)
+                prefix = label.rstrip("0123456789")
+                return kind, prefix, int(label[len(prefix):] or 0)
+            return sorted(names, key=key)
+
+        with self.lock:
+            return {
+                "previous_url": self.previous_url,
+                "reused": ordered(self.reused),
+                "recomputed": ordered(self.recomputed),
+                "changed": ordered(self.changed)
+            }
+
+
+class RegionMemo:
+    def __init__(self, max_batches=6):
+        self.max_batches = max_batches
+        self.snapshots = OrderedDict()  # (type, batch): {"url", "context", "regions"}
+        self.lock = threading.Lock()
+        self.stats = {"sessions": 0, "reused": 0, "recomputed": 0}
+
+    def session(self, url, context):
+        # None for URLs without ?batch= and ?type=, which have no predecessor
+        batch, map_type = PriorityCacheManager.parse_batch_and_type(url)
+        if not batch or not map_type or self.max_batches <= 0:
+            return None
+        key = (map_type.upper(), batch)
+        with self.lock:
+            snapshot = self.snapshots.get(key)
+            self.stats["sessions"] += 1
+        if snapshot is None or snapshot["context"] != context:
+            # Different size, templates or output settings: nothing carries over
+            return RegionSession(self, key, url, context, {}, None)
+        return RegionSession(self, key, url, context, snapshot["regions"], snapshot["url"])
+
+    def store(self, session, regions):
+        with self.lock:
+            previous = self.snapshots.get(session.key)
+            if previous is not None and previous["url"] == session.url and previous["context"] == session.context:
+                # Another endpoint on the same map: keep the regions it did not touch
+                regions = {**previous["regions"], **regions}
+            self.snapshots[session.key] = {"url": session.url, "context": session.context, "regions": regions}
+            self.snapshots.move_to_end(session.key)
+            while len(self.snapshots) > self.max_batches:
+                self.snapshots.popitem(last=False)
+            self.stats["reused"] += len(session.reused)
+            self.stats["recomputed"] += len(session.recomputed)
+
+    def get_status(self):
+        with self.lock:
+            return {
+                "batches": [f"{map_type}/{batch}" for map_type, batch in self.snapshots],
+                "max_batches": self.max_batches,
+                **self.stats
+            }
@@ -0,0 +1,187 @@
+import contextvars
+import cProfile
+import hmac
+import io
+import pstats
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Opt-in deterministic profiling of a single request. A request asks for it with
+# ?profile=1 or an X-Profile: 1 header, and must carry the shared secret in
+# X-Profile-Token (or ?profile_token=). Without PROFILE_SECRET configured the
+# flag is ignored, so the hook is safe to leave deployed.
+#
+# cProfile only sees the thread that enabled it, so the request thread gets one
+# profiler and every worker pool task submitted on behalf of the request gets
+# its own (the pool runs tasks in the submitter's context, where the active
+# profile lives). They are merged when the response is closed. Stage wall times
+# come from the same metrics.stage() timers that feed /metrics.
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self, profile_id, method, path):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.created_at = time.time()
+        self.finished = None
+        self.main = cProfile.Profile()
+        self.profiles = []
+        self.stages = {}  # stage: [count, seconds]
+        self.worker_tasks = 0
+        self.skipped_tasks = 0  # another profiler already active on the thread (Python 3.12+)
+        self.status_code = None
+        self.summary = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        try:
+            self.main.enable()
+        except ValueError:
+            self.main = None
+
+    def add_stage(self, stage, seconds):
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_task_profile(self, profile):
+        with self.lock:
+            self.profiles.append(profile)
+            self.worker_tasks += 1
+
+    def stage_times(self):
+        with self.lock:
+            return {stage: {"count": count, "total_ms": round(1000 * seconds, 2)}
+                    for stage, (count, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1])}
+
+    def finish(self, top=25):
+        if self.main is not None:
+            self.main.disable()
+        self.finished = time.perf_counter()
+        with self.lock:
+            profiles = ([self.main] if self.main is not None else []) + self.profiles
+
+        functions = []
+        if profiles:
+            stats = pstats.Stats(profiles[0], stream=io.StringIO())
+            for profile in profiles[1:]:
+                stats.add(profile)
+            rows = sorted(stats.stats.items(), key=lambda item: -item[1][2])[:top]
+            for (filename, line, name), (primitive, calls, own, cumulative, _) in rows:
+                functions.append({
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "primitive_calls": primitive,
+                    "own_ms": round(1000 * own, 3),
+                    "cumulative_ms": round(1000 * cumulative, 3)
+                })
+
+        self.summary = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status_code,
+            "created_at": self.created_at,
+            "wall_ms": round(1000 * (self.finished - self.started), 2),
+            "stages": self.stage_times(),
+            "worker_tasks": self.worker_tasks,
+            "skipped_tasks": self.skipped_tasks,
+            "request_thread_profiled": self.main is not None,
+            "hottest_functions": functions
+        }
+        return self.summary
+
+
+def profiled(fn, *args, **kwargs):
+    # Runs fn under its own profiler when the calling context belongs to a
+    # profiled request; otherwise just runs it
+    profile = current_profile.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    task_profiler = cProfile.Profile()
+    try:
+        task_profiler.enable()
+    except ValueError:
+        profile.skipped_tasks += 1
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        task_profiler.disable()
+        profile.add_task_profile(task_profiler)
+
+
+def record_stage(stage, seconds):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add_stage(stage, seconds)
+
+
+class RequestProfiler:
+    def __init__(self, secret=None, max_profiles=50, top=25):
+        self.secret = secret or None
+        self.max_profiles = max_profiles
+        self.top = top
+        self.profiles = OrderedDict()  # id: RequestProfile, oldest first
+        self.lock = threading.Lock()
+        self.stats = {"started": 0, "denied": 0, "evictions": 0}
+
+    @property
+    def enabled(self):
+        return self.secret is not None
+
+    def authorized(self, token):
+        return self.enabled and token is not None and hmac.compare_digest(str(token), self.secret)
+
+    def wants_profile(self, args, headers):
+        # True only for a flagged request carrying the right secret; a flagged
+        # request without it is served normally, unprofiled
+        flag = args.get("profile") or headers.get("X-Profile")
+        if not self.enabled or flag not in ("1", "true", "yes"):
+            return False
+        if self.authorized(headers.get("X-Profile-Token") or args.get("profile_token")):
+            return True
+        self.stats["denied"] += 1
+        return False
+
+    def start(self, method, path):
+        profile = RequestProfile(uuid.uuid4().hex, method, path)
+        with self.lock:
+            self.profiles[profile.id] = profile
+            while len(self.profiles) > self.max_profiles:
+                self.profiles.popitem(last=False)
+                self.stats["evictions"] += 1
+            self.stats["started"] += 1
+        profile.start()
+        return profile
+
+    def finish(self, profile):
+        summary = profile.finish(self.top)
+        print(f"[PROFILE] {profile.method} {profile.path} -> {profile.id} ({summary['wall_ms']} ms)")
+        return summary
+
+    def get(self, profile_id):
+        # Summary dict, {"id": ..., "pending": True} while the response is still
+        # streaming, or None if unknown / evicted
+        with self.lock:
+            profile = self.profiles.get(profile_id)
+        if profile is None:
+            return None
+        return profile.summary or {"id": profile.id, "path": profile.path, "pending": True}
+
+    def get_status(self):
+        with self.lock:
+            stored = len(self.profiles)
+        return {
+            "enabled": self.enabled,
+            "stored": stored,
+            "max_profiles": self.max_profiles,
+            **self.stats
+        }
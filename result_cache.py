@@ -0,0 +1,84 @@
+import json
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def params_key(params):
+    # Canonical form of already-normalized request parameters
+    return json.dumps(params, sort_keys=True, separators=(",", ":"), default=list)
+
+
+class ResultCache:
+    # Finished endpoint results keyed by (endpoint, image content hash, params).
+    # Template-dependent results carry their bank version in params, so a
+    # recompiled bank never serves old matches. Results are JSON-ready values and are treated as
+    # immutable once stored. Re-running the sheet on a map that was already
+    # processed then costs a lookup instead of every probe and SSIM match again.
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key: (result, size), LRU order
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {}  # endpoint: {"hits", "misses", "stored"}
+
+    def _count(self, endpoint, key):
+        counts = self.stats.setdefault(endpoint, {"hits": 0, "misses": 0, "stored": 0})
+        counts[key] += 1
+
+    def get_or_compute(self, endpoint, content_hash, params, compute, validate=None):
+        # No content hash (an image that did not come through the downloader): no caching
+        if not content_hash:
+            return compute()
+
+        key = (endpoint, content_hash, params_key(params))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        # validate lets callers reject entries whose side data is gone (evicted crops)
+        if entry is not None and (validate is None or validate(entry[0])):
+            with self.lock:
+                self._count(endpoint, "hits")
+            return entry[0]
+
+        with self.lock:
+            self._count(endpoint, "misses")
+        result = compute()
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return result
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self.entries[key] = (result, size)
+            self.current_bytes += size
+            self._count(endpoint, "stored")
+            while self.entries and (self.current_bytes > self.max_bytes or len(self.entries) > self.max_entries):
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.current_bytes -= old_size
+        return result
+
+    def get_status(self):
+        with self.lock:
+            hits = sum(c["hits"] for c in self.stats.values())
+            misses = sum(c["misses"] for c in self.stats.values())
+            return {
+                "entries": len(self.entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+                "endpoints": {
+                    endpoint: {**c, "hit_rate": round(c["hits"] / (c["hits"] + c["misses"]), 4)
+                               if c["hits"] + c["misses"] else None}
+                    for endpoint, c in self.stats.items()
+                }
+            }
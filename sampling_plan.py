@@ -0,0 +1,215 @@
+import math
+import threading
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from palette_classifier import pack_rgb, pack_hex, within_distance
+
+
+def array_backed_image(array, mode):
+    # Read-only PIL image sharing memory with `array`. The array is attached as a
+    # plain attribute (not image.info, which crops and converts copy along) so
+    # probes can gather from it without another copy.
+    height, width = array.shape[:2]
+    image = Image.frombuffer(mode, (width, height), array, "raw", mode, 0, 1)
+    image.map_pixels = array
+    return image
+
+
+_pixels_lock = threading.Lock()
+
+
+def image_pixels(image):
+    pixels = getattr(image, "map_pixels", None)
+    if pixels is None:
+        with _pixels_lock:
+            pixels = getattr(image, "map_pixels", None)
+            if pixels is None:
+                pixels = np.asarray(image)
+                image.map_pixels = pixels
+    return pixels
+
+
+# Decoded modes probes can read from directly, without an RGBA copy of the frame
+SPARSE_MODES = ("RGB", "RGBA", "L", "LA", "P")
+
+
+def supports_sparse(image):
+    if image.mode not in SPARSE_MODES:
+        return False
+    return image.mode != "P" or image.palette is None or image.palette.mode == "RGB"
+
+
+def _palette(image):
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    entries = np.array(image.getpalette() or [], dtype=np.uint8).reshape(-1, 3)[:256]
+    palette[:len(entries)] = entries
+    return palette
+
+
+def read_points(image, xs, ys):
+    # (N, 3) RGB at each (x, y), read point by point from a decoded PIL image in
+    # its own mode; matches what convert("RGBA") would have held there
+    access = image.load()
+    values = [access[x, y] for x, y in zip(xs.tolist(), ys.tolist())]
+    if image.mode == "P":
+        return _palette(image)[np.array(values, dtype=np.intp)]
+    rgb = np.array(values, dtype=np.uint8).reshape(len(values), -1)
+    if rgb.shape[1] < 3:
+        rgb = np.repeat(rgb[:, :1], 3, axis=1)
+    return rgb[:, :3]
+
+
+def pixel_rgb(image, xy):
+    # image.getpixel, but always a colour tuple whatever the decoded mode
+    pixel = image.getpixel(xy)
+    if image.mode == "P":
+        return tuple(int(v) for v in _palette(image)[pixel])
+    if image.mode in ("L", "LA"):
+        value = pixel if isinstance(pixel, int) else pixel[0]
+        return (value, value, value)
+    return pixel
+
+
+# Declarative per-probe rules; each maps an (N, 3+) pixel array to a bool array.
+
+class ColorSetRule:
+    def __init__(self, hex_codes):
+        self.packed = pack_hex(hex_codes)
+
+    def evaluate(self, pixels):
+        return np.isin(pack_rgb(pixels), self.packed)
+
+
+class NearColorRule:
+    def __init__(self, hex_color, threshold):
+        self.hex_color = hex_color
+        self.threshold = threshold
+
+    def evaluate(self, pixels):
+        return within_distance(pixels, self.hex_color, self.threshold)
+
+
+class NotRule:
+    def __init__(self, rule):
+        self.rule = rule
+
+    def evaluate(self, pixels):
+        return ~self.rule.evaluate(pixels)
+
+
+class AllRule:
+    def __init__(self, *rules):
+        self.rules = rules
+
+    def evaluate(self, pixels):
+        result = np.ones(len(pixels), dtype=bool)
+        for rule in self.rules:
+            result &= rule.evaluate(pixels)
+        return result
+
+
+class SamplingPlan:
+    # Reference-layout probe points compiled for one image size: flat index arrays
+    # plus named groups (slices into them). Probes that fall outside the image are
+    # marked invalid and read as black.
+    def __init__(self, width, height, xs, ys, groups):
+        self.width = width
+        self.height = height
+        self.xs = np.asarray(xs, dtype=np.int64)
+        self.ys = np.asarray(ys, dtype=np.int64)
+        self.valid = (self.xs >= 0) & (self.xs < width) & (self.ys >= 0) & (self.ys < height)
+        self.safe_xs = np.where(self.valid, self.xs, 0)
+        self.safe_ys = np.where(self.valid, self.ys, 0)
+        self.groups = groups
+
+    def gather(self, image):
+        # One fancy-indexing read for every probe -> (N, 3) uint8 RGB. Probe-only
+        # decodes have no pixel array; read just the probed points from them.
+        if getattr(image, "representation", None) == "probe":
+            rgb = read_points(image, self.safe_xs, self.safe_ys)
+        else:
+            pixels = image_pixels(image)
+            if pixels.ndim == 2:
+                pixels = pixels[..., None]
+            rgb = pixels[self.safe_ys, self.safe_xs][:, :3]
+            if rgb.shape[1] < 3:
+                rgb = np.repeat(rgb[:, :1], 3, axis=1)
+        rgb = np.array(rgb, dtype=np.uint8)
+        rgb[~self.valid] = 0
+        return rgb
+
+    def group(self, name):
+        return self.groups[name]
+
+
+def _scaled(values, scale):
+    # Same truncation as int(v * scale) on each coordinate
+    return (np.asarray(values, dtype=np.float64) * scale).astype(np.int64)
+
+
+@lru_cache(maxsize=64)
+def compile_island_plan(width, height, scale, centers, combat_points):
+    # centers: ((bgX, bgY) or None, ...); combat_points: ((bossX, bossY, minionX, minionY), ...)
+    n = len(centers)
+    xs = np.zeros(3 * n)
+    ys = np.zeros(3 * n)
+    usable = np.zeros(n, dtype=bool)
+    for i, center in enumerate(centers):
+        if center is None or i >= len(combat_points):
+            continue
+        usable[i] = True
+        xs[i], ys[i] = center
+        xs[n + i], ys[n + i], xs[2 * n + i], ys[2 * n + i] = combat_points[i]
+
+    xs, ys = _scaled(xs, scale), _scaled(ys, scale)
+    # Malformed centers and islands without combat points can never be
+    # classified; push them off-image
+    for group in range(3):
+        xs[group * n:(group + 1) * n][~usable] = -1
+    return SamplingPlan(width, height, xs, ys, {
+        "island": slice(0, n),
+        "boss": slice(n, 2 * n),
+        "minion": slice(2 * n, 3 * n)
+    })
+
+
+@lru_cache(maxsize=64)
+def compile_arrow_plan(width, height, scale, points_a, points_d):
+    # points_*: tuple of None (for 'x') or ((x1, y1), (x2, y2))
+    xs, ys, groups, start = [], [], {}, 0
+    for name, table in (("A", points_a), ("D", points_d)):
+        for entry in table:
+            if entry is not None:
+                for x, y in entry:
+                    xs.append(x)
+                    ys.append(y)
+        groups[name] = slice(start, len(xs))
+        start = len(xs)
+    return SamplingPlan(width, height, _scaled(xs, scale), _scaled(ys, scale), groups)
+
+
+def _coordinate(value):
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return value
+    return None
+
+
+def freeze_centers(centers):
+    # Entries without finite numeric bgX / bgY freeze to None; their island
+    # classifies as Void instead of failing the request
+    frozen = []
+    for c in centers:
+        xy = (_coordinate(c.get("bgX")), _coordinate(c.get("bgY"))) if isinstance(c, dict) else (None, None)
+        frozen.append(None if None in xy else xy)
+    return tuple(frozen)
+
+
+def freeze_combat_points(points):
+    return tuple((p["bossX"], p["bossY"], p["minionX"], p["minionY"]) for p in points)
+
+
+def freeze_arrow_points(points):
+    return tuple(None if entry == "x" else tuple(tuple(xy) for xy in entry) for entry in points)
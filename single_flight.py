@@ -0,0 +1,57 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key into one execution. Callers that
+    # arrive while a call is in flight wait for it and get its result, or re-raise
+    # its exception. Nothing is kept once the call finishes, so failures are never
+    # cached and the next caller after completion starts a fresh call.
+    def __init__(self, name="single_flight"):
+        self.name = name
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.stats = {"executed": 0, "shared": 0, "failed": 0}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats["shared"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                self.stats["executed"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self.lock:
+                self.stats["failed"] += 1
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+
+    def get_status(self):
+        with self.lock:
+            return {**self.stats, "in_flight": len(self.calls)}
@@ -0,0 +1,198 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Scores reproduce skimage.metrics.structural_similarity with its defaults for
+# 2-D uint8 input (7x7 uniform window, K1=0.01, K2=0.03, sample covariance,
+# data_range=255) to within SSIM_TOLERANCE; the only drift is float rounding
+# in OpenCV's running box sums.
+SSIM_TOLERANCE = 1e-9
+
+
+def _box_mean(a, win_size):
+    # Mean over every full win_size x win_size window of the last two axes
+    # ("valid" region, i.e. what skimage keeps after cropping the border).
+    # All planes are stacked into one tall image for a single OpenCV call; the
+    # rows where neighbouring planes bleed into each other are cropped away.
+    import cv2  # deferred: only matching needs OpenCV
+
+    h, w = a.shape[-2:]
+    pad = win_size // 2
+    tall = np.ascontiguousarray(a, dtype=np.float64).reshape(-1, w)
+    filtered = cv2.boxFilter(tall, -1, (win_size, win_size), normalize=True, borderType=cv2.BORDER_REFLECT)
+    filtered = filtered.reshape(-1, h, w)[:, pad:h - pad, pad:w - pad]
+    return filtered.reshape(a.shape[:-2] + filtered.shape[-2:])
+
+
+class BatchedSSIMMatcher:
+    def __init__(self, templates, win_size=7, data_range=255, K1=0.01, K2=0.03, chunk_size=8, window_mask=None,
+                 stats=None, pyramid_levels=8, level_source=None):
+        # templates: name -> 2-D array, all the same shape. window_mask (same shape,
+        # nonzero = used) limits correlation_peaks to the icon's footprint. stats:
+        # precomputed (uy, vy) planes in sorted-name order, e.g. from a template bank.
+        # pyramid_levels: how many resampled copies at_size() keeps (LRU).
+        # level_source: size -> (templates, window_mask) built from the original
+        # icons; without it levels are resampled from these templates.
+        self.names = sorted(templates.keys())
+        self.win_size = win_size
+        self.data_range = data_range
+        self.K1 = K1
+        self.K2 = K2
+        self.chunk_size = chunk_size
+        self.C1 = (K1 * data_range) ** 2
+        self.C2 = (K2 * data_range) ** 2
+        self.cov_norm = win_size * win_size / (win_size * win_size - 1.0)
+
+        if self.names:
+            self.templates = np.stack([np.asarray(templates[n], dtype=np.float64) for n in self.names])
+        else:
+            self.templates = np.zeros((0, win_size, win_size))
+        self.shape = self.templates.shape[1:]
+
+        # Per-template filtered planes, computed once
+        if stats is not None:
+            self.uy, self.vy = stats
+        else:
+            self.uy = _box_mean(self.templates, win_size)
+            self.vy = self.cov_norm * (_box_mean(self.templates * self.templates, win_size) - self.uy * self.uy)
+        self.uy_sq = self.uy * self.uy
+
+        self.templates_f32 = self.templates.astype(np.float32)
+        self.window_mask = None if window_mask is None else (np.asarray(window_mask) > 0).astype(np.float32)
+        self.pyramid_levels = pyramid_levels
+        self.level_source = level_source
+        self._levels = OrderedDict()  # size: BatchedSSIMMatcher, least recently used first
+        self._levels_lock = threading.Lock()
+
+    def score_stack(self, crops):
+        # crops: (S, H, W) -> (S, T) SSIM of every crop against every template
+        crops = np.asarray(crops, dtype=np.float64)
+        if crops.shape[1:] != self.shape:
+            raise ValueError("Input images must have the same dimensions.")
+
+        scores = np.empty((crops.shape[0], len(self.names)))
+        for start in range(0, crops.shape[0], self.chunk_size):
+            x = crops[start:start + self.chunk_size]
+            ux = _box_mean(x, self.win_size)
+            vx = self.cov_norm * (_box_mean(x * x, self.win_size) - ux * ux)
+            ux = ux[:, None]
+            vx = vx[:, None]
+
+            uxy = _box_mean(x[:, None] * self.templates[None], self.win_size)
+            vxy = self.cov_norm * (uxy - ux * self.uy)
+
+            num = (2 * ux * self.uy + self.C1) * (2 * vxy + self.C2)
+            den = (ux * ux + self.uy_sq + self.C1) * (vx + self.vy + self.C2)
+            scores[start:start + self.chunk_size] = (num / den).mean(axis=(-2, -1))
+
+        return scores
+
+    def score_pairs(self, crops, crop_index, template_index):
+        # SSIM of crops[crop_index[i]] against template template_index[i] only -> (P,)
+        crops = np.asarray(crops, dtype=np.float64)
+        if crops.shape[1:] != self.shape:
+            raise ValueError("Input images must have the same dimensions.")
+        crop_index = np.asarray(crop_index)
+        template_index = np.asarray(template_index)
+
+        # Crop statistics once per crop, then gathered per pair
+        ux_all = _box_mean(crops, self.win_size)
+        vx_all = self.cov_norm * (_box_mean(crops * crops, self.win_size) - ux_all * ux_all)
+
+        scores = np.empty(len(crop_index))
+        step = self.chunk_size * max(len(self.names), 1)  # as many planes per pass as score_stack
+        for start in range(0, len(crop_index), step):
+            ci = crop_index[start:start + step]
+            ti = template_index[start:start + step]
+            ux, vx = ux_all[ci], vx_all[ci]
+            uy, vy = self.uy[ti], self.vy[ti]
+
+            uxy = _box_mean(crops[ci] * self.templates[ti], self.win_size)
+            vxy = self.cov_norm * (uxy - ux * uy)
+
+            num = (2 * ux * uy + self.C1) * (2 * vxy + self.C2)
+            den = (ux * ux + uy * uy + self.C1) * (vx + vy + self.C2)
+            scores[start:start + step] = (num / den).mean(axis=(-2, -1))
+
+        return scores
+
+    def score(self, crop):
+        # One crop -> (T,) scores in self.names order
+        return self.score_stack(np.asarray(crop)[None])[0]
+
+    def best_match(self, crop, threshold=0.85):
+        scores = self.score(crop)
+        if scores.size == 0:
+            return {"label": "other", "score": -1}
+        best = int(scores.argmax())
+        best_score = float(scores[best])
+        return {
+            "label": self.names[best] if best_score >= threshold else "other",
+            "score": best_score
+        }
+
+    def at_size(self, size):
+        # A matcher over these templates at size x size, with its own SSIM
+        # statistics, so crops of that size are scored without resizing them.
+        # Built once per size (from level_source when there is one) and kept in
+        # a small LRU.
+        if size == self.shape[0] == self.shape[1]:
+            return self
+        with self._levels_lock:
+            level = self._levels.get(size)
+            if level is not None:
+                self._levels.move_to_end(size)
+                return level
+
+        if self.level_source is not None:
+            templates, mask = self.level_source(size)
+        else:
+            import cv2
+            templates = {name: cv2.resize(t, (size, size), interpolation=cv2.INTER_LINEAR)
+                         for name, t in zip(self.names, self.templates_f32)}
+            mask = None
+            if self.window_mask is not None:
+                mask = cv2.resize(self.window_mask, (size, size), interpolation=cv2.INTER_NEAREST)
+        level = BatchedSSIMMatcher(templates, self.win_size, self.data_range, self.K1, self.K2, self.chunk_size,
+                                   window_mask=mask, pyramid_levels=0)
+
+        with self._levels_lock:
+            level = self._levels.setdefault(size, level)
+            self._levels.move_to_end(size)
+            while len(self._levels) > self.pyramid_levels:
+                self._levels.popitem(last=False)
+        return level
+
+    def _templates_at(self, size):
+        # Templates (and window mask) resampled to size x size
+        level = self.at_size(size)
+        return level.templates_f32, level.window_mask
+
+    def pyramid_sizes(self):
+        with self._levels_lock:
+            return list(self._levels)
+
+    def correlation_peaks(self, region, size=None):
+        # Slide every template, resampled to size x size (default: native), over a
+        # region slightly larger than that with normalized cross-correlation.
+        # Returns ((T, 2) best (x, y) positions, (T,) peak values).
+        import cv2
+
+        region = np.asarray(region, dtype=np.float32)
+        templates, mask = self._templates_at(size) if size else (self.templates_f32, self.window_mask)
+        if region.shape[0] < templates.shape[1] or region.shape[1] < templates.shape[2]:
+            raise ValueError("Search region is smaller than the templates.")
+
+        positions = np.zeros((len(self.names), 2), dtype=np.int64)
+        peaks = np.full(len(self.names), -1.0)
+        for i, template in enumerate(templates):
+            if mask is None:
+                response = cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED)
+            else:
+                response = cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED, mask=mask)
+            response = np.nan_to_num(response, nan=-1.0, posinf=-1.0, neginf=-1.0)
+            _, peak, _, loc = cv2.minMaxLoc(response)
+            positions[i] = loc
+            peaks[i] = peak
+        return positions, peaks
@@ -0,0 +1,285 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from crop_geometry import shape_mask
+from ssim_matcher import BatchedSSIMMatcher, _box_mean
+from template_prefilter import FEATURE_NAMES, FEATURE_VERSION, TemplatePrefilter, describe
+
+# A compiled bank is one file per icon directory holding the 118 px grayscale
+# templates, their SSIM statistics and prefilter descriptors, so a process never decodes or resizes a
+# PNG at startup: the first match memory-maps the file and wraps it in a
+# BatchedSSIMMatcher. Build them with
+#
+#   python template_bank.py            (iconsER -> template_banks/er.bank, iconsNR -> nr.bank)
+#
+# A bank that is missing or older than its icon directory is rebuilt on first use.
+#
+# File layout: MAGIC, uint64 header length, JSON header, then 64-byte aligned
+# raw arrays described by the header.
+
+MAGIC = b"TBANK001"
+TEMPLATE_SIZE = 118
+WIN_SIZE = 7
+ALIGN = 64
+BANK_DIR = os.environ.get("TEMPLATE_BANK_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "template_banks"))
+
+# map type (from the URL's ?type=) -> icon directory
+ICON_DIRS = {"ER": "iconsER", "NR": "iconsNR"}
+# Per-size resampled template sets kept by each matcher (crop sizes seen recently)
+PYRAMID_LEVELS = int(os.environ.get("TEMPLATE_PYRAMID_LEVELS", 8))
+DEFAULT_TYPE = "ER"
+
+
+def template_bank_version(templates):
+    # templates: {name: 2-D uint8 array}. Changes whenever any template is added,
+    # removed, renamed or altered.
+    digest = hashlib.sha256()
+    for name in sorted(templates):
+        array = templates[name]
+        digest.update(f"{name}:{array.shape}:".encode("utf-8"))
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _sources(directory):
+    # (file name, size, mtime) of every icon; a bank whose list differs is stale
+    entries = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.png"))):
+        st = os.stat(path)
+        entries.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+    return entries
+
+
+def load_sources(directory):
+    # name -> grayscale PIL image of every icon, at its original size
+    return {os.path.basename(path).split(".")[0]: Image.open(path).convert("L")
+            for path in sorted(glob.glob(os.path.join(directory, "*.png")))}
+
+
+def resize_sources(sources, size):
+    # The one resampling every template size gets, the compiled 118 px set included
+    return {name: np.array(image.resize((size, size))) for name, image in sources.items()}
+
+
+def compile_arrays(directory, size=TEMPLATE_SIZE, win_size=WIN_SIZE):
+    templates = resize_sources(load_sources(directory), size)
+
+    names = sorted(templates)
+    stack = np.stack([templates[n] for n in names]) if names else np.zeros((0, size, size), dtype=np.uint8)
+    as_float = stack.astype(np.float64)
+    cov_norm = win_size * win_size / (win_size * win_size - 1.0)
+    uy = _box_mean(as_float, win_size)
+    vy = cov_norm * (_box_mean(as_float * as_float, win_size) - uy * uy)
+    # Descriptors of the templates as preprocess_crop would leave them (contrast x1.5)
+    boosted = np.stack([np.array(ImageEnhance.Contrast(Image.fromarray(t)).enhance(1.5)) for t in stack]) \
+        if names else stack
+    features = describe(boosted)
+
+    header = {
+        "version": template_bank_version(templates),
+        "size": size,
+        "win_size": win_size,
+        "features": FEATURE_VERSION,
+        "names": names,
+        "sources": _sources(directory),
+        "compiled_at": time.time()
+    }
+    return header, {"templates": stack, "uy": uy, "vy": vy, **features}
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_bank(path, header, arrays):
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset = _aligned(offset + array.nbytes)
+
+    header = {**header, "arrays": layout}
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp, path)
+    return header
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a template bank")
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    header["data_start"] = _aligned(len(MAGIC) + 8 + length)
+    return header
+
+
+def map_bank(path, header):
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if not np.prod(shape):
+            arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+            continue
+        arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r", shape=shape,
+                                 offset=header["data_start"] + spec["offset"])
+    return arrays
+
+
+class TemplateBank:
+    # One icon set, opened on first use. `matcher` is the BatchedSSIMMatcher over
+    # the mapped arrays; `version` identifies the template contents (result cache
+    # keys include it); `prefilter(top_k, margin)` shortlists templates per crop.
+    def __init__(self, map_type, source_dir, path, size=TEMPLATE_SIZE):
+        self.map_type = map_type
+        self.source_dir = source_dir
+        self.path = path
+        self.size = size
+        self.lock = threading.Lock()
+        self._matcher = None
+        self.features = None  # prefilter descriptors, loaded with the matcher
+        self.header = None
+        self.load_ms = None
+        self.compiled = False
+        self._sources = None  # original icons, decoded for the first pyramid level
+
+    def _stale(self, header):
+        return (header.get("size") != self.size or header.get("win_size") != WIN_SIZE
+                or header.get("features") != FEATURE_VERSION
+                or header.get("sources") != _sources(self.source_dir))
+
+    def _load(self):
+        started = time.perf_counter()
+        header = None
+        try:
+            header = read_header(self.path)
+            if self._stale(header):
+                print(f"[TEMPLATE BANK] {self.path} is out of date with {self.source_dir}, recompiling")
+                header = None
+        except (FileNotFoundError, ValueError):
+            pass
+
+        if header is None:
+            header, arrays = compile_arrays(self.source_dir, self.size)
+            self.compiled = True
+            try:
+                write_bank(self.path, header, arrays)
+                header = read_header(self.path)
+                arrays = map_bank(self.path, header)
+            except OSError as e:
+                # Read-only deploy: keep the freshly compiled arrays in memory
+                print(f"[TEMPLATE BANK] Could not write {self.path}: {e}")
+        else:
+            arrays = map_bank(self.path, header)
+
+        templates = {name: arrays["templates"][i] for i, name in enumerate(header["names"])}
+        matcher = BatchedSSIMMatcher(
+            templates,
+            win_size=header["win_size"],
+            window_mask=np.array(shape_mask("diamond", self.size // 2)),
+            stats=(arrays["uy"], arrays["vy"]),
+            pyramid_levels=PYRAMID_LEVELS,
+            level_source=self.level
+        )
+        self.features = {name: arrays[name] for name in FEATURE_NAMES}
+        self.header = header
+        self.load_ms = round(1000 * (time.perf_counter() - started), 2)
+        print(f"[TEMPLATE BANK] {self.map_type}: {len(header['names'])} templates, version {header['version']} ({self.load_ms} ms)")
+        return matcher
+
+    def level(self, size):
+        # Templates and window mask for matcher.at_size(size), resampled from the
+        # original icons rather than from the 118 px templates. If the icons on
+        # disk no longer match the loaded bank, the compiled templates are used.
+        with self.lock:
+            if self._sources is None:
+                if _sources(self.source_dir) == self.header["sources"]:
+                    self._sources = load_sources(self.source_dir)
+                else:
+                    print(f"[TEMPLATE BANK] {self.source_dir} changed since load; pyramid uses compiled templates")
+                    self._sources = {name: Image.fromarray(np.asarray(t)) for name, t in
+                                     zip(self.header["names"], self._matcher.templates.astype(np.uint8))}
+            sources = self._sources
+        mask = shape_mask("diamond", size // 2)
+        if mask.size != (size, size):  # odd sizes
+            mask = mask.resize((size, size), Image.NEAREST)
+        return resize_sources(sources, size), np.array(mask)
+
+    @property
+    def matcher(self):
+        matcher = self._matcher
+        if matcher is None:
+            with self.lock:
+                if self._matcher is None:
+                    self._matcher = self._load()
+                matcher = self._matcher
+        return matcher
+
+    def prefilter(self, top_k, margin=0.0):
+        self.matcher
+        return TemplatePrefilter(self.features, top_k, margin)
+
+    @property
+    def version(self):
+        self.matcher
+        return self.header["version"]
+
+    def get_status(self):
+        if self._matcher is None:
+            return {"loaded": False, "path": self.path, "source_dir": self.source_dir}
+        return {
+            "loaded": True,
+            "path": self.path,
+            "source_dir": self.source_dir,
+            "version": self.header["version"],
+            "templates": len(self.header["names"]),
+            "load_ms": self.load_ms,
+            "pyramid_sizes": self._matcher.pyramid_sizes(),
+            "compiled_on_load": self.compiled
+        }
+
+
+def default_banks(root=None, bank_dir=BANK_DIR):
+    root = root or os.path.dirname(os.path.abspath(__file__))
+    return {
+        map_type: TemplateBank(map_type, os.path.join(root, directory), os.path.join(bank_dir, f"{map_type.lower()}.bank"))
+        for map_type, directory in ICON_DIRS.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile icon directories into template bank files.")
+    parser.add_argument("--out-dir", default=BANK_DIR)
+    parser.add_argument("--size", type=int, default=TEMPLATE_SIZE)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    for map_type, directory in ICON_DIRS.items():
+        header, arrays = compile_arrays(os.path.join(root, directory), args.size)
+        path = os.path.join(args.out_dir, f"{map_type.lower()}.bank")
+        write_bank(path, header, arrays)
+        print(f"{map_type}: {len(header['names'])} templates from {directory} -> {path} (version {header['version']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import numpy as np
+
+# Cheap descriptors that shortlist templates before SSIM. Every template gets
+#   phash  64-bit DCT hash of a 32x32 thumbnail (8x8 low frequencies vs median)
+#   hist   16-bin intensity histogram
+#   thumb  zero-mean, unit-norm 8x8 thumbnail (cosine = low-res correlation)
+# at bank build time; each preprocessed crop is described the same way and
+# only its top_k nearest templates (plus any within `margin` of the k-th) are
+# scored with SSIM. Templates are described after the same contrast boost the
+# crops get, so the histograms are comparable.
+
+FEATURE_VERSION = 1
+HASH_SIZE = 32
+HASH_LOW = 8
+HIST_BINS = 16
+THUMB_SIZE = 8
+FEATURE_NAMES = ("phash", "hist", "thumb")
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SIZE)
+
+
+def _resize_stack(stack, size):
+    import cv2  # deferred: only matching needs OpenCV
+    return np.stack([cv2.resize(plane, (size, size), interpolation=cv2.INTER_AREA) for plane in stack])
+
+
+def describe(stack):
+    # (N, H, W) uint8 grayscale -> {"phash": (N, 64) bool, "hist": (N, 16), "thumb": (N, 64)}
+    stack = np.asarray(stack)
+    n = len(stack)
+    if n == 0:
+        return {"phash": np.zeros((0, HASH_LOW * HASH_LOW), dtype=bool),
+                "hist": np.zeros((0, HIST_BINS), dtype=np.float32),
+                "thumb": np.zeros((0, THUMB_SIZE * THUMB_SIZE), dtype=np.float32)}
+    as_float = stack.astype(np.float32)
+
+    small = _resize_stack(as_float, HASH_SIZE)
+    low = (_DCT @ small @ _DCT.T)[:, :HASH_LOW, :HASH_LOW].reshape(n, -1)
+    phash = low > np.median(low[:, 1:], axis=1, keepdims=True)  # DC term left out of the median
+
+    bins = (stack.reshape(n, -1).astype(np.uint16) * HIST_BINS) >> 8
+    hist = np.stack([np.bincount(row, minlength=HIST_BINS) for row in bins]).astype(np.float32)
+    hist /= hist.sum(axis=1, keepdims=True)
+
+    thumb = _resize_stack(as_float, THUMB_SIZE).reshape(n, -1)
+    thumb -= thumb.mean(axis=1, keepdims=True)
+    thumb /= np.linalg.norm(thumb, axis=1, keepdims=True) + 1e-6
+    return {"phash": phash, "hist": hist, "thumb": thumb}
+
+
+def distances(crops, templates):
+    # Feature dicts -> (S, T) distances, each term scaled to [0, 1] and summed
+    hash_term = (crops["phash"][:, None] != templates["phash"][None]).mean(axis=-1)
+    hist_term = 0.5 * np.abs(crops["hist"][:, None] - templates["hist"][None]).sum(axis=-1)
+    thumb_term = (1.0 - crops["thumb"] @ np.asarray(templates["thumb"]).T) / 2.0
+    return hash_term + hist_term + thumb_term
+
+
+class TemplatePrefilter:
+    def __init__(self, features, top_k, margin=0.0):
+        # features: the bank's template descriptors; top_k <= 0 disables the stage
+        self.features = features
+        self.count = len(features["phash"])
+        self.top_k = top_k
+        self.margin = margin
+
+    @property
+    def active(self):
+        return 0 < self.top_k < self.count
+
+    def shortlist(self, crops):
+        # (S, H, W) preprocessed crops -> (crop index, template index) arrays of
+        # the pairs worth scoring with SSIM
+        d = distances(describe(crops), self.features)
+        kth = np.partition(d, self.top_k - 1, axis=1)[:, self.top_k - 1:self.top_k]
+        keep = d <= kth + self.margin
+        return np.nonzero(keep)
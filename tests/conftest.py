@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the service modules from the repository root. Importing app must
+# not start warm-up threads or touch a disk tier.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WARMUP", "off")
+os.environ.setdefault("MAP_STORE_DIR", "")
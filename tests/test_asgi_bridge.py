@@ -0,0 +1,68 @@
+import asyncio
+
+import httpx
+
+import asgi_app
+
+
+def request(bridge, path):
+    async def go():
+        transport = httpx.ASGITransport(app=bridge)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.wait_for(client.get(path), 10)
+    return asyncio.run(go())
+
+
+def test_view_raising_before_start_response_answers_500():
+    def failing_view(environ, start_response):
+        raise RuntimeError("view exploded")
+
+    response = request(asgi_app.AsgiBridge(failing_view), "/anything")
+    assert response.status_code == 500
+    assert response.json() == {"error": "view exploded"}
+
+
+def test_streamed_chunks_arrive_in_order():
+    def streaming_view(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"a", b"", b"b", b"c"]
+
+    response = request(asgi_app.AsgiBridge(streaming_view), "/")
+    assert response.status_code == 200
+    assert response.text == "abc"
+
+
+def test_asgi_status_is_registered_by_the_factory():
+    import app as service
+
+    bridge = asgi_app.create_app()
+    assert service.app.extensions["asgi_bridge"] is bridge
+    response = request(bridge, "/asgi_status")
+    assert response.status_code == 200
+    assert response.json()["in_flight"] == 0
+
+
+def test_view_failing_mid_body_still_ends_the_response():
+    def broken_stream(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/x-ndjson")])
+        yield b"first\n"
+        raise RuntimeError("worker died")
+
+    sent = []
+
+    async def go():
+        messages = iter([{"type": "http.request", "body": b"", "more_body": False}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": []}
+        await asyncio.wait_for(asgi_app.AsgiBridge(broken_stream)(scope, receive, send), 10)
+
+    asyncio.run(go())
+    assert sent[0]["status"] == 200
+    assert [m.get("body") for m in sent[1:]] == [b"first\n", b""]
+    assert sent[-1]["more_body"] is False
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import map_analysis
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_worker_loads_banks_without_the_flask_app():
+    code = ("import sys, batch_worker; batch_worker._init_worker(); "
+            "print('app' in sys.modules, 'flask' in sys.modules, "
+            "all(b._matcher is not None for b in batch_worker._analysis.template_banks.values()))")
+    env = {**os.environ, "WARMUP": "off", "MAP_STORE_DIR": ""}
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.split()[-3:] == ["False", "False", "True"]
+
+
+def test_icons_are_matched_inline_without_a_pool(monkeypatch):
+    threads = set()
+
+    def pair(img, idx, category, output=None):
+        threads.add(threading.current_thread())
+        return {"left": {}, "right": {}}
+
+    monkeypatch.setattr(map_analysis, "match_decision_icon_pair", pair)
+    icons = map_analysis.match_decision_icons(None, ["shop"] * 25)
+    assert len(icons) == 25
+    assert threads == {threading.current_thread()}
+
+
+def test_batch_rejects_a_map_with_the_wrong_number_of_centers(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app.batch_worker, "get_pool", lambda: pytest.fail("no map should be analyzed"))
+    centers = [dict(c) for c in map_analysis.islandCenters[:3]]
+    response = app.app.test_client().post("/analyze_batch", json={"maps": [
+        "http://maps.test/a.png", {"image_url": "http://maps.test/b.png", "islandCenters": centers}
+    ]})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "maps[1]: islandCenters must be a 25-item list"}
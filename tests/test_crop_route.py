@@ -0,0 +1,23 @@
+import pytest
+from PIL import Image
+
+import app
+from crop_artifacts import CropOutput
+
+
+@pytest.fixture
+def crop_id():
+    rendered = app.crop_store.render(Image.new("RGB", (8, 8), "red"), CropOutput(inline=False))
+    return rendered["crop_id"]
+
+
+@pytest.mark.parametrize("header", ['{id}', '"{id}"', 'W/"{id}"', '"other", "{id}"', '"other",W/"{id}"', "*"])
+def test_matching_if_none_match_answers_304(crop_id, header):
+    response = app.app.test_client().get(f"/crops/{crop_id}", headers={"If-None-Match": header.format(id=crop_id)})
+    assert response.status_code == 304
+
+
+def test_other_etag_gets_the_body(crop_id):
+    response = app.app.test_client().get(f"/crops/{crop_id}", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == f'"{crop_id}"'
@@ -0,0 +1,69 @@
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from disk_map_store import DiskMapStore
+
+BLOB_BYTES = 128 + 20 * 20 * 4  # .npy header plus a 20x20 RGBA map
+
+
+def rgba(value):
+    return Image.new("RGBA", (20, 20), (value, 0, 0, 255))
+
+
+def blob_files(root):
+    return sorted(os.listdir(os.path.join(root, "blobs")))
+
+
+def test_hit_is_memory_mapped_with_the_stored_pixels(tmp_path):
+    store = DiskMapStore(str(tmp_path))
+    assert not os.path.exists(tmp_path / "blobs")  # nothing is created before the first write
+    store.put("http://maps.test/a.png", rgba(7), "aa")
+
+    image = store.get("http://maps.test/a.png")
+    assert isinstance(image.map_pixels, np.memmap)
+    assert np.array_equal(np.asarray(image), np.asarray(rgba(7)))
+    assert (image.content_hash, image.source_url) == ("aa", "http://maps.test/a.png")
+    assert store.get("http://maps.test/b.png") is None
+    assert (store.stats["hits"], store.stats["misses"]) == (1, 1)
+
+
+def test_oldest_blob_is_evicted_past_the_cap(tmp_path):
+    store = DiskMapStore(str(tmp_path), max_bytes=2 * BLOB_BYTES)
+    for i, digest in enumerate(("aa", "bb", "cc")):
+        store.put(f"http://maps.test/{digest}.png", rgba(i), digest)
+        os.utime(store._blob_path(digest), (time.time() - 100 + i, time.time() - 100 + i))
+
+    store.put("http://maps.test/dd.png", rgba(3), "dd")
+    assert blob_files(tmp_path) == ["cc.npy", "dd.npy"]
+    assert store.get("http://maps.test/aa.png") is None
+    assert not os.path.exists(store._url_path("http://maps.test/aa.png"))  # its record went with it
+
+
+def test_cap_holds_across_stores_sharing_a_directory(tmp_path):
+    # One store per process (the service and each batch worker) over one directory
+    stores = [DiskMapStore(str(tmp_path), max_bytes=2 * BLOB_BYTES) for _ in range(3)]
+    for i, store in enumerate(stores):
+        store.put(f"http://maps.test/{i}.png", rgba(i), f"{i:02d}")
+        store.put(f"http://maps.test/{i}b.png", rgba(100 + i), f"{i:02d}b")
+
+    total = sum(os.path.getsize(tmp_path / "blobs" / name) for name in blob_files(tmp_path))
+    assert total <= 2 * BLOB_BYTES
+
+
+def test_stale_hit_is_served_only_after_revalidation(tmp_path):
+    checks = []
+    answers = iter([True, False])
+    store = DiskMapStore(str(tmp_path), max_age=60,
+                         revalidate=lambda url, etag, last_modified: checks.append(etag) or next(answers))
+    url = "http://maps.test/a.png"
+    store.put(url, rgba(1), "aa", {"etag": '"v1"', "fetched_at": time.time() - 120})
+
+    assert store.get(url) is not None  # revalidated, and trusted for another max_age
+    assert store.get(url) is not None
+    store.put(url, rgba(1), "aa", {"etag": '"v1"', "fetched_at": time.time() - 120})
+    assert store.get(url) is None  # changed upstream
+    assert checks == ['"v1"', '"v1"']
+    assert (store.stats["revalidated"], store.stats["stale"]) == (1, 1)
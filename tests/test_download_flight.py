@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+import map_analysis
+
+
+class Decoded:
+    def __init__(self, representation):
+        self.representation = representation
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    calls = []
+
+    def fake_fetch_and_decode(image_url, need="full"):
+        calls.append(need)
+        time.sleep(0.2)
+        return Decoded(need)
+
+    monkeypatch.setattr(map_analysis, "fetch_and_decode", fake_fetch_and_decode)
+    monkeypatch.setattr(map_analysis.priority_cache, "get_original", lambda url, count=True, disk=True: None)
+    return calls
+
+
+def run_concurrently(first, second):
+    results = {}
+    threads = [threading.Thread(target=lambda: results.setdefault("first", first()))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=lambda: results.setdefault("second", second())))
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_probe_caller_joins_an_in_flight_full_decode(decodes):
+    url = "http://maps.test/a.png"
+    results = run_concurrently(lambda: map_analysis.download_image(url, "full"), lambda: map_analysis.download_image(url, "probe"))
+    assert decodes == ["full"]
+    assert results["first"] is results["second"]
+
+
+def test_full_caller_does_not_accept_a_probe_decode(decodes):
+    url = "http://maps.test/b.png"
+    results = run_concurrently(lambda: map_analysis.download_image(url, "probe"), lambda: map_analysis.download_image(url, "full"))
+    assert decodes == ["probe", "full"]
+    assert results["first"].representation == "probe"
+    assert results["second"].representation == "full"
+
+
+def test_stale_disk_hit_is_revalidated_once_per_flight(monkeypatch, tmp_path):
+    from PIL import Image
+
+    from disk_map_store import DiskMapStore
+    from priority_cache_manager import PriorityCacheManager
+
+    checks = []
+
+    def revalidate(url, etag, last_modified):
+        checks.append(url)
+        time.sleep(0.2)
+        return True
+
+    store = DiskMapStore(str(tmp_path), max_age=60, revalidate=revalidate)
+    url = "http://maps.test/stale.png"
+    store.put(url, Image.new("RGBA", (8, 8)), "aa", {"etag": '"v1"', "fetched_at": time.time() - 120})
+    monkeypatch.setattr(map_analysis, "priority_cache", PriorityCacheManager(disk_store=store))
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(map_analysis.download_image(url))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert checks == [url]
+    assert len(results) == 4 and all(r.content_hash == "aa" for r in results)
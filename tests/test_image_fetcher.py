@@ -0,0 +1,89 @@
+import functools
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from image_fetcher import FetchError, ImageFetcher, ImageTooLarge
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+
+from stub_image_server import StubHandler
+
+BODY = bytes(range(256)) * 64  # 16 KiB
+
+
+class StreamingStubHandler(StubHandler):
+    # /stream/<name> sends the file without Content-Length, so only the
+    # streamed byte count can enforce the cap
+    def do_GET(self):
+        if not self.path.startswith("/stream/"):
+            return super().do_GET()
+        with open(self.translate_path(self.path[len("/stream"):]), "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for start in range(0, len(body), 4096):
+            self.wfile.write(body[start:start + 4096])
+        self.close_connection = True
+
+
+@pytest.fixture
+def stub(tmp_path):
+    (tmp_path / "map.png").write_bytes(BODY)
+    handler = functools.partial(StreamingStubHandler, directory=str(tmp_path))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", tmp_path
+    server.shutdown()
+    server.server_close()
+
+
+def test_second_fetch_is_a_304_with_the_stored_body(stub):
+    base, _ = stub
+    fetcher = ImageFetcher()
+    first = fetcher.fetch(f"{base}/map.png")
+    second = fetcher.fetch(f"{base}/map.png")
+
+    assert (first.status_code, first.content, first.revalidated) == (200, BODY, False)
+    assert (second.status_code, second.content, second.revalidated) == (304, BODY, True)
+    assert second.etag == first.etag
+    status = fetcher.get_status()
+    assert (status["full"], status["not_modified"], status["bytes_received"]) == (1, 1, len(BODY))
+
+
+def test_changed_map_is_fetched_again(stub):
+    base, root = stub
+    fetcher = ImageFetcher()
+    first = fetcher.fetch(f"{base}/map.png")
+    (root / "map.png").write_bytes(BODY[::-1])
+    os.utime(root / "map.png", (1, 1))
+
+    assert not fetcher.revalidate(f"{base}/map.png", first.etag, first.last_modified)
+    second = fetcher.fetch(f"{base}/map.png")  # 304 against the body revalidate remembered
+    assert (second.status_code, second.content) == (304, BODY[::-1])
+
+
+def test_declared_size_over_the_cap_raises(stub):
+    base, _ = stub
+    with pytest.raises(ImageTooLarge):
+        ImageFetcher(max_bytes=len(BODY) - 1).fetch(f"{base}/map.png")
+
+
+def test_streamed_size_over_the_cap_raises_without_content_length(stub):
+    base, _ = stub
+    assert ImageFetcher().fetch(f"{base}/stream/map.png").content == BODY
+    fetcher = ImageFetcher(max_bytes=len(BODY) - 1)
+    with pytest.raises(ImageTooLarge):
+        fetcher.fetch(f"{base}/stream/map.png")
+    assert fetcher.get_status()["errors"] == 1
+
+
+def test_missing_map_raises_fetch_error(stub):
+    base, _ = stub
+    with pytest.raises(FetchError, match="404"):
+        ImageFetcher().fetch(f"{base}/missing.png")
@@ -0,0 +1,41 @@
+import math
+
+import numpy as np
+
+from map_analysis import COLOR_MAP
+from palette_classifier import PaletteClassifier, hex_to_rgb, rgb_to_hex
+
+
+def reference_closest_color(pixel):
+    # The original per-pixel loop closest_color replaced
+    closest_hex, closest_dist = None, float("inf")
+    for hex_code in COLOR_MAP.keys():
+        dist = math.dist(pixel[:3], hex_to_rgb(hex_code))
+        if dist < closest_dist:
+            closest_hex, closest_dist = hex_code, dist
+    return closest_hex if closest_dist < 20 else rgb_to_hex(pixel)
+
+
+def near_palette_pixels():
+    # Every pixel within a 21-step cube of each palette color: both sides of the
+    # distance-20 boundary and of every bin edge around it
+    offsets = np.stack(np.meshgrid(*[np.arange(-21, 22)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+    cubes = [np.clip(np.array(hex_to_rgb(h)) + offsets, 0, 255) for h in COLOR_MAP]
+    return np.concatenate(cubes).astype(np.uint8)
+
+
+def test_lut_matches_the_exact_search():
+    grid = np.stack(np.meshgrid(*[np.arange(0, 256, 3)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+    pixels = np.concatenate([grid.astype(np.uint8), near_palette_pixels()])
+    lut = PaletteClassifier(COLOR_MAP, max_distance=20)
+    exact = PaletteClassifier(COLOR_MAP, max_distance=20, lut_bits=0)
+    assert np.array_equal(lut.classify(pixels), exact.classify(pixels))
+
+
+def test_closest_hex_matches_the_original_closest_color():
+    rng = np.random.default_rng(0)
+    near = near_palette_pixels()
+    pixels = np.concatenate([near[rng.choice(len(near), 3000, replace=False)],
+                             rng.integers(0, 256, (1000, 3), dtype=np.uint8)])
+    expected = [reference_closest_color(tuple(int(v) for v in p)) for p in pixels]
+    assert PaletteClassifier(COLOR_MAP, max_distance=20).closest_hex(pixels) == expected
@@ -0,0 +1,63 @@
+import numpy as np
+
+from priority_cache_manager import PriorityCacheManager
+
+
+def blob(size):
+    return np.zeros(size, dtype=np.uint8)
+
+
+def test_least_recently_used_original_is_evicted_first():
+    cache = PriorityCacheManager(max_bytes=300)
+    for url in ("a", "b", "c"):
+        cache.store_original(url, blob(100))
+    cache.get_original("a")
+    cache.store_original("d", blob(100))
+
+    assert list(cache.original_cache) == ["c", "a", "d"]
+    status = cache.get_cache_status()
+    assert status["current_bytes"] == 300
+    assert (status["evictions"], status["evicted_bytes"]) == (1, 100)
+
+
+def test_scaled_entries_go_before_originals():
+    cache = PriorityCacheManager(max_bytes=250)
+    cache.store_original("a", blob(100))
+    cache.store_scaled("a", 0.5, blob(50))
+    cache.store_original("b", blob(100))
+    cache.store_original("c", blob(50))
+
+    assert list(cache.original_cache) == ["a", "b", "c"]
+    assert cache.get_scaled("a", 0.5) is None
+    assert cache.current_bytes == 250
+
+
+def test_active_batch_maps_outlive_inactive_ones():
+    cache = PriorityCacheManager(max_bytes=200)
+    active = "http://maps.test/m.png?batch=1&type=ER"
+    cache.store_original(active, blob(100))
+    cache.store_original("inactive", blob(100))  # more recent than the active map
+    cache.store_original("new", blob(100))
+
+    assert list(cache.original_cache) == [active, "new"]
+
+
+def test_oversized_entry_is_rejected_without_evicting():
+    cache = PriorityCacheManager(max_bytes=100)
+    cache.store_original("a", blob(60))
+    cache.store_original("huge", blob(101))
+
+    assert list(cache.original_cache) == ["a"]
+    status = cache.get_cache_status()
+    assert (status["rejected"], status["evictions"], status["current_bytes"]) == (1, 0, 60)
+
+
+def test_evict_url_releases_every_tier_of_a_map():
+    cache = PriorityCacheManager(max_bytes=1000)
+    cache.store_original("a", blob(100))
+    cache.store_scaled("a", 0.5, blob(25))
+    cache.store_scaled("a", 0.25, blob(50))
+    cache.evict_url("a")
+
+    assert cache.current_bytes == 0
+    assert not cache.scaled_cache and not cache.scaled_keys_by_url and not cache.entry_sizes
@@ -0,0 +1,91 @@
+import pytest
+from PIL import Image
+
+import app
+import map_analysis
+from crop_artifacts import CropArtifactStore, CropOutput
+from result_cache import ResultCache
+
+
+class Bank:
+    version = "v1"
+    shortlist = False
+
+    def prefilter(self, top_k, margin=0.0):
+        return type("Prefilter", (), {"active": self.shortlist and top_k > 0})()
+
+
+class Map:
+    content_hash = "c0ffee"
+    source_url = "http://maps.test/a.png?type=ER"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    bank = Bank()
+    monkeypatch.setattr(app, "result_cache", ResultCache())
+    monkeypatch.setattr(app, "bank_for", lambda img: bank)
+    computed = []
+
+    def lookup(img=None, templates=True, validate=None, result=None):
+        def compute():
+            computed.append(1)
+            return result if result is not None else {"n": len(computed)}
+        return app.cached_result("endpoint", img or Map(), {"categories": ["decision"]}, compute, validate, templates)
+
+    lookup.bank = bank
+    lookup.computed = computed
+    return lookup
+
+
+def test_same_map_and_params_hit(cache):
+    assert cache() == cache() == {"n": 1}
+
+
+def test_bank_version_joins_the_key_of_template_results(cache):
+    cache()
+    cache.bank.version = "v2"
+    assert cache() == {"n": 2}
+    assert cache(templates=False) == {"n": 3}
+    cache.bank.version = "v3"
+    assert cache(templates=False) == {"n": 3}  # probe-only results ignore the bank
+
+
+def test_active_prefilter_joins_the_key(cache, monkeypatch):
+    cache()
+    monkeypatch.setattr(app, "PREFILTER_TOP_K", 8)
+    assert cache() == {"n": 1}  # a shortlist the bank does not apply changes nothing
+    cache.bank.shortlist = True
+    assert cache() == {"n": 2}
+    monkeypatch.setattr(app, "PREFILTER_MARGIN", 0.05)
+    assert cache() == {"n": 3}
+
+
+def test_ssim_resolution_joins_the_key(cache, monkeypatch):
+    cache()
+    monkeypatch.setattr(app, "SSIM_RESOLUTION", "native")
+    assert cache() == {"n": 2}
+
+
+def test_reduced_decode_joins_the_key(cache):
+    cache()
+    draft = Map()
+    draft.reduced = 2.0
+    assert cache(draft) == {"n": 2}
+    assert cache(draft) == {"n": 2}
+
+
+def test_entries_with_expired_crops_are_recomputed(cache, monkeypatch):
+    store = CropArtifactStore(max_bytes=100)  # room for one 8x8 PNG
+    monkeypatch.setattr(map_analysis, "crop_store", store)
+    red = store.render(Image.new("RGB", (8, 8), "red"), CropOutput(inline=False))
+    result = {"icons": [{"left": red}]}
+
+    assert cache(validate=map_analysis.crops_available, result=result) is result
+    assert cache(validate=map_analysis.crops_available, result=result) is result
+    assert len(cache.computed) == 1
+
+    store.render(Image.new("RGB", (8, 8), "blue"), CropOutput(inline=False))  # evicts the red crop
+    assert not store.contains(red["crop_id"])
+    cache(validate=map_analysis.crops_available, result=result)
+    assert len(cache.computed) == 2
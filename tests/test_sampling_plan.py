@@ -0,0 +1,49 @@
+import numpy as np
+from PIL import Image
+
+from sampling_plan import array_backed_image, compile_island_plan, freeze_centers
+
+
+COMBAT = ((10, 10, 20, 20), (30, 30, 40, 40), (50, 50, 60, 60))
+
+
+def test_freeze_centers_keeps_valid_entries():
+    assert freeze_centers([{"bgX": 1.5, "bgY": 2}, {"bgX": 3, "bgY": 4.0}]) == ((1.5, 2), (3, 4.0))
+
+
+def test_freeze_centers_marks_malformed_entries():
+    centers = [{"bgX": 1}, {"bgX": "12", "bgY": 3}, None, {"bgX": float("nan"), "bgY": 1}, {"bgX": 5, "bgY": 6}]
+    assert freeze_centers(centers) == (None, None, None, None, (5, 6))
+
+
+def test_malformed_center_probes_are_invalid():
+    plan = compile_island_plan(100, 100, 1.0, ((5, 5), None, (7, 7)), COMBAT)
+    valid = plan.valid[plan.group("island")] & plan.valid[plan.group("boss")] & plan.valid[plan.group("minion")]
+    assert valid.tolist() == [True, False, True]
+
+
+def test_gather_reads_scaled_probe_points():
+    pixels = np.zeros((100, 100, 4), dtype=np.uint8)
+    pixels[2, 3] = (1, 2, 3, 255)
+    plan = compile_island_plan(100, 100, 0.5, ((6, 4),), COMBAT)
+    rgb = plan.gather(array_backed_image(pixels, "RGBA"))
+    assert rgb[0].tolist() == [1, 2, 3]
+
+
+def test_classify_islands_voids_only_the_malformed_island():
+    import map_analysis
+
+    image = Image.new("RGBA", (map_analysis.REFERENCE_IMAGE_SIZE, map_analysis.REFERENCE_IMAGE_SIZE), map_analysis.MONSTER_HEX)
+    for center in map_analysis.islandCenters:
+        x, y = int(center["bgX"]), int(center["bgY"])
+        image.paste("#6D6DE5", (x - 5, y - 5, x + 5, y + 5))  # every island a shop
+    img = array_backed_image(np.array(image), "RGBA")
+    centers = [dict(c) for c in map_analysis.islandCenters]
+    del centers[3]["bgY"]
+    centers[4]["bgX"] = "oops"
+
+    results = map_analysis.classify_islands(img, centers)
+    assert len(results) == 25
+    assert results[3] == {"index": 4, "island_type": "Void", "category": "Void"}
+    assert results[4] == {"index": 5, "island_type": "Void", "category": "Void"}
+    assert all(r["category"] == "shop" for i, r in enumerate(results) if i not in (3, 4))
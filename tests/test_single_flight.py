@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class MapGone(Exception):
+    pass
+
+
+def gone():
+    raise MapGone("404")
+
+
+def start_waiters(flight, key, fn, count):
+    outcomes = []
+    threads = [threading.Thread(target=lambda: outcomes.append(call(flight, key, fn))) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def call(flight, key, fn):
+    try:
+        return flight.do(key, fn)
+    except Exception as e:
+        return e
+
+
+def test_waiters_share_the_leaders_error():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        release.wait(5)
+        gone()
+
+    threads, outcomes = start_waiters(flight, "url", fail, 4)
+    deadline = time.monotonic() + 5
+    while flight.get_status()["shared"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(outcomes) == 4 and all(isinstance(o, MapGone) for o in outcomes)
+    assert flight.get_status() == {"executed": 1, "shared": 3, "failed": 1, "in_flight": 0}
+
+
+def test_a_failure_is_not_cached():
+    flight = SingleFlight("test")
+    with pytest.raises(MapGone):
+        flight.do("url", gone)
+    assert flight.do("url", lambda: "decoded") == "decoded"
+    assert flight.get_status()["executed"] == 2
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight("test")
+    assert [flight.do(key, lambda key=key: key.upper()) for key in ("a", "b")] == ["A", "B"]
+    assert flight.get_status()["shared"] == 0
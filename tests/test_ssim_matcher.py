@@ -0,0 +1,29 @@
+import numpy as np
+from skimage.metrics import structural_similarity
+
+from map_analysis import template_banks
+from ssim_matcher import SSIM_TOLERANCE, BatchedSSIMMatcher
+
+
+def test_scores_match_skimage_within_tolerance():
+    matcher = template_banks["ER"].matcher
+    templates = matcher.templates.astype(np.uint8)
+    rng = np.random.default_rng(0)
+    noisy = np.clip(templates[:3].astype(int) + rng.integers(-40, 41, templates[:3].shape), 0, 255).astype(np.uint8)
+    crops = np.concatenate([templates[:2], noisy, rng.integers(0, 256, (2,) + matcher.shape, dtype=np.uint8),
+                            np.full((1,) + matcher.shape, 128, dtype=np.uint8)])
+
+    scores = matcher.score_stack(crops)
+    expected = np.array([[structural_similarity(crop, template, data_range=255) for template in templates]
+                         for crop in crops])
+    assert np.abs(scores - expected).max() <= SSIM_TOLERANCE
+
+
+def test_standalone_matcher_matches_skimage_across_chunks():
+    rng = np.random.default_rng(1)
+    templates = {f"t{i}": rng.integers(0, 256, (20, 24), dtype=np.uint8) for i in range(3)}
+    crops = rng.integers(0, 256, (11, 20, 24), dtype=np.uint8)  # more than one chunk of 8
+    scores = BatchedSSIMMatcher(templates).score_stack(crops)
+    expected = np.array([[structural_similarity(crop, templates[name], data_range=255) for name in sorted(templates)]
+                         for crop in crops])
+    assert np.abs(scores - expected).max() <= SSIM_TOLERANCE
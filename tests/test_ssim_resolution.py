@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+
+import map_analysis
+from sampling_plan import array_backed_image
+from synthetic_maps import render_map
+
+
+def shifted_labels(width, resolution):
+    image, truth = render_map(width)
+    img = array_backed_image(np.array(image.convert("RGBA")), "RGBA")
+    img.source_url = "http://maps.test/map.png?type=ER"
+    labels = []
+    for index, row in enumerate(truth["icons"]):
+        point = map_analysis.icon_points[index]
+        for side in ("left", "right"):
+            if row[side]:
+                x, y = point[f"{side}X"], point[f"{side}Y"]
+                labels.append(map_analysis.best_shifted_match(x, y, img, top_k=0, resolution=resolution)["label"])
+    return labels
+
+
+@pytest.mark.parametrize("width", [2810, 1405])
+def test_native_resolution_gives_the_template_resolution_labels(width):
+    # The calibrated sizes: scoring crops at native size against the template
+    # pyramid must not change a single label
+    assert shifted_labels(width, "native") == shifted_labels(width, "template")
+
+
+def test_pyramid_level_at_template_size_is_the_compiled_bank():
+    bank = map_analysis.template_banks["ER"]
+    templates, mask = bank.level(bank.size)
+    matcher = bank.matcher
+    assert np.array_equal(np.stack([templates[n] for n in matcher.names]), matcher.templates.astype(np.uint8))
+    assert np.array_equal(mask > 0, matcher.window_mask > 0)
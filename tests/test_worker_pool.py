@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from worker_pool import Overloaded, PriorityExecutor
+
+
+def blocker(pool, lane):
+    # Occupies one worker until the returned event is set
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    future = pool.submit(lane, hold)
+    assert started.wait(5)
+    return release, future
+
+
+def test_point_lane_is_served_before_queued_bulk_work():
+    pool = PriorityExecutor(workers=1, reserved=0)
+    release, _ = blocker(pool, "bulk")
+    order = []
+    futures = [pool.submit("bulk", order.append, "bulk-1"), pool.submit("bulk", order.append, "bulk-2"),
+               pool.submit("point", order.append, "point")]
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ["point", "bulk-1", "bulk-2"]
+
+
+def test_reserved_worker_only_serves_the_point_lane():
+    pool = PriorityExecutor(workers=2, reserved=1)
+    release, _ = blocker(pool, "bulk")
+    second_bulk = pool.submit("bulk", lambda: "bulk")
+    assert pool.submit("point", lambda: "point").result(5) == "point"
+    assert not second_bulk.done()  # the idle worker is reserved for point queries
+    release.set()
+    assert second_bulk.result(5) == "bulk"
+
+
+def test_fan_out_from_inside_a_worker_runs_inline():
+    pool = PriorityExecutor(workers=1, reserved=0)
+
+    def fan_out():
+        futures = pool.submit_many("bulk", [(lambda i: (i, threading.current_thread()), (i,)) for i in range(3)])
+        return [f.result() for f in futures], threading.current_thread()
+
+    results, worker = pool.run("bulk", fan_out)  # would deadlock if queued behind itself
+    assert [i for i, _ in results] == [0, 1, 2]
+    assert all(thread is worker for _, thread in results)
+
+
+def test_full_lane_rejects_all_or_nothing():
+    pool = PriorityExecutor(workers=1, reserved=0, lane_limits={"point": 5, "bulk": 10})
+    release, _ = blocker(pool, "bulk")
+    with pytest.raises(Overloaded) as raised:
+        pool.submit_many("bulk", [(lambda: None, ())] * 11)
+    assert raised.value.lane == "bulk" and raised.value.retry_after >= 1
+    status = pool.get_status()["lanes"]["bulk"]
+    assert (status["queue_depth"], status["rejected"]) == (0, 1)
+    release.set()
+
+
+def test_overloaded_bulk_lane_answers_429_with_retry_after(monkeypatch):
+    import app
+
+    pool = PriorityExecutor(workers=1, reserved=0, lane_limits={"point": 5, "bulk": 10})
+    monkeypatch.setattr(app, "worker_pool", pool)
+    monkeypatch.setattr(app, "download_image", lambda *a, **kw: pytest.fail("admission must come first"))
+    response = app.app.test_client().post("/crop_all_decision_icons", json={
+        "image_url": "http://maps.test/a.png", "categories": ["decision"] * 25
+    })
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.get_json()["retry_after"] == int(response.headers["Retry-After"])
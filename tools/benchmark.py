@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmarks every stage and endpoint on generated maps served by the local stub,
+# and checks the answers against the generator's ground truth:
+#
+#   python tools/benchmark.py --widths 2810,1405 --reps 5 [--json out.json]
+#
+# Runs in-process against the Flask app. The result cache is disabled unless
+# --result-cache is given, so repeated reps measure the real work. Compare the
+# JSON output of two commits to see whether a change helped.
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Per-stage and per-endpoint benchmark with correctness checks.")
+    parser.add_argument("--widths", default="2810,1405,1000")
+    parser.add_argument("--type", default="ER")
+    parser.add_argument("--reps", type=int, default=5)
+    parser.add_argument("--maps", default=None, help="directory for generated maps (default: a temp dir)")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub server delay per request, seconds")
+    parser.add_argument("--search", default=None, help="shift search mode (grid / correlation)")
+    parser.add_argument("--prefilter-k", default="4,6,8",
+                        help="template shortlist sizes to compare against full SSIM (comma separated)")
+    parser.add_argument("--result-cache", action="store_true", help="leave the result cache on")
+    parser.add_argument("--json", default=None, help="write the full report here")
+    return parser.parse_args()
+
+
+args = parse_args()
+if not args.result_cache:
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"  # nothing fits, so nothing is stored
+os.environ.setdefault("MAP_STORE_DIR", tempfile.mkdtemp(prefix="bench_store_"))
+os.environ["WARMUP"] = "blocking"  # measure steady state, not first-use loading
+if args.search:
+    os.environ["SHIFT_SEARCH_MODE"] = args.search
+
+import app
+import map_analysis as service
+from crop_artifacts import CropEncoding
+from stub_image_server import StubHandler
+from synthetic_maps import write_maps
+
+
+def timed(fn, reps):
+    times = []
+    result = None
+    for _ in range(reps):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return times, result
+
+
+def summary(times):
+    ordered = sorted(times)
+    return {
+        "n": len(times),
+        "mean_ms": round(1000 * statistics.mean(times), 2),
+        "p50_ms": round(1000 * ordered[len(ordered) // 2], 2),
+        "p95_ms": round(1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 2),
+        "min_ms": round(1000 * ordered[0], 2)
+    }
+
+
+def start_stub(directory, latency):
+    StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), lambda *a, **kw: StubHandler(*a, directory=directory, **kw))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench_stages(url, truth, reps):
+    stages = {}
+    fetch_times, fetched = timed(lambda: service.image_fetcher.fetch(url), reps)
+    stages["fetch"] = summary(fetch_times)
+    decode_times, img = timed(lambda: service.decode_and_store(url, fetched.content), reps)
+    stages["decode"] = summary(decode_times)
+
+    stages["classify_islands"] = summary(timed(lambda: service.classify_islands(img), reps)[0])
+    stages["check_arrows"] = summary(timed(lambda: service.check_arrows(img), reps)[0])
+
+    scale = service.get_image_scale(img)
+    radius = service.scaled_radius(service.DIAMOND_RADIUS, scale)
+    index = next(i for i, row in enumerate(truth["icons"]) if row["left"])
+    point = service.icon_points[index]
+    x, y = int(point["leftX"] * scale), int(point["leftY"] * scale)
+    crop_times, crop = timed(lambda: service.crop_diamond_at(img, x, y, radius), reps)
+    stages["crop"] = summary(crop_times)
+    pre_times, pre = timed(lambda: service.preprocess_crop(crop), reps)
+    stages["preprocess"] = summary(pre_times)
+
+    import numpy as np
+    matcher = service.bank_for(img).matcher
+    stack = np.stack([np.array(pre)] * 25)
+    stages["ssim_25_crops"] = summary(timed(lambda: matcher.score_stack(stack), reps)[0])
+    stages["shifted_match"] = summary(timed(lambda: service.best_shifted_match(point["leftX"], point["leftY"], img), reps)[0])
+    stages["encode_png"] = summary(timed(lambda: CropEncoding("png").encode(crop), reps)[0])
+    return stages, img
+
+
+def bench_prefilter(img, truth, reps, ks):
+    # Every decision icon matched with full SSIM (top_k=0) and with each
+    # shortlist size. A miss is an icon whose best full-SSIM template was not
+    # shortlisted (the best score changed); label changes are the visible part.
+    icons = [(service.icon_points[i], side) for i, row in enumerate(truth["icons"])
+             for side in ("left", "right") if row[side]]
+    totals = {k: 0.0 for k in [0] + ks}
+    misses = {k: 0 for k in ks}
+    label_changes = {k: 0 for k in ks}
+    for point, side in icons:
+        x, y = point[f"{side}X"], point[f"{side}Y"]
+        times, full = timed(lambda: service.best_shifted_match(x, y, img, top_k=0), reps)
+        totals[0] += sum(times)
+        for k in ks:
+            times, fast = timed(lambda: service.best_shifted_match(x, y, img, top_k=k), reps)
+            totals[k] += sum(times)
+            misses[k] += abs(fast["score"] - full["score"]) > 1e-9
+            label_changes[k] += fast["label"] != full["label"]
+
+    n = max(len(icons) * reps, 1)
+    report = {"icons": len(icons), "full_ms_per_icon": round(1000 * totals[0] / n, 2), "k": {}}
+    for k in ks:
+        report["k"][k] = {
+            "ms_per_icon": round(1000 * totals[k] / n, 2),
+            "speedup": round(totals[0] / totals[k], 2) if totals[k] else None,
+            "miss_rate": round(misses[k] / max(len(icons), 1), 4),
+            "label_changes": label_changes[k]
+        }
+    return report
+
+
+def bench_resolution(img, truth, reps):
+    # Crops resized to the 118 px templates vs crops scored at native size
+    # against the template pyramid: agreement between the two, accuracy of each
+    # against the generator's truth, and time per icon.
+    icons = [(service.icon_points[i], side, row[side]["label"]) for i, row in enumerate(truth["icons"])
+             for side in ("left", "right") if row[side]]
+    modes = ("template", "native")
+    totals = {mode: 0.0 for mode in modes}
+    correct = {mode: 0 for mode in modes}
+    agree = 0
+    disagreements = []
+    for point, side, want in icons:
+        x, y = point[f"{side}X"], point[f"{side}Y"]
+        labels = {}
+        for mode in modes:
+            times, result = timed(lambda: service.best_shifted_match(x, y, img, resolution=mode), reps)
+            totals[mode] += sum(times)
+            labels[mode] = result["label"]
+            correct[mode] += result["label"] == want
+        agree += labels["template"] == labels["native"]
+        if labels["template"] != labels["native"]:
+            disagreements.append({"want": want, **labels})
+
+    n = max(len(icons) * reps, 1)
+    return {
+        "icons": len(icons),
+        "agreement": f"{agree}/{len(icons)}",
+        "correct": {mode: f"{correct[mode]}/{len(icons)}" for mode in modes},
+        "ms_per_icon": {mode: round(1000 * totals[mode] / n, 2) for mode in modes},
+        "disagreements": disagreements
+    }
+
+
+def bench_endpoints(client, url, truth, reps):
+    categories = [island["category"] for island in truth["islands"]]
+    first = next(i for i, row in enumerate(truth["icons"]) if row["left"])
+    point = service.icon_points[first]
+    calls = {
+        "extract_color": lambda: client.get("/extract_color", query_string={"image_url": url, "x": 1404, "y": 343}),
+        "check_minion": lambda: client.get("/check_minion", query_string={"image_url": url, "x": 1140, "y": 758}),
+        "extract_all_categories": lambda: client.post("/extract_all_categories", json={"image_url": url}),
+        "arrow_check_bulk": lambda: client.post("/arrow_check_bulk", json={"image_url": url}),
+        "crop_all_decision_icons": lambda: client.post("/crop_all_decision_icons", json={"image_url": url, "categories": categories}),
+        "debug_decision_icon_labels": lambda: client.post("/debug_decision_icon_labels", json={"image_url": url, "categories": categories}),
+        "debug_icon_at_point": lambda: client.post("/debug_icon_at_point", json={"image_url": url, "x": point["leftX"], "y": point["leftY"]}),
+        "analyze_map": lambda: client.post("/analyze_map", json={"image_url": url}),
+    }
+    endpoints = {}
+    responses = {}
+    for name, call in calls.items():
+        times, response = timed(call, reps)
+        endpoints[name] = summary(times)
+        responses[name] = response.get_json()
+    return endpoints, responses
+
+
+def check(truth, responses):
+    islands = responses["extract_all_categories"]["island_data"]
+    island_ok = sum(got["category"] == want["category"] and got["island_type"] == want["island_type"]
+                    for got, want in zip(islands, truth["islands"]))
+
+    arrows = responses["arrow_check_bulk"]
+    arrow_total = arrow_ok = 0
+    for group in ("A", "D"):
+        for got, want in zip(arrows[group], truth["arrows"][group]):
+            for g, w in zip(got, want):
+                arrow_total += 1
+                arrow_ok += g == w
+
+    icons = responses["crop_all_decision_icons"]["icons"]
+    debug = responses["debug_decision_icon_labels"]
+    icon_total = label_ok = offset_ok = 0
+    misses = []
+    for index, (row, got, dbg) in enumerate(zip(truth["icons"], icons, debug)):
+        for side in ("left", "right"):
+            want = row[side]
+            if not want:
+                continue
+            icon_total += 1
+            label_ok += got[side]["label"] == want["label"]
+            offset_ok += dbg.get(f"{side}_offset") == want["offset"]
+            if got[side]["label"] != want["label"]:
+                misses.append({"island": index + 1, "side": side, "want": want["label"], "got": got[side]["label"]})
+
+    return {
+        "islands": f"{island_ok}/{len(truth['islands'])}",
+        "arrows": f"{arrow_ok}/{arrow_total}",
+        "icon_labels": f"{label_ok}/{icon_total}",
+        "icon_offsets": f"{offset_ok}/{icon_total}",
+        "icon_misses": misses,
+        "analyze_map_consistent": responses["analyze_map"]["island_data"] == islands
+                                  and responses["analyze_map"]["arrows"] == arrows
+    }
+
+
+def print_table(title, rows):
+    print(f"  {title}")
+    for name, row in rows.items():
+        print(f"    {name:<28} mean={row['mean_ms']:>9}ms  p50={row['p50_ms']:>9}ms  p95={row['p95_ms']:>9}ms")
+
+
+def main():
+    widths = [int(w) for w in args.widths.split(",") if w.strip()]
+    prefilter_ks = [int(k) for k in args.prefilter_k.split(",") if k.strip()]
+    maps_dir = args.maps or tempfile.mkdtemp(prefix="bench_maps_")
+    generated = write_maps(maps_dir, widths, args.type)
+    server, base = start_stub(maps_dir, args.latency)
+    client = app.app.test_client()
+
+    report = {"search": service.SHIFT_SEARCH_MODE, "prefilter_top_k": service.PREFILTER_TOP_K,
+              "resolution": service.SSIM_RESOLUTION, "type": args.type, "reps": args.reps, "maps": {}}
+    try:
+        for width, _, truth in generated:
+            url = f"{base}/map{width}.png?type={args.type}"
+            stages, img = bench_stages(url, truth, args.reps)
+            prefilter = bench_prefilter(img, truth, args.reps, prefilter_ks)
+            resolution = bench_resolution(img, truth, args.reps)
+            endpoints, responses = bench_endpoints(client, url, truth, args.reps)
+            correctness = check(truth, responses)
+            report["maps"][width] = {"stages": stages, "endpoints": endpoints, "correctness": correctness,
+                                     "prefilter": prefilter, "resolution": resolution}
+
+            print(f"map {width}px")
+            print_table("stages", stages)
+            print_table("endpoints", endpoints)
+            print(f"  correctness: islands {correctness['islands']}, arrows {correctness['arrows']}, "
+                  f"icon labels {correctness['icon_labels']}, icon offsets {correctness['icon_offsets']}")
+            for miss in correctness["icon_misses"]:
+                print(f"    miss: island {miss['island']} {miss['side']}: want {miss['want']}, got {miss['got']}")
+            print(f"  prefilter ({prefilter['icons']} icons, full SSIM {prefilter['full_ms_per_icon']} ms/icon)")
+            for k, row in prefilter["k"].items():
+                print(f"    top_k={k:<3} {row['ms_per_icon']:>8} ms/icon  speedup x{row['speedup']}  "
+                      f"miss rate {row['miss_rate']}  label changes {row['label_changes']}")
+            print(f"  ssim resolution: template vs native agree {resolution['agreement']}, correct "
+                  f"{resolution['correct']['template']} vs {resolution['correct']['native']}, ms/icon "
+                  f"{resolution['ms_per_icon']['template']} vs {resolution['ms_per_icon']['native']}")
+            for row in resolution["disagreements"]:
+                print(f"    want {row['want']}: template {row['template']}, native {row['native']}")
+    finally:
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report -> {args.json}")
+
+
+if __name__ == "__main__":
+    main()
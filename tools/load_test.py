@@ -0,0 +1,104 @@
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Fires concurrent requests at a running instance (Flask or ASGI mode) and
+# reports throughput and latency percentiles per endpoint. Point the maps at
+# tools/stub_image_server.py to control download latency:
+#
+#   python tools/load_test.py --base http://127.0.0.1:5000 \
+#       --map http://127.0.0.1:8765/map2810.png --map http://127.0.0.1:8765/map1405.png \
+#       --concurrency 32 --requests 200 --endpoints extract_color,arrow_check_bulk
+
+ENDPOINTS = {
+    "extract_color": lambda url: ("GET", "/extract_color", {"image_url": url, "x": 1404, "y": 343}),
+    "check_minion": lambda url: ("GET", "/check_minion", {"image_url": url, "x": 1140, "y": 758}),
+    "extract_all_categories": lambda url: ("POST", "/extract_all_categories", {"image_url": url}),
+    "arrow_check_bulk": lambda url: ("POST", "/arrow_check_bulk", {"image_url": url}),
+    "crop_all_decision_icons": lambda url: ("POST", "/crop_all_decision_icons", {"image_url": url}),
+    "analyze_map": lambda url: ("POST", "/analyze_map", {"image_url": url}),
+}
+
+_local = threading.local()
+
+
+def _session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def fire(base, endpoint, url):
+    method, path, params = ENDPOINTS[endpoint](url)
+    started = time.perf_counter()
+    try:
+        if method == "GET":
+            response = _session().get(base + path, params=params, timeout=300)
+        else:
+            response = _session().post(base + path, json=params, timeout=300)
+        status = response.status_code
+        if status == 200 and "error" in response.json():
+            status = "error"
+    except requests.RequestException as e:
+        status = type(e).__name__
+    return endpoint, status, time.perf_counter() - started
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the colour extraction service.")
+    parser.add_argument("--base", default="http://127.0.0.1:5000")
+    parser.add_argument("--map", action="append", required=True, help="map image URL (repeatable)")
+    parser.add_argument("--endpoints", default="extract_color,check_minion,arrow_check_bulk")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    jobs = [(endpoints[i % len(endpoints)], args.map[(i // len(endpoints)) % len(args.map)])
+            for i in range(args.requests)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda job: fire(args.base, *job), jobs))
+    elapsed = time.perf_counter() - started
+
+    summary = {"requests": len(results), "seconds": round(elapsed, 2),
+               "throughput_rps": round(len(results) / elapsed, 2), "endpoints": {}}
+    for endpoint in endpoints:
+        times = [t for e, _, t in results if e == endpoint]
+        statuses = {}
+        for e, status, _ in results:
+            if e == endpoint:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if times:
+            summary["endpoints"][endpoint] = {
+                "count": len(times),
+                "statuses": statuses,
+                "p50_ms": round(1000 * percentile(times, 50), 1),
+                "p95_ms": round(1000 * percentile(times, 95), 1),
+                "p99_ms": round(1000 * percentile(times, 99), 1),
+                "max_ms": round(1000 * max(times), 1)
+            }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"{summary['requests']} requests in {summary['seconds']}s ({summary['throughput_rps']} req/s)")
+    for endpoint, row in summary["endpoints"].items():
+        print(f"  {endpoint:<26} n={row['count']:<5} p50={row['p50_ms']}ms p95={row['p95_ms']}ms "
+              f"p99={row['p99_ms']}ms max={row['max_ms']}ms {row['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+# Cold-start numbers from fresh processes, so results are comparable between
+# commits and machines:
+#   import_s    `import app` alone (warm-up off)
+#   live_s      process spawn -> /healthz answers
+#   ready_s     process spawn -> /readyz answers 200
+#
+#   python tools/measure_startup.py --runs 5 [--asgi]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env):
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env={**env, "WARMUP": "off"},
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure_server(env, asgi=False, timeout=60):
+    port = free_port()
+    script = "asgi_app.py" if asgi else "app.py"
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script], cwd=ROOT, env={**env, "PORT": str(port)},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    live = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if live is None and _status(f"{base}/healthz") == 200:
+                live = time.perf_counter() - started
+            if live is not None and _status(f"{base}/readyz") == 200:
+                ready = time.perf_counter() - started
+                break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return live, ready
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"median": round(statistics.median(values), 3), "min": round(min(values), 3), "max": round(max(values), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time-to-ready.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--asgi", action="store_true", help="start asgi_app.py instead of app.py")
+    args = parser.parse_args()
+
+    # Fresh disk tier per run so earlier runs cannot help later ones
+    with tempfile.TemporaryDirectory() as store:
+        env = {**os.environ, "MAP_STORE_DIR": store, "PYTHONDONTWRITEBYTECODE": "1"}
+        imports, lives, readies = [], [], []
+        for _ in range(args.runs):
+            imports.append(measure_import(env))
+            live, ready = measure_server(env, asgi=args.asgi)
+            lives.append(live)
+            readies.append(ready)
+
+    print(json.dumps({
+        "mode": "asgi" if args.asgi else "flask",
+        "runs": args.runs,
+        "import_s": summarize(imports),
+        "live_s": summarize(lives),
+        "ready_s": summarize(readies)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
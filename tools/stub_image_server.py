@@ -0,0 +1,85 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for Cloudinary when load-testing either serving mode: serves a
+# directory of map images with ETag / Last-Modified (answering conditional
+# requests with 304) and an artificial per-request latency.
+#
+#   python tools/stub_image_server.py --dir maps --port 8765 --latency 0.5
+
+
+class StubHandler(SimpleHTTPRequestHandler):
+    latency = 0.0
+    etags = {}
+    etags_lock = threading.Lock()
+    served = {"200": 0, "304": 0, "404": 0}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _etag(self, path):
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with self.etags_lock:
+            etag = self.etags.get(key)
+            if etag is None:
+                with open(path, "rb") as f:
+                    etag = f'"{hashlib.sha1(f.read()).hexdigest()}"'
+                self.etags[key] = etag
+        return etag, formatdate(st.st_mtime, usegmt=True)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.served["404"] += 1
+            self.send_error(404)
+            return
+
+        etag, last_modified = self._etag(path)
+        if self.headers.get("If-None-Match") == etag:
+            self.served["304"] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        with open(path, "rb") as f:
+            body = f.read()
+        self.served["200"] += 1
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve map images like Cloudinary would, slowly.")
+    parser.add_argument("--dir", default=".", help="directory of map images")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    handler = lambda *a, **kw: StubHandler(*a, directory=args.dir, **kw)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    print(f"Serving {os.path.abspath(args.dir)} on http://127.0.0.1:{args.port} (latency {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served: {StubHandler.served}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import map_analysis as service  # layout tables and palette come from the service itself
+
+# Renders maps with a known answer for every probe the service makes:
+#   - islands filled with palette colours at islandCenters,
+#   - a boss (#E58F16) or minion marker at each island's combatTypePoints entry,
+#   - arrow pixels at a random half of arrowPointsA / arrowPointsD,
+#   - icons from iconsER (or iconsNR) pasted at icon_points with a random
+#     offset of up to +/-2 px, on every decision island.
+# Coordinates are scaled to the requested width exactly as the service scales
+# them, so the ground truth holds at any width.
+#
+#   python tools/synthetic_maps.py --out maps --widths 2810,1405,1000
+#
+# writes maps/map<width>.png and maps/truth<width>.json.
+
+BACKGROUND = service.MONSTER_HEX
+MINION_MARKER = "#C80A0A"
+ARROW_COLOR = "#FFFFFF"
+ISLAND_TYPES = ["easy", "medium", "hard", "portal", "arrival", "bronze door", "silver door",
+                "gold door", "shop", "time lock"]
+HEX_BY_TYPE = {v: k for k, v in service.COLOR_MAP.items()}
+MAX_OFFSET = service.SHIFT_RADIUS
+
+
+def _rgb(hex_color):
+    return service.hex_to_rgb(hex_color)
+
+
+def render_map(width, map_type="ER", seed=None, decision_every=3):
+    rng = random.Random(width if seed is None else seed)
+    scale = width / service.REFERENCE_IMAGE_SIZE
+    image = Image.new("RGB", (width, width), _rgb(BACKGROUND))
+    draw = ImageDraw.Draw(image)
+    icon_dir = os.path.join(ROOT, service.template_banks[map_type].source_dir)
+    icons = sorted(glob.glob(os.path.join(icon_dir, "*.png")))
+
+    def at(v):
+        return int(v * scale)
+
+    truth = {"width": width, "type": map_type, "islands": [], "icons": [], "arrows": {}}
+    for i, center in enumerate(service.islandCenters):
+        island_type = "decision" if i % decision_every == 0 else rng.choice(ISLAND_TYPES)
+        cx, cy = at(center["bgX"]), at(center["bgY"])
+        draw.rectangle((cx - at(90), cy - at(40), cx + at(90), cy + at(40)), fill=_rgb(HEX_BY_TYPE[island_type]))
+
+        combat = "None"
+        if island_type in ("easy", "medium", "hard"):
+            combat = rng.choice(["boss", "minion", "None"])
+            points = service.combatTypePoints[i]
+            r = max(2, at(6))
+            if combat == "boss":
+                x, y = at(points["bossX"]), at(points["bossY"])
+                draw.ellipse((x - r, y - r, x + r, y + r), fill=_rgb(service.BOSS_HEX))
+            elif combat == "minion":
+                x, y = at(points["minionX"]), at(points["minionY"])
+                draw.ellipse((x - r, y - r, x + r, y + r), fill=_rgb(MINION_MARKER))
+        truth["islands"].append({
+            "index": i + 1,
+            "island_type": island_type,
+            "category": service.island_category(island_type, combat)
+        })
+
+        row = {"left": None, "right": None}
+        if island_type == "decision":
+            point = service.icon_points[i]
+            size = 2 * service.scaled_radius(service.DIAMOND_RADIUS, scale)
+            for side in ("left", "right"):
+                path = rng.choice(icons)
+                icon = Image.open(path).convert("RGBA").resize((size, size), Image.LANCZOS)
+                dx, dy = rng.randint(-MAX_OFFSET, MAX_OFFSET), rng.randint(-MAX_OFFSET, MAX_OFFSET)
+                x, y = at(point[f"{side}X"]) + dx - size // 2, at(point[f"{side}Y"]) + dy - size // 2
+                image.paste(icon, (x, y), icon)
+                row[side] = {"label": os.path.basename(path).split(".")[0], "offset": [dx, dy]}
+            # Shifted icons can touch the island's own probe point between them;
+            # keep it showing the island colour, as on real maps
+            r = max(1, at(3))
+            draw.rectangle((cx - r, cy - r, cx + r, cy + r), fill=_rgb(HEX_BY_TYPE[island_type]))
+        truth["icons"].append(row)
+
+    r = max(1, at(4))
+    for name, table in (("A", service.arrowPointsA), ("D", service.arrowPointsD)):
+        expected = []
+        for entry in table:
+            if entry == "x":
+                expected.append(["skip", "skip"])
+                continue
+            marks = []
+            for x, y in entry:
+                if rng.random() < 0.5:
+                    draw.rectangle((at(x) - r, at(y) - r, at(x) + r, at(y) + r), fill=_rgb(ARROW_COLOR))
+                    marks.append("arrow")
+                else:
+                    marks.append("no")
+            expected.append(marks)
+        truth["arrows"][name] = expected
+
+    return image, truth
+
+
+def write_maps(out_dir, widths, map_type="ER", seed=None):
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for width in widths:
+        image, truth = render_map(width, map_type, seed)
+        map_path = os.path.join(out_dir, f"map{width}.png")
+        image.save(map_path)
+        with open(os.path.join(out_dir, f"truth{width}.json"), "w") as f:
+            json.dump(truth, f)
+        written.append((width, map_path, truth))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render synthetic maps with ground truth.")
+    parser.add_argument("--out", default="synthetic_maps")
+    parser.add_argument("--widths", default="2810,1405,1000")
+    parser.add_argument("--type", default="ER", choices=sorted(service.template_banks))
+    parser.add_argument("--seed", type=int, default=None, help="default: the width, so every width is reproducible")
+    args = parser.parse_args()
+
+    widths = [int(w) for w in args.widths.split(",") if w.strip()]
+    for width, path, _ in write_maps(args.out, widths, args.type, args.seed):
+        print(f"{width}px -> {path}")
+
+
+if __name__ == "__main__":
+    main()
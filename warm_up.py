@@ -0,0 +1,66 @@
+import threading
+import time
+
+# Startup in two steps: importing the service is kept cheap (heavy modules and
+# tables load on first use), and a warm-up pass then loads them on purpose so
+# the first real request does not pay for it. /healthz answers as soon as the
+# process serves HTTP; /readyz only once warm-up has finished, which is what the
+# load balancer should route on.
+
+
+class WarmUp:
+    def __init__(self, stages):
+        # stages: list of (name, fn), run in order
+        self.stages = stages
+        self.timings = {}  # name: ms
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def run(self):
+        self.started_at = time.perf_counter()
+        for name, fn in self.stages:
+            stage_started = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                # A failed stage leaves the instance unready; the code path it
+                # primes still loads lazily if traffic arrives anyway
+                self.error = f"{name}: {e}"
+                print(f"[WARM UP] Stage {name} failed: {e}")
+                return
+            self.timings[name] = round(1000 * (time.perf_counter() - stage_started), 2)
+        self.finished_at = time.perf_counter()
+        self.ready.set()
+        print(f"[WARM UP] Ready in {round(1000 * (self.finished_at - self.started_at), 2)} ms: {self.timings}")
+
+    def start(self, mode="background"):
+        # mode: "background" (default), "blocking", or "off" (ready at once, lazy loading only)
+        with self.lock:
+            if self.thread is not None or self.ready.is_set():
+                return
+            if mode == "off":
+                self.ready.set()
+                return
+            if mode == "blocking":
+                self.thread = threading.current_thread()
+            else:
+                self.thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+                self.thread.start()
+                return
+        self.run()
+
+    def get_status(self):
+        total = None
+        if self.started_at is not None and self.finished_at is not None:
+            total = round(1000 * (self.finished_at - self.started_at), 2)
+        return {
+            "ready": self.ready.is_set(),
+            "stages": dict(self.timings),
+            "pending": [name for name, _ in self.stages if name not in self.timings] if not self.ready.is_set() else [],
+            "total_ms": total,
+            "error": self.error
+        }
@@ -0,0 +1,178 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from request_profiler import profiled
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+class Overloaded(Exception):
+    def __init__(self, lane, retry_after):
+        super().__init__(f"Server busy ({lane} queue full), retry in {retry_after}s.")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class _Task:
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        # Run with the submitter's context so request-scoped state (metric labels,
+        # an active profile) follows the work
+        self.context = contextvars.copy_context()
+
+
+class LaneStats:
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def as_dict(self, depth, limit):
+        done = max(self.completed, 1)
+        return {
+            "queue_depth": depth,
+            "queue_limit": limit,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(1000 * self.wait_total / done, 2),
+            "max_wait_ms": round(1000 * self.wait_max, 2),
+            "avg_run_ms": round(1000 * self.run_total / done, 2)
+        }
+
+
+class PriorityExecutor:
+    # One process-wide thread pool with a bounded queue per lane. Lanes are listed
+    # highest priority first: an idle worker always takes from the first non-empty
+    # lane, so cheap point queries never sit behind queued bulk matching. A full
+    # lane rejects new work with Overloaded (mapped to 429 + Retry-After) rather
+    # than letting requests pile up until they time out. `reserved` workers only
+    # ever serve the first lane, so point queries have a worker even while every
+    # other one is busy with a long bulk task.
+    def __init__(self, workers=DEFAULT_WORKERS, lane_limits=None, reserved=1):
+        self.workers = workers
+        self.reserved = min(reserved, max(workers - 1, 0))
+        self.lane_limits = lane_limits or {"point": 100, "bulk": 200}
+        self.lanes = {lane: deque() for lane in self.lane_limits}
+        self.stats = {lane: LaneStats() for lane in self.lane_limits}
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.threads = []
+        self.busy = 0
+        self.busy_low = 0  # workers running anything but the first lane
+
+    def _ensure_started(self):
+        if self.threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _next_task(self):
+        for position, (lane, queue) in enumerate(self.lanes.items()):
+            if not queue:
+                continue
+            if position > 0 and self.busy_low >= self.workers - self.reserved:
+                break
+            return lane, queue.popleft()
+        return None, None
+
+    def _worker(self):
+        self.local.in_worker = True
+        while True:
+            with self.condition:
+                lane, task = self._next_task()
+                while task is None:
+                    self.condition.wait()
+                    lane, task = self._next_task()
+                low = lane != next(iter(self.lanes))
+                self.busy += 1
+                self.busy_low += low
+
+            started = time.monotonic()
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.context.run(profiled, task.fn, *task.args, **task.kwargs))
+                except BaseException as e:
+                    task.future.set_exception(e)
+            finished = time.monotonic()
+
+            with self.condition:
+                self.busy -= 1
+                self.busy_low -= low
+                if low:
+                    self.condition.notify()  # a reserved-out low-lane task may now run
+                stats = self.stats[lane]
+                waited = started - task.enqueued_at
+                stats.completed += 1
+                stats.wait_total += waited
+                stats.wait_max = max(stats.wait_max, waited)
+                stats.run_total += finished - started
+
+    def retry_after(self, lane):
+        stats = self.stats[lane]
+        avg_run = stats.run_total / stats.completed if stats.completed else 1.0
+        backlog = sum(len(q) for q in self.lanes.values())
+        return max(1, math.ceil(backlog * avg_run / max(self.workers, 1)))
+
+    def admit(self, lane, needed=1):
+        # Cheap up-front check so a request can be turned away before it downloads
+        with self.condition:
+            if len(self.lanes[lane]) + needed > self.lane_limits[lane]:
+                self.stats[lane].rejected += 1
+                raise Overloaded(lane, self.retry_after(lane))
+
+    def submit_many(self, lane, calls):
+        # calls: list of (fn, args). All-or-nothing admission. From inside a worker
+        # the calls run inline so nested fan-out cannot deadlock the pool.
+        if getattr(self.local, "in_worker", False):
+            futures = []
+            for fn, args in calls:
+                future = Future()
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+                futures.append(future)
+            return futures
+
+        with self.condition:
+            self._ensure_started()
+            queue = self.lanes[lane]
+            if len(queue) + len(calls) > self.lane_limits[lane]:
+                self.stats[lane].rejected += 1
+                raise Overloaded(lane, self.retry_after(lane))
+            tasks = [_Task(fn, args, {}) for fn, args in calls]
+            queue.extend(tasks)
+            self.stats[lane].submitted += len(tasks)
+            self.condition.notify(len(tasks))
+        return [task.future for task in tasks]
+
+    def submit(self, lane, fn, *args):
+        return self.submit_many(lane, [(fn, args)])[0]
+
+    def run(self, lane, fn, *args):
+        return self.submit(lane, fn, *args).result()
+
+    def get_status(self):
+        with self.condition:
+            return {
+                "workers": self.workers,
+                "reserved": self.reserved,
+                "busy": self.busy,
+                "lanes": {lane: self.stats[lane].as_dict(len(queue), self.lane_limits[lane])
+                          for lane, queue in self.lanes.items()}
+            }